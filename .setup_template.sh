@@ -21,10 +21,58 @@ export CLIENT_SECRET=''
 export AUTHORIZE_URI='{0}/app/developers/#/oauth/authorize'
 export REDIRECT_URI='http://localhost:8000/main/callback/'
 export TOKEN_URI='{0}/api/oauth/token'
+export FYLE_CONNECTION_TTL=3300
+export FYLE_CONNECTION_CACHE_SIZE=256
+export FYLE_PROFILE_SESSION_TTL=300
 export FYLE_JOBS_URL=''
 export FYLE_JOBS_CALLBACK_URL='http://localhost:8000/fetcher/callback/'
+export BACKUP_QUEUE_ENABLED=True
+export BACKUP_WORKER_CONCURRENCY=4
+export BACKUP_WORKER_POLL_INTERVAL=5
+export BACKUP_JOB_HEARTBEAT_INTERVAL=60
+export BACKUP_JOB_STALE_AFTER=21600
+export BACKUP_JOB_MAX_ATTEMPTS=3
+export BACKUP_JOB_RETRY_BACKOFF=60
+export BACKUP_ORG_MAX_RUNNING=4
+export BACKUP_USER_MAX_RUNNING=2
+export BACKUP_FAIR_SHARE_WINDOW=3600
+export BACKUP_ORG_WEIGHTS=''
+export BACKUP_COALESCE_MAX_AGE=21600
+export BACKUP_SCHEDULE_WORKERS=8
+export BACKUP_ENGINE=threads
+export ASYNC_ENGINE_MAX_BACKUPS=32
+export ASYNC_ENGINE_WORKERS=32
+export ASYNC_ENGINE_UPLOAD_WORKERS=16
+export ASYNC_ENGINE_PAGE_QUEUE_SIZE=2
 
 export DOWNLOAD_PATH='/tmp/'
+export EXPENSES_PAGE_SIZE=300
+export EXPENSE_SHARD_WORKERS=4
+export EXPENSE_SHARD_WINDOW_DAYS=90
+# Attachment downloads use FYLE_ORG_ATTACHMENT_RATE_LIMIT instead of FYLE_ORG_API_RATE_LIMIT,
+# all calls count against FYLE_API_RATE_LIMIT: keep it at least the sum of the org rates
+export FYLE_API_RATE_LIMIT=25
+export FYLE_API_BURST=25
+export FYLE_ORG_API_RATE_LIMIT=5
+export FYLE_ORG_ATTACHMENT_RATE_LIMIT=20
+export FYLE_ORG_API_CONCURRENCY=8
+export FYLE_API_MAX_RETRIES=4
+export FYLE_API_RETRY_BACKOFF=1
+export HTTP_POOL_SIZE=10
+export HTTP_CONNECT_TIMEOUT=5
+export HTTP_READ_TIMEOUT=30
+export HTTP_MAX_RETRIES=3
+export HTTP_RETRY_BACKOFF=0.5
+export ATTACHMENT_DOWNLOAD_WORKERS=8
+export ATTACHMENT_DOWNLOAD_RETRIES=3
+export ATTACHMENT_RETRY_BACKOFF=1
+export BACKUP_ARCHIVE_MODE='directory'
+export BACKUP_ZIP_COMPRESSION_LEVEL=6
+export COLUMNAR_ROW_GROUP_SIZE=50000
+export PARQUET_COMPRESSION='snappy'
+export JSONL_GZIP_LEVEL=6
+export JSONL_ZSTD_LEVEL=3
+export ATTACHMENT_DEDUP_ENABLED=False
 export CLOUD_STORAGE_PROVIDER='awss3'
 
 # AWS settings
@@ -33,6 +81,11 @@ export AWS_SECRET_ACCESS_KEY=''
 export S3_BUCKET_NAME=''
 export S3_REGION_NAME=''
 export PRESIGNED_URL_EXPIRY=3600
+export S3_MAX_POOL_CONNECTIONS=20
+export S3_TRANSFER_MAX_CONCURRENCY=10
+export S3_MULTIPART_PART_SIZE=8388608
+export S3_MULTIPART_MAX_PENDING_PARTS=4
+export S3_MULTIPART_UPLOAD_WORKERS=4
 
 # Email settings
 export SENDGRID_API_KEY=''
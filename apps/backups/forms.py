@@ -1,13 +1,26 @@
 from django import forms
 from tempus_dominus.widgets import DatePicker
 
+from apps.data_fetcher.formats import is_columnar_available, is_zstd_available
+
 class ExpenseForm(forms.Form):
     """
     Expenses form
     """
     data_format_choices = [
-        ("CSV", "CSV")
+        ("CSV", "CSV"),
+        ("JSONL", "JSON Lines"),
+        ("JSONL_GZ", "JSON Lines (gzip)")
     ]
+    if is_zstd_available():
+        data_format_choices += [
+            ("JSONL_ZSTD", "JSON Lines (zstd)")
+        ]
+    if is_columnar_available():
+        data_format_choices += [
+            ("PARQUET", "Parquet"),
+            ("ARROW", "Arrow")
+        ]
     expense_state_choices = [
         ('FYLED', 'FYLED'),
         ('PAID', 'PAID'),
@@ -23,8 +36,7 @@ class ExpenseForm(forms.Form):
             'placeholder': 'Provide a name for this backup',
             'autocomplete': 'off'
         }))
-    data_format = forms.ChoiceField(widget=forms.HiddenInput(), choices=data_format_choices,
-                                    initial='CSV')
+    data_format = forms.ChoiceField(choices=data_format_choices, initial='CSV')
     object_type = forms.CharField(widget=forms.HiddenInput(), initial='expenses')
     state = forms.MultipleChoiceField(choices=expense_state_choices,
                                       required=False
@@ -55,3 +67,4 @@ class ExpenseForm(forms.Form):
         }
     ), required=False)
     download_attachments = forms.BooleanField(required=False)
+    incremental = forms.BooleanField(required=False)
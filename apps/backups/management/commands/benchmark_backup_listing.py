@@ -0,0 +1,79 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+
+from apps.backups.models import Backups, ObjectLookup
+from apps.backups.views import BackupsView
+from apps.user.models import UserProfile
+
+BENCHMARK_BATCH_ID = 'benchmark-backup-listing'
+
+
+class Command(BaseCommand):
+    """
+    Measure the backup listing query on a table with many backups
+    """
+    help = 'Benchmark query count and latency of the backup listing with seeded backups'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000000,
+                            help='Backups to seed, spread over the benchmark users')
+        parser.add_argument('--users', type=int, default=1000, help='Benchmark users to seed')
+        parser.add_argument('--iterations', type=int, default=200,
+                            help='Listing requests to time')
+        parser.add_argument('--batch-size', type=int, default=10000,
+                            help='Rows per insert while seeding')
+        parser.add_argument('--keep', action='store_true',
+                            help='Keep the seeded rows for the next run')
+
+    def seed(self, rows, user_count, batch_size):
+        """
+        Create the benchmark users and backups that are missing
+        """
+        emails = ['benchmark{0}@fyle-backup.test'.format(index) for index in range(user_count)]
+        existing = set(UserProfile.objects.filter(email__in=emails)
+                       .values_list('email', flat=True))
+        UserProfile.objects.bulk_create([UserProfile(email=email, name='Benchmark')
+                                         for email in emails if email not in existing])
+        user_ids = list(UserProfile.objects.filter(email__in=emails).values_list('id', flat=True))
+        seeded = Backups.objects.filter(batch_id=BENCHMARK_BATCH_ID).count()
+        for start in range(seeded, rows, batch_size):
+            Backups.objects.bulk_create([
+                Backups(name='benchmark', current_state='READY', filters='{}',
+                        object_type=ObjectLookup.expenses, data_format='CSV',
+                        fyle_org_id='orBenchmark', fyle_refresh_token='token',
+                        user_id=user_ids[index % len(user_ids)], batch_id=BENCHMARK_BATCH_ID)
+                for index in range(start, min(start + batch_size, rows))])
+            self.stdout.write('Seeded {0}/{1} backups'.format(min(start + batch_size, rows), rows))
+        return user_ids
+
+    def handle(self, *args, **options):
+        user_ids = self.seed(options['rows'], options['users'], options['batch_size'])
+        users = UserProfile.objects.filter(id__in=user_ids[:options['iterations']])
+        users = list(users) * (options['iterations'] // len(user_ids) + 1)
+        view = BackupsView()
+        request_factory = RequestFactory()
+
+        timings = []
+        with CaptureQueriesContext(connection) as queries:
+            for user in users[:options['iterations']]:
+                request = request_factory.get('/main/backups/')
+                request.user = user
+                start = time.perf_counter()
+                view.get(request, 'expenses')
+                timings.append(time.perf_counter() - start)
+        timings.sort()
+        self.stdout.write('queries per listing: {0}'.format(len(queries) / len(timings)))
+        self.stdout.write('p50: {0:.2f} ms  p95: {1:.2f} ms  max: {2:.2f} ms'.format(
+            statistics.median(timings) * 1000, timings[int(len(timings) * 0.95)] * 1000,
+            timings[-1] * 1000))
+        self.stdout.write(Backups.objects.filter(object_type=ObjectLookup.expenses,
+                                                 user_id=user_ids[0]).explain())
+
+        if not options['keep']:
+            Backups.objects.filter(batch_id=BENCHMARK_BATCH_ID).delete()
+            UserProfile.objects.filter(id__in=user_ids).delete()
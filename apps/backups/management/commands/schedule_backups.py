@@ -0,0 +1,64 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.backups.forms import ExpenseForm
+from apps.backups.utils import create_backups_in_batch, schedule_backups_in_batch
+from apps.user.models import UserProfile
+
+
+class Command(BaseCommand):
+    """
+    Create the same expenses backup for many users and schedule them at once
+    """
+    help = 'Schedule an expenses backup for the given users or for all users of an org'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--name', required=True, help='Name of the backups')
+        parser.add_argument('--emails', nargs='+', default=[],
+                            help='Emails of the users to back up')
+        parser.add_argument('--org', help='Back up all users connected to this Fyle org_id')
+        parser.add_argument('--state', nargs='+', default=[],
+                            help='Expense states to back up, all by default')
+        for field in ('approved_at_gte', 'approved_at_lte', 'updated_at_gte', 'updated_at_lte'):
+            parser.add_argument('--' + field.replace('_', '-'), dest=field,
+                                help='Date in YYYY-MM-DD format')
+        parser.add_argument('--data-format', default='CSV', help='Data format of the backups')
+        parser.add_argument('--download-attachments', action='store_true',
+                            help='Include expense attachments')
+        parser.add_argument('--incremental', action='store_true',
+                            help='Only back up changes since the last backup of each user')
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Jobs triggered at once, BACKUP_SCHEDULE_WORKERS by default')
+
+    def handle(self, *args, **options):
+        form = ExpenseForm({
+            'name': options['name'], 'object_type': 'expenses', 'state': options['state'],
+            'data_format': options['data_format'],
+            'download_attachments': options['download_attachments'],
+            'incremental': options['incremental'],
+            'approved_at_gte': options['approved_at_gte'],
+            'approved_at_lte': options['approved_at_lte'],
+            'updated_at_gte': options['updated_at_gte'],
+            'updated_at_lte': options['updated_at_lte']
+        })
+        if not form.is_valid():
+            raise CommandError(form.errors.as_text())
+        if not options['emails'] and not options['org']:
+            raise CommandError('Pass --emails or --org')
+
+        users = UserProfile.objects.filter(refresh_token__isnull=False,
+                                           fyle_org_id__isnull=False)
+        if options['emails']:
+            users = users.filter(email__in=options['emails'])
+        if options['org']:
+            users = users.filter(fyle_org_id=options['org'])
+        users = list(users)
+        if not users:
+            raise CommandError('No users with a connected Fyle account found')
+
+        start = time.perf_counter()
+        backups = create_backups_in_batch(users, form.cleaned_data)
+        scheduled = schedule_backups_in_batch(backups, options['workers'])
+        self.stdout.write('Scheduled {0}/{1} backup(s) of batch {2} in {3:.1f}s'.format(
+            scheduled, len(backups), backups[0].batch_id, time.perf_counter() - start))
@@ -0,0 +1,29 @@
+# Generated by Django 3.0.4 on 2026-10-17 21:16
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backups', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='backups',
+            name='base_backup',
+            field=models.ForeignKey(help_text='Backup this incremental backup builds on', null=True, on_delete=django.db.models.deletion.SET_NULL, to='backups.Backups'),
+        ),
+        migrations.AddField(
+            model_name='backups',
+            name='is_incremental',
+            field=models.BooleanField(default=False, help_text='Backup only changes since the base backup'),
+        ),
+        migrations.AddField(
+            model_name='backups',
+            name='watermark',
+            field=models.DateTimeField(help_text='Highest updated_at of the backed up objects', null=True),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 3.0.4 on 2026-10-17 21:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backups', '0002_incremental_backups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedAttachment',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('fyle_org_id', models.CharField(help_text='Fyle org_id of the expense', max_length=255)),
+                ('expense_id', models.CharField(help_text='Fyle expense id', max_length=255)),
+                ('expense_updated_at', models.CharField(help_text='updated_at of the expense when archived', max_length=64, null=True)),
+                ('filename', models.CharField(help_text='Attachment file name', max_length=255)),
+                ('content_hash', models.CharField(help_text='SHA-256 of attachment content', max_length=64)),
+                ('object_name', models.CharField(help_text='Cloud storage object name', max_length=512)),
+                ('created_at', models.DateTimeField(auto_now_add=True, help_text='Created at datetime')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='archivedattachment',
+            index=models.Index(fields=['fyle_org_id', 'content_hash'], name='backups_arc_fyle_or_28fca9_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='archivedattachment',
+            unique_together={('fyle_org_id', 'expense_id', 'filename')},
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.0.4 on 2026-10-17 21:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backups', '0003_archived_attachments'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='backups',
+            name='batch_id',
+            field=models.CharField(db_index=True, help_text='Batch this backup was scheduled in', max_length=36, null=True),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.0.4 on 2026-10-17 21:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backups', '0004_backup_batches'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='backups',
+            index=models.Index(fields=['user', 'object_type', '-created_at'], name='backups_bac_user_id_8f06a5_idx'),
+        ),
+    ]
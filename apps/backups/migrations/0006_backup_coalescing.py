@@ -0,0 +1,19 @@
+# Generated by Django 3.0.4 on 2026-10-17 21:46
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backups', '0005_backup_listing_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='backups',
+            name='coalesced_into',
+            field=models.ForeignKey(help_text='Ongoing identical backup whose result is shared', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='coalesced_backups', to='backups.Backups'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.0.4 on 2026-10-17 21:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backups', '0006_backup_coalescing'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='archivedattachment',
+            name='expense_attachment_count',
+            field=models.IntegerField(help_text='Attachments of the expense when archived', null=True),
+        ),
+    ]
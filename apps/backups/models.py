@@ -28,6 +28,17 @@ class Backups(models.Model):
     # we are now storing S3 object name in file_path
     file_path = models.CharField(null=True, max_length=512,
                                  help_text='Cloud storage URL for this backup')
+    is_incremental = models.BooleanField(default=False,
+                                         help_text='Backup only changes since the base backup')
+    base_backup = models.ForeignKey('self', null=True, on_delete=models.SET_NULL,
+                                    help_text='Backup this incremental backup builds on')
+    watermark = models.DateTimeField(null=True,
+                                     help_text='Highest updated_at of the backed up objects')
+    batch_id = models.CharField(max_length=36, null=True, db_index=True,
+                                help_text='Batch this backup was scheduled in')
+    coalesced_into = models.ForeignKey('self', null=True, on_delete=models.SET_NULL,
+                                       related_name='coalesced_backups',
+                                       help_text='Ongoing identical backup whose result is shared')
     created_at = models.DateTimeField(auto_now_add=True, help_text='Created at datetime')
     modified_at = models.DateTimeField(auto_now=True, help_text='Updated at datetime')
 
@@ -37,3 +48,30 @@ class Backups(models.Model):
     class Meta:
         ordering = ["-created_at"]
         get_latest_by = "created_at"
+        # Backup listing filters by user and object type, newest first
+        indexes = [models.Index(fields=['user', 'object_type', '-created_at'])]
+
+
+class ArchivedAttachment(models.Model):
+    """
+    Index of attachments kept in the content addressed attachment store
+    """
+    id = models.AutoField(primary_key=True)
+    fyle_org_id = models.CharField(max_length=255, help_text='Fyle org_id of the expense')
+    expense_id = models.CharField(max_length=255, help_text='Fyle expense id')
+    expense_updated_at = models.CharField(max_length=64, null=True,
+                                          help_text='updated_at of the expense when archived')
+    filename = models.CharField(max_length=255, help_text='Attachment file name')
+    expense_attachment_count = models.IntegerField(null=True,
+                                                   help_text='Attachments of the expense '
+                                                             'when archived')
+    content_hash = models.CharField(max_length=64, help_text='SHA-256 of attachment content')
+    object_name = models.CharField(max_length=512, help_text='Cloud storage object name')
+    created_at = models.DateTimeField(auto_now_add=True, help_text='Created at datetime')
+
+    def __str__(self):
+        return self.object_name
+
+    class Meta:
+        unique_together = ('fyle_org_id', 'expense_id', 'filename')
+        indexes = [models.Index(fields=['fyle_org_id', 'content_hash'])]
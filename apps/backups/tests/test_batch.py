@@ -0,0 +1,149 @@
+import json
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils import timezone
+
+from apps.user.models import UserProfile
+from apps.backups.models import Backups, ObjectLookup
+from apps.backups.utils import schedule_backup, coalesce_backups
+from apps.data_fetcher.jobs import enqueue_backup
+from apps.data_fetcher.utils import share_backup_result
+from fyle_backup_app import settings
+
+
+class BatchScheduleTest(TestCase):
+    """
+    Test cases for scheduling backups of many users at once
+    """
+
+    def setUp(self):
+        for index in range(5):
+            UserProfile.objects.create_user(email='user{0}@test.com'.format(index),
+                                            password='foo', refresh_token='token',
+                                            fyle_org_id='orA' if index < 4 else 'orB')
+        patcher = mock.patch('apps.backups.utils.FyleSdkConnector')
+        connector = patcher.start()
+        self.addCleanup(patcher.stop)
+        connector.return_value.connection.Employees.get_my_profile.return_value = {
+            'data': {'id': 'ou1', 'org_id': 'orA'}}
+        patcher = mock.patch('apps.backups.utils.get_http_session')
+        self.post = patcher.start().return_value.post
+        self.addCleanup(patcher.stop)
+
+    def test_org_backups_are_created_and_scheduled(self):
+        responses = [mock.Mock(status_code=200, text=json.dumps({'id': 'job{0}'.format(i)}))
+                     for i in range(3)] + [mock.Mock(status_code=400)]
+        self.post.side_effect = responses
+        out = StringIO()
+        call_command('schedule_backups', '--name', 'Month end', '--org', 'orA',
+                     '--state', 'PAID', 'APPROVED', '--updated-at-gte', '2020-03-01',
+                     stdout=out)
+        self.assertIn('Scheduled 3/4 backup(s)', out.getvalue())
+        backups = Backups.objects.filter(name='Month end')
+        self.assertEqual(backups.count(), 4)
+        self.assertEqual(len(set(backups.values_list('batch_id', flat=True))), 1)
+        self.assertEqual(sorted(backups.values_list('current_state', flat=True)),
+                         ['FAILED', 'ONGOING', 'ONGOING', 'ONGOING'])
+        self.assertEqual(json.loads(backups[0].filters)['updated_at'],
+                         ['gte:2020-03-01T00:00:00.000Z'])
+        callback_urls = [call[1]['json']['template']['data']['url']
+                         for call in self.post.call_args_list]
+        self.assertTrue(all(url.endswith('expenses/') for url in callback_urls))
+
+    @mock.patch.object(settings, 'FYLE_API_RETRY_BACKOFF', 0)
+    def test_job_creation_is_only_retried_when_throttled(self):
+        self.post.side_effect = [mock.Mock(status_code=500)] + \
+            [mock.Mock(status_code=429, headers={})] * (settings.FYLE_API_MAX_RETRIES + 1) + \
+            [mock.Mock(status_code=429, headers={}),
+             mock.Mock(status_code=200, text=json.dumps({'id': 'job1'}))]
+        out = StringIO()
+        call_command('schedule_backups', '--name', 'Month end', '--org', 'orB',
+                     '--state', 'PAID', stdout=out)
+        self.assertEqual(self.post.call_count, 1)
+        self.assertEqual(Backups.objects.get(name='Month end').current_state, 'FAILED')
+
+        call_command('schedule_backups', '--name', 'Month end', '--org', 'orB',
+                     '--state', 'APPROVED', stdout=out)
+        self.assertEqual(self.post.call_count, settings.FYLE_API_MAX_RETRIES + 2)
+        self.assertEqual(Backups.objects.filter(current_state='FAILED').count(), 2)
+
+        call_command('schedule_backups', '--name', 'Month end', '--org', 'orB',
+                     '--state', 'DRAFT', stdout=out)
+        self.assertEqual(Backups.objects.get(task_id='job1').current_state, 'ONGOING')
+
+    def test_identical_ongoing_backups_are_coalesced(self):
+        self.post.side_effect = lambda *args, **kwargs: mock.Mock(
+            status_code=200, text=json.dumps({'id': 'job{0}'.format(self.post.call_count)}))
+        for _ in range(2):
+            call_command('schedule_backups', '--name', 'Month end', '--org', 'orA',
+                         '--state', 'PAID', stdout=StringIO())
+        call_command('schedule_backups', '--name', 'Month end', '--org', 'orA',
+                     '--state', 'APPROVED', stdout=StringIO())
+        self.assertEqual(self.post.call_count, 8)
+        coalesced = Backups.objects.exclude(coalesced_into=None)
+        self.assertEqual(coalesced.count(), 4)
+        self.assertTrue(all(backup.coalesced_into.user_id == backup.user_id and
+                            backup.coalesced_into.filters == backup.filters and
+                            backup.task_id is None for backup in coalesced))
+
+        backup = coalesced[0].coalesced_into
+        backup.current_state = 'READY'
+        backup.file_path = 'orA-Monthend.zip'
+        backup.save()
+        share_backup_result(backup)
+        self.assertEqual(list(backup.coalesced_backups.values_list('current_state', 'file_path')),
+                         [('READY', 'orA-Monthend.zip')])
+
+    def test_only_live_recent_backups_are_coalesced_into(self):
+        self.post.side_effect = lambda *args, **kwargs: mock.Mock(
+            status_code=200, text=json.dumps({'id': 'job{0}'.format(self.post.call_count)}))
+        call_command('schedule_backups', '--name', 'Month end', '--org', 'orB',
+                     '--state', 'PAID', stdout=StringIO())
+        backup = Backups.objects.get()
+        backup.task_id = None
+        backup.save()
+        call_command('schedule_backups', '--name', 'Month end', '--org', 'orB',
+                     '--state', 'PAID', stdout=StringIO())
+        self.assertEqual(self.post.call_count, 2)
+
+        enqueue_backup(backup)
+        Backups.objects.exclude(id=backup.id).update(current_state='READY')
+        call_command('schedule_backups', '--name', 'Month end', '--org', 'orB',
+                     '--state', 'PAID', stdout=StringIO())
+        self.assertEqual(self.post.call_count, 2)
+        self.assertEqual(Backups.objects.filter(coalesced_into=backup).count(), 1)
+
+        Backups.objects.filter(id=backup.id).update(created_at=timezone.now() - timedelta(
+            seconds=settings.BACKUP_COALESCE_MAX_AGE + 1))
+        call_command('schedule_backups', '--name', 'Month end', '--org', 'orB',
+                     '--state', 'PAID', stdout=StringIO())
+        self.assertEqual(self.post.call_count, 3)
+
+    def test_backups_are_only_coalesced_within_their_org(self):
+        user = UserProfile.objects.get(email='user0@test.com')
+
+        def create_backup(fyle_org_id, **kwargs):
+            return Backups.objects.create(name='test', current_state='ONGOING',
+                                          object_type=ObjectLookup.expenses, filters='{}',
+                                          data_format='CSV', fyle_org_id=fyle_org_id, user=user,
+                                          fyle_refresh_token='token', **kwargs)
+        ongoing = create_backup('orB', task_id='job1')
+        backups = [create_backup('orA'), create_backup('orB')]
+        self.assertEqual(coalesce_backups(backups), backups[:1])
+        self.assertEqual(list(ongoing.coalesced_backups.all()), backups[1:])
+
+    @mock.patch('apps.backups.utils.get_employee_details')
+    def test_backup_fails_when_scheduling_raises(self, get_employee_details):
+        self.post.side_effect = ConnectionError('Connection refused')
+        backup = Backups.objects.create(name='test', current_state='ONGOING',
+                                        object_type=ObjectLookup.expenses,
+                                        filters='{}', data_format='CSV', fyle_org_id='orB',
+                                        user=UserProfile.objects.get(fyle_org_id='orB'),
+                                        fyle_refresh_token='token')
+        with self.assertRaises(ConnectionError):
+            schedule_backup(mock.Mock(), backup)
+        self.assertEqual(Backups.objects.get(id=backup.id).current_state, 'FAILED')
@@ -0,0 +1,48 @@
+from datetime import timedelta
+
+from django.test import TestCase
+from django.utils import timezone
+
+from apps.user.models import UserProfile
+from apps.backups.models import Backups, ObjectLookup
+
+
+class BackupsPaginationTest(TestCase):
+    """
+    Test cases for keyset pagination of the backup history
+    """
+
+    def setUp(self):
+        self.user = UserProfile.objects.create_user(email='user1@test.com', password='foo')
+        other_user = UserProfile.objects.create_user(email='user2@test.com', password='foo')
+        for user in (self.user, other_user):
+            Backups.objects.bulk_create([
+                Backups(name='backup{0}'.format(index), current_state='READY', filters='{}',
+                        object_type=ObjectLookup.expenses, data_format='CSV',
+                        fyle_org_id='orTest', fyle_refresh_token='token', user=user)
+                for index in range(12)])
+        # Backups created in the same instant are ordered by id
+        created_at = timezone.now()
+        for index, backup in enumerate(Backups.objects.filter(user=self.user).order_by('id')):
+            Backups.objects.filter(id=backup.id).update(
+                created_at=created_at + timedelta(minutes=index // 2))
+        self.client.login(email='user1@test.com', password='foo')
+
+    def test_pages_cover_history_in_order(self):
+        names = []
+        cursor = None
+        while True:
+            params = {'object_type': 'expenses', 'limit': 5}
+            if cursor:
+                params['cursor'] = cursor
+            response = self.client.get('/main/backups/', params).json()
+            names += [backup['name'] for backup in response['backups']]
+            cursor = response['next_cursor']
+            if cursor is None:
+                break
+        self.assertEqual(names, ['backup{0}'.format(index) for index in reversed(range(12))])
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/main/backups/', {'object_type': 'expenses',
+                                                      'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 400)
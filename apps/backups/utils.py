@@ -1,8 +1,19 @@
+import base64
+import binascii
 import json
 import logging
-import requests
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
 from apps.user.models import UserProfile
-from apps.data_fetcher.utils import FyleSdkConnector
+from apps.user.utils import get_employee_details
+from apps.data_fetcher.utils import FyleSdkConnector, FyleApiRetryableError, \
+    get_fyle_api_throttle, check_response_throttling, get_http_session
+from apps.data_fetcher.models import BackupJob, JobState
 from fyle_backup_app import settings
 
 from .models import Backups, ObjectLookup
@@ -57,8 +68,14 @@ class FyleJobsSDK:
     Fyle Jobs SDK
     """
 
-    def __init__(self, fyle_sdk_connection):
-        self.user_profile = fyle_sdk_connection.Employees.get_my_profile()['data']
+    def __init__(self, fyle_sdk_connection, user_profile=None):
+        """
+        :param fyle_sdk_connection: FyleSDK connection
+        :param user_profile: Fyle profile of the user, fetched when not passed
+        """
+        if user_profile is None:
+            user_profile = fyle_sdk_connection.Employees.get_my_profile()['data']
+        self.user_profile = user_profile
         self.access_token = fyle_sdk_connection.access_token
 
     def trigger_now(self, callback_url, callback_method,
@@ -70,7 +87,7 @@ class FyleJobsSDK:
         :param callback_method: HTTP method for callback
         :param job_description: Job description
         :param object_id: object id
-        :returns: response
+        :returns: response, None if the job was not created
         """
         body = {
             'template': {
@@ -98,17 +115,76 @@ class FyleJobsSDK:
             'Authorization': 'Bearer {0}'.format(self.access_token)
         }
 
-        response = requests.post(
-            settings.FYLE_JOBS_URL,
-            headers=api_headers,
-            json=body
-        )
+        def post():
+            response = get_http_session().post(
+                settings.FYLE_JOBS_URL,
+                headers=api_headers,
+                json=body
+            )
+            # Creating jobs is not idempotent, so only requests Fyle throttled without
+            # processing them are sent again. The session retries failed connections.
+            if response.status_code == 429:
+                check_response_throttling(response)
+            return response
+
+        try:
+            response = get_fyle_api_throttle(self.user_profile.get('org_id')).call(post)
+        except FyleApiRetryableError as e:
+            logger.error('Fyle Jobs API kept throttling job: %s. Error: %s', job_description, e)
+            return None
         if response.status_code == 200:
             result = json.loads(response.text)
             return result
         return None
 
 
+def encode_backups_cursor(backup):
+    """
+    Cursor pointing after a backup in the listing
+    :param backup: dict with the id and created_at of a backup
+    :return: url safe string
+    """
+    value = json.dumps([backup['created_at'].isoformat(), backup['id']])
+    return base64.urlsafe_b64encode(value.encode()).decode()
+
+
+def decode_backups_cursor(cursor):
+    """
+    :param cursor: string from encode_backups_cursor()
+    :return: (created_at, id) of the last backup of the previous page
+    :raises ValueError: for cursors that were not made by encode_backups_cursor()
+    """
+    try:
+        created_at, backup_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(created_at), int(backup_id)
+    except (binascii.Error, TypeError, UnicodeDecodeError) as e:
+        raise ValueError('Invalid cursor') from e
+
+
+def get_backups_page(user_id, object_type, cursor=None, limit=None):
+    """
+    Get a page of a user's backups, newest first. Pages continue from the
+    (created_at, id) of the previous page's last backup, so each page is a range
+    scan on the listing index however deep into the history it is.
+    :param user_id: id of the user
+    :param object_type: object type name, e.g. 'expenses'
+    :param cursor: cursor of the page, None for the first page
+    :param limit: backups per page, settings.BACKUPS_LIMIT by default
+    :return: (list of backup dicts, cursor of the next page or None)
+    """
+    limit = limit or settings.BACKUPS_LIMIT
+    backups = Backups.objects.filter(user_id=user_id, object_type=ObjectLookup[object_type]
+                                    ).order_by('-created_at', '-id')
+    if cursor:
+        created_at, backup_id = decode_backups_cursor(cursor)
+        backups = backups.filter(Q(created_at__lt=created_at) |
+                                 Q(created_at=created_at, id__lt=backup_id))
+    backups = list(backups.values('id', 'name', 'current_state', 'error_message',
+                                  'created_at')[:limit + 1])
+    next_cursor = encode_backups_cursor(backups[limit - 1]) if len(backups) > limit else None
+    return backups[:limit], next_cursor
+
+
 def create_backup(request, data):
     """
     Create a new backup
@@ -131,30 +207,132 @@ def create_backup(request, data):
                                     object_type=ObjectLookup[object_type],
                                     filters=filters, data_format=data_format,
                                     fyle_org_id=fyle_org_id, user=user,
-                                    fyle_refresh_token=refresh_token
+                                    fyle_refresh_token=refresh_token,
+                                    is_incremental=bool(data.get('incremental'))
                                     )
     return backup
 
+
+def create_backups_in_batch(users, data):
+    """
+    Create the same backup for many users with a single insert
+    :param users: list of UserProfile objects with a Fyle account connected
+    :param data: cleaned form data
+    :return: list of the created backup objects
+    """
+    object_type = data.get('object_type')
+    filters = BackupFilters(data, object_type).get_filters_for_object()
+    batch_id = str(uuid.uuid4())
+    Backups.objects.bulk_create([
+        Backups(name=data.get('name'), current_state='ONGOING',
+                object_type=ObjectLookup[object_type], filters=filters,
+                data_format=data.get('data_format'), fyle_org_id=user.fyle_org_id, user=user,
+                fyle_refresh_token=user.refresh_token,
+                is_incremental=bool(data.get('incremental')), batch_id=batch_id)
+        for user in users])
+    # bulk_create does not set primary keys on MySQL, so the rows are read back
+    return list(Backups.objects.filter(batch_id=batch_id).select_related('user'))
+
+
+def trigger_backup_job(backup, user_profile=None):
+    """
+    Create the Jobs Infra task that runs a backup
+    :param backup: backup object
+    :param user_profile: Fyle profile of the backup's user, fetched when not passed
+    :return: created job, None if Jobs Infra did not create it
+    """
+    fyle_sdk_connector = FyleSdkConnector(backup.fyle_refresh_token, backup.fyle_org_id)
+    jobs = FyleJobsSDK(fyle_sdk_connector.connection, user_profile)
+    object_type = ObjectLookup(backup.object_type).label.lower()
+    return jobs.trigger_now(
+        callback_url='{0}{1}/'.format(settings.FYLE_JOBS_CALLBACK_URL, object_type),
+        callback_method='POST',
+        object_id=backup.id,
+        payload={'backup_id': backup.id},
+        job_description='Fetch backup_id {0} for user: {1}'.format(backup.id, backup.user))
+
+
+def coalesce_backups(backups):
+    """
+    Attach backups to an ongoing backup of the same user and org with the same configuration,
+    instead of running them again. They get the outcome of that backup when it ends.
+    Only backups created within BACKUP_COALESCE_MAX_AGE that have a Jobs Infra task
+    or a queued or running job are shared, so backups left ONGOING by a failed
+    schedule or a lost callback are not.
+    :param backups: list of new backup objects with the same configuration
+    :return: list of the backups that still need to be scheduled
+    """
+    if not backups:
+        return backups
+    config = backups[0]
+    created_after = timezone.now() - timedelta(seconds=settings.BACKUP_COALESCE_MAX_AGE)
+    queued = BackupJob.objects.filter(state__in=[JobState.QUEUED, JobState.RUNNING])
+    with transaction.atomic():
+        # Locking the ongoing backups makes them share their outcome after this commits
+        ongoing = Backups.objects.select_for_update().filter(
+            Q(task_id__isnull=False) | Q(id__in=queued.values('backup_id')),
+            user_id__in=[backup.user_id for backup in backups],
+            fyle_org_id__in=[backup.fyle_org_id for backup in backups], current_state='ONGOING',
+            coalesced_into=None, object_type=config.object_type, filters=config.filters,
+            data_format=config.data_format, is_incremental=config.is_incremental,
+            created_at__gte=created_after
+        ).exclude(id__in=[backup.id for backup in backups]).order_by('id')
+        ongoing_by_user = {}
+        for ongoing_backup in ongoing:
+            ongoing_by_user.setdefault((ongoing_backup.user_id, ongoing_backup.fyle_org_id),
+                                       ongoing_backup)
+        coalesced = []
+        for backup in backups:
+            backup.coalesced_into = ongoing_by_user.get((backup.user_id, backup.fyle_org_id))
+            if backup.coalesced_into is not None:
+                logger.info('Backup_id: %s coalesced into ongoing backup_id: %s',
+                            backup.id, backup.coalesced_into.id)
+                coalesced.append(backup)
+        Backups.objects.bulk_update(coalesced, ['coalesced_into'])
+    return [backup for backup in backups if backup.coalesced_into is None]
+
+
+def schedule_backups_in_batch(backups, workers=None):
+    """
+    Schedule many backups using JobsInfra, triggering their jobs concurrently.
+    Backups identical to an ongoing backup of their user share its result instead.
+    :param backups: list of backup objects
+    :param workers: jobs triggered at once, settings.BACKUP_SCHEDULE_WORKERS by default
+    :return: number of backups scheduled
+    """
+    def trigger(backup):
+        try:
+            return trigger_backup_job(backup)
+        except Exception as e:
+            logger.error('Exception occured while scheduling backup_id: %s. Error: %s',
+                         backup.id, e)
+            return None
+
+    with ThreadPoolExecutor(max_workers=workers or settings.BACKUP_SCHEDULE_WORKERS) as executor:
+        pending = coalesce_backups(backups)
+        created_jobs = list(executor.map(trigger, pending))
+    for backup, created_job in zip(pending, created_jobs):
+        if created_job is None:
+            logger.error('Backup_id: %s not scheduled. Task creation failed.', backup.id)
+            backup.current_state = 'FAILED'
+        else:
+            backup.task_id = created_job['id']
+    Backups.objects.bulk_update(pending, ['task_id', 'current_state'])
+    return len(backups) - len(pending) + sum(created_job is not None
+                                             for created_job in created_jobs)
+
+
 def schedule_backup(request, backup):
     """
-    Schedule this backup using JobsInfra
+    Schedule this backup using JobsInfra, unless an identical backup of the
+    user is ongoing and its result can be shared
     :param request: request object
     :param backup: backup object
     """
     try:
-        fyle_sdk_connector = FyleSdkConnector(request.user.refresh_token)
-        fyle_sdk_connection = fyle_sdk_connector.connection
-        jobs = FyleJobsSDK(fyle_sdk_connection)
-        object_type = request.POST.get('object_type')
-        created_job = jobs.trigger_now(
-            callback_url='{0}{1}/'.format(settings.FYLE_JOBS_CALLBACK_URL,
-                                          object_type),
-            callback_method='POST',
-            object_id=backup.id,
-            payload={'backup_id': backup.id},
-            job_description='Fetch backup_id {0} for user: {1}'.format(
-                backup.id, request.user
-            ))
+        if not coalesce_backups([backup]):
+            return True
+        created_job = trigger_backup_job(backup, get_employee_details(request))
         if created_job is None:
             logger.error('Backup_id: %s not scheduled. Task creation failed.', backup.id)
             backup.current_state = 'FAILED'
@@ -165,4 +343,6 @@ def schedule_backup(request, backup):
         return True
     except Exception as excp:
         logger.error('Exception occured while scheduling backup_id: %s', backup.id)
+        backup.current_state = 'FAILED'
+        backup.save()
         raise
@@ -1,4 +1,3 @@
-import json
 import logging
 from django.shortcuts import render, redirect
 from django.views import View
@@ -8,11 +7,12 @@ from django.core.exceptions import ValidationError
 
 from apps.fyle_connect.utils import FyleOAuth2
 from apps.user.models import UserProfile
+from apps.user.utils import get_employee_details
 from apps.backups.forms import ExpenseForm
 from apps.data_fetcher.utils import notify_user, FyleSdkConnector
 from fyle_backup_app import settings
 
-from .utils import create_backup, schedule_backup
+from .utils import create_backup, schedule_backup, get_backups_page
 from .models import Backups, ObjectLookup
 
 logger = logging.getLogger('app')
@@ -64,14 +64,18 @@ class BackupsView(View):
     Insert/Get objects from backups table
     """
     def get(self, request, object_type=None):
-        if object_type is None:
-            return {'backups': None}
-        backups_list = Backups.objects.filter(object_type=ObjectLookup[object_type],
-                                              user_id__email=request.user
-                                             ).values('id', 'name', 'current_state',
-                                                      'error_message',
-                                                      'created_at')[:settings.BACKUPS_LIMIT]
-        return JsonResponse({"backups": list(backups_list)})
+        object_type = object_type or request.GET.get('object_type')
+        if object_type not in ObjectLookup.names:
+            return JsonResponse({'backups': None, 'next_cursor': None})
+        try:
+            limit = int(request.GET.get('limit', settings.BACKUPS_LIMIT))
+            limit = max(1, min(limit, settings.BACKUPS_PAGE_MAX_LIMIT))
+            backups_list, next_cursor = get_backups_page(request.user.id, object_type,
+                                                         request.GET.get('cursor'), limit)
+        except ValueError:
+            return JsonResponse({'status':'error', 'message':'Invalid cursor or limit.'},
+                                status=400)
+        return JsonResponse({"backups": backups_list, "next_cursor": next_cursor})
 
     def post(self, request):
         try:
@@ -109,11 +113,15 @@ class BackupsNotifyView(View):
         try:
             logger.info('Got a notify request from user %s for backup_id: %s',
                         request.user, backup_id)
-            backup = Backups.objects.get(id=backup_id, user_id__email=request.user)
-            fyle_connection = FyleSdkConnector(backup.fyle_refresh_token)
+            backup = Backups.objects.get(id=backup_id, user_id=request.user.id)
+            fyle_connection = FyleSdkConnector(backup.fyle_refresh_token, backup.fyle_org_id)
             object_type = ObjectLookup(backup.object_type).label.lower()
+            # The profile of the current org is already cached for this request
+            user_data = None
+            if backup.fyle_org_id == request.user.fyle_org_id:
+                user_data = get_employee_details(request)
             notify_user(fyle_connection, backup.file_path, backup.fyle_org_id,
-                        object_type)
+                        object_type, user_data)
             messages.success(request, 'We have sent you the download\
                              link by email.')
             return redirect('/main/{0}/'.format(object_type))
@@ -135,10 +143,13 @@ class ExpensesView(View):
         if request.user.refresh_token is None:
             messages.error(request, 'Please connect your Fyle account!')
             return redirect('/fyle/connect/')
-        bkp_view = BackupsView()
-        response = bkp_view.get(request, self.object_type)
-        response = json.loads(response.content).get('backups')
+        try:
+            backup_list, next_cursor = get_backups_page(request.user.id, self.object_type,
+                                                        request.GET.get('cursor'))
+        except ValueError:
+            return redirect('/main/{0}/'.format(self.object_type))
         form = ExpenseForm()
-        return render(request, 'expenses.html', {'form': form, 'backup_list':response,
+        return render(request, 'expenses.html', {'form': form, 'backup_list': backup_list,
+                                                 'next_cursor': next_cursor,
                                                  'object_name': 'Expense',
                                                  'expenses_tab': 'active'})
@@ -0,0 +1,305 @@
+import asyncio
+import itertools
+import logging
+import os
+import socket
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import close_old_connections
+
+from fyle_backup_app import settings
+
+from . import metrics
+from .jobs import claim_backup_job, finish_backup_job, requeue_stale_jobs
+from .models import CheckpointStage
+from .utils import FyleSdkConnector, AttachmentDownloader, get_backup_checkpoint, \
+    get_expense_dumper, save_dumped_expenses, upload_and_notify, observe_backup, \
+    share_backup_result
+
+logger = logging.getLogger('app')
+
+
+class AsyncBackupEngine():
+    """
+    Run queued backups as coroutines on one event loop. Fyle API, database, file
+    and email calls block, so they run on a shared thread pool and S3 parts are
+    uploaded by a second one: threads are bounded by the pools, not by the backups.
+    """
+    def __init__(self, max_backups=None, workers=None, upload_workers=None,
+                 poll_interval=None):
+        """
+        :param max_backups: backups run at once, settings.ASYNC_ENGINE_MAX_BACKUPS by default
+        :param workers: threads for blocking calls, settings.ASYNC_ENGINE_WORKERS by default
+        :param upload_workers: threads for S3 part uploads,
+        settings.ASYNC_ENGINE_UPLOAD_WORKERS by default
+        :param poll_interval: seconds to wait on an empty queue,
+        settings.BACKUP_WORKER_POLL_INTERVAL by default
+        """
+        self.max_backups = max_backups or settings.ASYNC_ENGINE_MAX_BACKUPS
+        self.poll_interval = settings.BACKUP_WORKER_POLL_INTERVAL if poll_interval is None \
+            else poll_interval
+        self.executor = ThreadPoolExecutor(max_workers=workers or settings.ASYNC_ENGINE_WORKERS)
+        self.upload_executor = ThreadPoolExecutor(
+            max_workers=upload_workers or settings.ASYNC_ENGINE_UPLOAD_WORKERS)
+        self.worker = '{0}:{1}:async'.format(socket.gethostname(), os.getpid())
+        self.running = set()
+        self.consumer = None
+        self.wakeup = None
+        self.stopping = False
+
+    async def run_sync(self, func, *args, **kwargs):
+        """
+        Run a blocking call on the thread pool. Database connections of the pool
+        thread that are broken or past CONN_MAX_AGE are closed before and after it.
+        """
+        def call():
+            close_old_connections()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                close_old_connections()
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self.executor, call)
+
+    def start(self, exit_when_idle=False):
+        """
+        Start consuming the backup queue on the current event loop, unless started already
+        :param exit_when_idle: stop once the queue is empty
+        :return: asyncio.Task of the queue consumer
+        """
+        if self.consumer is None:
+            self.consumer = asyncio.ensure_future(self.consume_queue(exit_when_idle))
+        return self.consumer
+
+    async def stop(self):
+        """
+        Stop claiming jobs and wait for the running backups to finish
+        """
+        self.stopping = True
+        if self.wakeup is not None:
+            self.wakeup.set()
+        if self.consumer is not None:
+            await self.consumer
+        self.executor.shutdown(wait=False)
+        self.upload_executor.shutdown(wait=False)
+
+    async def consume_queue(self, exit_when_idle=False):
+        """
+        Claim queued jobs and run them, at most max_backups at a time
+        :param exit_when_idle: return once the queue is empty and the backups are done
+        """
+        self.wakeup = asyncio.Event()
+        await self.run_sync(requeue_stale_jobs)
+        while not self.stopping:
+            if len(self.running) >= self.max_backups:
+                await asyncio.wait(self.running, return_when=asyncio.FIRST_COMPLETED)
+                continue
+            job = await self.run_sync(self.claim_job)
+            if job is not None:
+                task = asyncio.ensure_future(self.run_job(job))
+                self.running.add(task)
+                task.add_done_callback(self.running.discard)
+            elif exit_when_idle:
+                if not self.running:
+                    break
+                await asyncio.wait(self.running, return_when=asyncio.FIRST_COMPLETED)
+            else:
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+        if self.running:
+            await asyncio.wait(self.running)
+
+    def claim_job(self):
+        """
+        Claim the next queued job along with its backup
+        :return: BackupJob object or None when the queue is empty
+        """
+        job = claim_backup_job(self.worker)
+        if job is not None:
+            logger.info('Worker %s running job %s for backup: %s', job.worker, job.id,
+                        job.backup.name)
+        return job
+
+    async def run_job(self, job):
+        """
+        Run the backup of a claimed job and record the outcome
+        :param job: BackupJob object
+        """
+        try:
+            is_success = await self.run_backup(job.backup)
+        except Exception as e:
+            logger.error('Job %s for backup_id: %s failed. Error: %s', job.id, job.backup_id, e)
+            is_success = False
+        await self.run_sync(finish_backup_job, job, is_success)
+
+    async def run_backup(self, backup):
+        """
+        Fetch, dump, upload and notify a backup, like fetch_and_notify_expenses
+        :param backup: backup object
+        :return: False for errored cases, True otherwise
+        """
+        archive_mode = settings.BACKUP_ARCHIVE_MODE
+        stage_timer = metrics.StageTimer()
+        start = time.perf_counter()
+        outcome = 'failed'
+        fyle_connection = await self.run_sync(FyleSdkConnector, backup.fyle_refresh_token,
+                                              backup.fyle_org_id)
+        checkpoint = await self.run_sync(get_backup_checkpoint, backup, archive_mode)
+        try:
+            if checkpoint.stage == CheckpointStage.DUMPING:
+                dumper = await self.run_sync(get_expense_dumper, backup, fyle_connection,
+                                             checkpoint, archive_mode, stage_timer,
+                                             upload_executor=self.upload_executor)
+                if dumper is None:
+                    await self.run_sync(checkpoint.delete)
+                    outcome = 'no_data'
+                    return True
+                file_path = await self.dump(dumper)
+                await self.run_sync(save_dumped_expenses, backup, checkpoint, archive_mode,
+                                    dumper, file_path)
+            await self.run_sync(upload_and_notify, backup, fyle_connection, checkpoint,
+                                archive_mode, stage_timer)
+            outcome = 'ready'
+            return True
+        except Exception as e:
+            backup.current_state = 'FAILED'
+            await self.run_sync(backup.save)
+            logger.error('Backup process failed for bkp_id: %s . Error: %s', backup.id, e)
+            return False
+        finally:
+            observe_backup(backup.id, outcome, stage_timer, start)
+            await self.run_sync(share_backup_result, backup)
+
+    async def dump(self, dumper):
+        """
+        Write the pages of a backup while the next pages are fetched. Fetching waits
+        once ASYNC_ENGINE_PAGE_QUEUE_SIZE pages are ahead of writing.
+        :param dumper: Dumper of the backup
+        :return: path of the zip file
+        """
+        timer = dumper.stage_timer
+        archive = await self.run_sync(dumper.start_dump)
+        pages = asyncio.Queue(maxsize=settings.ASYNC_ENGINE_PAGE_QUEUE_SIZE)
+        extraction = asyncio.ensure_future(self.extract_pages(dumper, pages))
+        try:
+            while True:
+                page = await pages.get()
+                if isinstance(page, Exception):
+                    raise page
+                if page is None:
+                    break
+                with timer.time('dump'):
+                    await self.run_sync(dumper.write_page, archive, page)
+                attachments_done = 0
+                if dumper.download_attachments is True:
+                    with timer.time('attachments'):
+                        attachments_done = await self.dump_attachments(dumper, archive, page)
+                await self.run_sync(dumper.save_checkpoint, archive, attachments_done, page)
+                await self.run_sync(dumper.send_heartbeat)
+            with timer.time('archive'):
+                return await self.run_sync(dumper.finish_dump, archive)
+        except (Exception, asyncio.CancelledError):
+            extraction.cancel()
+            await self.run_sync(archive.abort)
+            raise
+
+    async def extract_pages(self, dumper, pages):
+        """
+        Fetch the pages of a backup into a queue, ending with None or the error
+        :param dumper: Dumper of the backup
+        :param pages: asyncio.Queue of pages
+        """
+        iterator = iter(dumper.iter_pages())
+        try:
+            while True:
+                with dumper.stage_timer.time('extract'):
+                    page = await self.run_sync(next, iterator, None)
+                if page is None:
+                    break
+                await pages.put(page)
+        except Exception as e:
+            await pages.put(e)
+            return
+        await pages.put(None)
+
+    async def dump_attachments(self, dumper, archive, page):
+        """
+        Fetch the attachments of a page concurrently and write them in page order.
+        Like AttachmentDownloader.download, at most twice the download workers
+        are fetched ahead of writing.
+        :param dumper: Dumper of the backup
+        :param archive: DirectoryArchive or ZipStreamArchive of the backup
+        :param page: page of expense dicts
+        :return: number of expenses with attachments in the page
+        """
+        expenses, expense_ids = await self.run_sync(dumper.get_attachment_expenses, archive,
+                                                    page)
+        if not expenses:
+            return 0
+        downloader = AttachmentDownloader(dumper.connection)
+        remaining_ids = iter(expense_ids)
+
+        def fetch(expense_id):
+            return expense_id, asyncio.ensure_future(self.run_sync(downloader.fetch, expense_id))
+        pending = deque(fetch(expense_id) for expense_id in
+                        itertools.islice(remaining_ids, downloader.workers * 2))
+        try:
+            position = 0
+            while pending:
+                expense_id, attachments = pending.popleft()
+                next_id = next(remaining_ids, None)
+                if next_id is not None:
+                    pending.append(fetch(next_id))
+                position += 1
+                try:
+                    attachments = await attachments
+                except Exception as e:
+                    logger.error('Attachment dump failed for expense %s, Error: %s',
+                                 expense_id, e)
+                    continue
+                await self.run_sync(dumper.write_expense_attachments, archive,
+                                    expenses[expense_id], attachments)
+                dumper.log_attachment_progress(position, len(expense_ids))
+        finally:
+            for _, attachments in pending:
+                attachments.cancel()
+        return len(expenses)
+
+
+class BackupEngineApplication():
+    """
+    ASGI application serving Django, with an AsyncBackupEngine consuming the
+    backup queue on the same event loop
+    """
+    def __init__(self, application, engine=None):
+        """
+        :param application: Django ASGI application
+        :param engine: AsyncBackupEngine, one with the default settings by default
+        """
+        self.application = application
+        self.engine = engine or AsyncBackupEngine()
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        # Servers without lifespan events start the engine on the first request
+        self.engine.start()
+        return await self.application(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        """
+        Start the engine with the server and let running backups finish on shutdown
+        """
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                self.engine.start()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.engine.stop()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
@@ -0,0 +1,253 @@
+import gzip
+import json
+
+from dateutil import parser
+
+from fyle_backup_app import settings
+
+from .schemas import EXTRA_FIELDS_COLUMN
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+COLUMNAR_FORMATS = {
+    'PARQUET': '.parquet',
+    'ARROW': '.arrow'
+}
+
+JSON_LINES_FORMATS = {
+    'JSONL': '.jsonl',
+    'JSONL_GZ': '.jsonl.gz',
+    'JSONL_ZSTD': '.jsonl.zst'
+}
+
+
+def is_columnar_available():
+    """
+    Columnar formats need the optional pyarrow package
+    """
+    return pyarrow is not None
+
+
+def is_zstd_available():
+    """
+    Zstandard compressed JSON Lines need the optional zstandard package
+    """
+    return zstandard is not None
+
+
+def get_data_file_extension(data_format):
+    """
+    :param data_format: data format of the backup
+    :return: extension of the backup data file
+    """
+    if data_format == 'CSV':
+        return '.csv'
+    if data_format in JSON_LINES_FORMATS:
+        return JSON_LINES_FORMATS[data_format]
+    if data_format in COLUMNAR_FORMATS:
+        return COLUMNAR_FORMATS[data_format]
+    raise NotImplementedError
+
+
+def open_data_writer(file, data_format, schema=None):
+    """
+    Get the writer for the data file of a backup in a JSON Lines or columnar format
+    :param file: writable binary file object
+    :param data_format: data format of the backup
+    :param schema: schemas.Schema with the columns of columnar formats
+    :return: JSONLinesWriter or ColumnarWriter
+    """
+    if data_format in JSON_LINES_FORMATS:
+        return JSONLinesWriter(file, data_format)
+    if data_format in COLUMNAR_FORMATS:
+        return ColumnarWriter(file, data_format, schema)
+    raise NotImplementedError
+
+
+def get_arrow_type(column_type):
+    """
+    :param column_type: column type of the schema, 'string', 'float', 'bool' or 'timestamp'
+    :return: pyarrow DataType of the column. Timestamps are kept in UTC.
+    """
+    if column_type == 'float':
+        return pyarrow.float64()
+    if column_type == 'bool':
+        return pyarrow.bool_()
+    if column_type == 'timestamp':
+        return pyarrow.timestamp('us', tz='UTC')
+    return pyarrow.string()
+
+
+def to_column_value(value, column_type):
+    """
+    Convert an expense field value to the type of its column
+    :param value: value from the Fyle API
+    :param column_type: column type of the schema
+    :raises ValueError, TypeError: for values that do not fit the column type
+    """
+    if value is None:
+        return None
+    if column_type == 'timestamp':
+        return parser.isoparse(value)
+    if column_type == 'float':
+        if isinstance(value, bool):
+            raise TypeError('{0!r} is not a number'.format(value))
+        return float(value)
+    if column_type == 'bool':
+        if not isinstance(value, bool):
+            raise TypeError('{0!r} is not a boolean'.format(value))
+        return value
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    return str(value)
+
+
+class ColumnarWriter():
+    """
+    Write pages of expenses to a Parquet or Arrow IPC file with the typed columns of
+    a versioned schema, so every backup of a schema version has the same columns.
+    Fields that are not columns, and values that do not fit the type of their
+    column, are kept as JSON in the extra fields column.
+    Pages are buffered and written out in row groups of row_group_size rows.
+    """
+    def __init__(self, file, data_format, schema, row_group_size=None):
+        """
+        :param file: writable binary file object, left open by close()
+        :param data_format: 'PARQUET' or 'ARROW'
+        :param schema: schemas.Schema of the backup
+        :param row_group_size: rows per row group, settings.COLUMNAR_ROW_GROUP_SIZE by default
+        """
+        if pyarrow is None:
+            raise NotImplementedError('{0} backups need pyarrow installed'.format(data_format))
+        self.file = file
+        self.data_format = data_format
+        self.schema = schema
+        self.row_group_size = row_group_size or settings.COLUMNAR_ROW_GROUP_SIZE
+        self.arrow_schema = pyarrow.schema(
+            [pyarrow.field(column, get_arrow_type(schema.get_column_type(column)))
+             for column in schema.columns] +
+            [pyarrow.field(EXTRA_FIELDS_COLUMN, pyarrow.string())])
+        self.writer = None
+        self.batches = []
+        self.buffered_rows = 0
+
+    def open_writer(self):
+        """
+        Open the file writer
+        """
+        if self.data_format == 'PARQUET':
+            self.writer = pyarrow.parquet.ParquetWriter(
+                self.file, self.arrow_schema, compression=settings.PARQUET_COMPRESSION)
+        else:
+            self.writer = pyarrow.ipc.new_file(self.file, self.arrow_schema)
+
+    def to_columns(self, data):
+        """
+        Convert a page of expenses to lists of column values
+        :param data: page of expense dicts
+        :return: dict of column name to values
+        """
+        columns = {name: [] for name in self.arrow_schema.names}
+        for record in data:
+            row, extra_fields = self.schema.split_fields(record)
+            for column in self.schema.columns:
+                value = row.get(column)
+                try:
+                    value = to_column_value(value, self.schema.get_column_type(column))
+                except (ValueError, TypeError, OverflowError):
+                    extra_fields[column] = value
+                    value = None
+                columns[column].append(value)
+            columns[EXTRA_FIELDS_COLUMN].append(
+                json.dumps(extra_fields, default=str) if extra_fields else None)
+        return columns
+
+    def write(self, data):
+        """
+        Add a page of expenses, writing a row group once enough rows are buffered
+        :param data: page of expense dicts
+        """
+        if self.writer is None:
+            self.open_writer()
+        columns = self.to_columns(data)
+        arrays = [pyarrow.array(columns[field.name], type=field.type)
+                  for field in self.arrow_schema]
+        self.batches.append(pyarrow.RecordBatch.from_arrays(arrays, schema=self.arrow_schema))
+        self.buffered_rows += len(data)
+        if self.buffered_rows >= self.row_group_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Write the buffered pages as a row group
+        """
+        if not self.batches:
+            return
+        table = pyarrow.Table.from_batches(self.batches, schema=self.arrow_schema)
+        if self.data_format == 'PARQUET':
+            self.writer.write_table(table, row_group_size=self.row_group_size)
+        else:
+            self.writer.write_table(table, max_chunksize=self.row_group_size)
+        self.batches = []
+        self.buffered_rows = 0
+
+    def close(self):
+        """
+        Write the remaining rows and the file footer
+        """
+        if self.writer is None:
+            return
+        self.flush()
+        self.writer.close()
+
+
+class JSONLinesWriter():
+    """
+    Write expenses one JSON object per line, keeping nested fields as they are.
+    Rows are encoded and written one at a time, so memory use does not grow
+    with the size of the backup.
+    """
+    def __init__(self, file, data_format):
+        """
+        :param file: writable binary file object, left open by close()
+        :param data_format: 'JSONL', 'JSONL_GZ' or 'JSONL_ZSTD'
+        """
+        self.file = file
+        self.data_format = data_format
+        if data_format == 'JSONL_GZ':
+            self.stream = gzip.GzipFile(fileobj=file, mode='wb',
+                                        compresslevel=settings.JSONL_GZIP_LEVEL)
+        elif data_format == 'JSONL_ZSTD':
+            if zstandard is None:
+                raise NotImplementedError('JSONL_ZSTD backups need zstandard installed')
+            compressor = zstandard.ZstdCompressor(level=settings.JSONL_ZSTD_LEVEL)
+            self.stream = compressor.stream_writer(file)
+        else:
+            self.stream = file
+
+    def write(self, data):
+        """
+        :param data: page of expense dicts
+        """
+        for row in data:
+            self.stream.write(json.dumps(row, separators=(',', ':')).encode())
+            self.stream.write(b'\n')
+
+    def close(self):
+        """
+        Write the end of the compressed stream
+        """
+        if self.data_format == 'JSONL_GZ':
+            self.stream.close()
+        elif self.data_format == 'JSONL_ZSTD':
+            self.stream.flush(zstandard.FLUSH_FRAME)
@@ -0,0 +1,255 @@
+import logging
+import os
+import socket
+import threading
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.db import connection, transaction, close_old_connections
+from django.db.models import Count, Min, Q
+from django.utils import timezone
+
+from fyle_backup_app import settings
+
+from apps.backups.models import Backups
+
+from .models import BackupJob, JobState
+from .utils import fetch_and_notify_expenses, get_fyle_api_throttle, share_backup_result
+
+logger = logging.getLogger('app')
+
+
+def enqueue_backup(backup):
+    """
+    Queue a backup for the backup workers. A backup that is already queued or
+    running is not queued again, so Jobs Infra retries are safe.
+    :param backup: backup object
+    :return: BackupJob object
+    """
+    job = BackupJob.objects.filter(backup=backup,
+                                   state__in=[JobState.QUEUED, JobState.RUNNING]).first()
+    if job is None:
+        job = BackupJob.objects.create(backup=backup, fyle_org_id=backup.fyle_org_id)
+    logger.info('Backup_id: %s queued as job %s. Queue depth: %s', backup.id, job.id,
+                BackupJob.objects.filter(state=JobState.QUEUED).count())
+    return job
+
+
+def get_queue_stats():
+    """
+    Queue depth and running jobs, in total and per org
+    :return: dict
+    """
+    per_org = {}
+    counts = BackupJob.objects.filter(state__in=[JobState.QUEUED, JobState.RUNNING]) \
+                              .values('fyle_org_id', 'state').annotate(count=Count('id')) \
+                              .order_by()
+    for row in counts:
+        org_stats = per_org.setdefault(row['fyle_org_id'], {'queued': 0, 'running': 0})
+        org_stats[row['state'].lower()] = row['count']
+    return {'queued': sum(stats['queued'] for stats in per_org.values()),
+            'running': sum(stats['running'] for stats in per_org.values()),
+            'orgs': per_org}
+
+
+def get_org_finish_tag(fyle_org_id, started):
+    """
+    Virtual finish time of the next job of an org in weighted fair queuing
+    :param fyle_org_id: Fyle org_id
+    :param started: dict of org to jobs started in the fair share window
+    """
+    return (started.get(fyle_org_id, 0) + 1) / settings.BACKUP_ORG_WEIGHTS.get(fyle_org_id, 1)
+
+
+# MySQL named lock serialising job claims across workers
+CLAIM_LOCK_NAME = 'fyle_backup_job_claim'
+
+
+@contextmanager
+def job_claim_lock(timeout=10):
+    """
+    Serialise job claims across workers, so the running job counts a claim is
+    checked against cannot change before it commits. Other databases, like SQLite
+    in tests, are not locked.
+    :param timeout: seconds to wait for the lock
+    :return: context manager yielding whether the lock was taken
+    """
+    if connection.vendor != 'mysql':
+        yield True
+        return
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT GET_LOCK(%s, %s)', [CLAIM_LOCK_NAME, timeout])
+        acquired = cursor.fetchone()[0] == 1
+    try:
+        yield acquired
+    finally:
+        if acquired:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT RELEASE_LOCK(%s)', [CLAIM_LOCK_NAME])
+
+
+def claim_backup_job(worker):
+    """
+    Claim the next queued job by weighted fair queuing across orgs: the org that
+    started the fewest jobs for its weight within BACKUP_FAIR_SHARE_WINDOW goes
+    first, so one org's burst of backups cannot hold every worker. Orgs and users
+    at their running job limit are skipped. Ties go to the oldest job.
+    Claims hold job_claim_lock() from counting the running jobs until they commit,
+    so concurrent workers cannot go over a limit.
+    :param worker: name of the claiming worker
+    :return: BackupJob object or None when no queued job can run now
+    """
+    with job_claim_lock() as acquired:
+        if not acquired:
+            logger.warning('Worker %s timed out waiting for the job claim lock', worker)
+            return None
+        with transaction.atomic():
+            return claim_next_backup_job(worker)
+
+
+def claim_next_backup_job(worker):
+    """
+    Claim the next queued job, see claim_backup_job()
+    :param worker: name of the claiming worker
+    :return: BackupJob object or None
+    """
+    running = BackupJob.objects.filter(state=JobState.RUNNING)
+    running_orgs = dict(running.values_list('fyle_org_id').annotate(count=Count('id'))
+                        .order_by())
+    busy_users = [user_id for user_id, count in running.values_list('backup__user_id')
+                  .annotate(count=Count('id')).order_by()
+                  if count >= settings.BACKUP_USER_MAX_RUNNING]
+    now = timezone.now()
+    window_start = now - timedelta(seconds=settings.BACKUP_FAIR_SHARE_WINDOW)
+    started = dict(BackupJob.objects.filter(started_at__gte=window_start)
+                   .values_list('fyle_org_id').annotate(count=Count('id')).order_by())
+    queued = BackupJob.objects.filter(Q(run_after=None) | Q(run_after__lte=now),
+                                      state=JobState.QUEUED).exclude(
+        backup_id__in=Backups.objects.filter(user_id__in=busy_users).values('id'))
+    orgs = [org for org in queued.values_list('fyle_org_id').annotate(first_id=Min('id'))
+            .order_by() if running_orgs.get(org[0], 0) < settings.BACKUP_ORG_MAX_RUNNING]
+    orgs.sort(key=lambda org: (get_org_finish_tag(org[0], started), org[1]))
+    skip_locked = connection.features.has_select_for_update_skip_locked
+    for fyle_org_id, _ in orgs:
+        job = queued.select_for_update(skip_locked=skip_locked) \
+                    .filter(fyle_org_id=fyle_org_id).first()
+        if job is None:
+            continue
+        job.state = JobState.RUNNING
+        job.worker = worker
+        job.started_at = timezone.now()
+        job.heartbeat_at = job.started_at
+        job.attempts += 1
+        job.save()
+        return job
+    return None
+
+
+def requeue_stale_jobs():
+    """
+    Queue again the jobs left running by a worker that died, found by a heartbeat
+    older than BACKUP_JOB_STALE_AFTER. Jobs out of attempts fail instead.
+    :return: number of jobs queued again
+    """
+    now = timezone.now()
+    stale_before = now - timedelta(seconds=settings.BACKUP_JOB_STALE_AFTER)
+    stale = BackupJob.objects.filter(Q(heartbeat_at__lt=stale_before) |
+                                     Q(heartbeat_at=None, started_at__lt=stale_before),
+                                     state=JobState.RUNNING)
+    failed = stale.filter(attempts__gte=settings.BACKUP_JOB_MAX_ATTEMPTS)
+    for job in failed.select_related('backup'):
+        logger.error('Job %s for backup_id: %s is stale after %s attempt(s)', job.id,
+                     job.backup_id, job.attempts)
+        job.backup.current_state = 'FAILED'
+        job.backup.save()
+        share_backup_result(job.backup)
+    failed.update(state=JobState.FAILED, finished_at=now)
+    count = stale.update(state=JobState.QUEUED, worker=None, started_at=None,
+                         heartbeat_at=None)
+    if count:
+        logger.info('Queued %s stale backup job(s) again', count)
+    return count
+
+
+def run_backup_job(job):
+    """
+    Run the backup of a claimed job and record the outcome
+    :param job: BackupJob object
+    """
+    logger.info('Worker %s running job %s for backup_id: %s', job.worker, job.id, job.backup_id)
+    try:
+        is_success = fetch_and_notify_expenses(job.backup)
+    except Exception as e:
+        logger.error('Job %s for backup_id: %s failed. Error: %s', job.id, job.backup_id, e)
+        is_success = False
+    finish_backup_job(job, is_success)
+
+
+def finish_backup_job(job, is_success):
+    """
+    Record the outcome of a job. A failed job is queued again after a backoff
+    until it has run BACKUP_JOB_MAX_ATTEMPTS times, and resumes from its checkpoint.
+    :param job: BackupJob object
+    :param is_success: whether the backup succeeded
+    """
+    if not is_success and job.attempts < settings.BACKUP_JOB_MAX_ATTEMPTS:
+        delay = settings.BACKUP_JOB_RETRY_BACKOFF * 2 ** (job.attempts - 1)
+        logger.info('Job %s for backup_id: %s failed attempt %s/%s, queued again in %ss',
+                    job.id, job.backup_id, job.attempts, settings.BACKUP_JOB_MAX_ATTEMPTS,
+                    delay)
+        job.state = JobState.QUEUED
+        job.worker = None
+        job.started_at = None
+        job.heartbeat_at = None
+        job.run_after = timezone.now() + timedelta(seconds=delay)
+        job.save()
+        # The backup and the backups sharing its outcome are not done yet
+        Backups.objects.filter(Q(id=job.backup_id) | Q(coalesced_into_id=job.backup_id)) \
+                       .update(current_state='ONGOING')
+        return
+    job.state = JobState.DONE if is_success else JobState.FAILED
+    job.finished_at = timezone.now()
+    job.save()
+    logger.info('Fyle API stats of org %s: %s, attachments: %s', job.fyle_org_id,
+                get_fyle_api_throttle(job.fyle_org_id).get_stats(),
+                get_fyle_api_throttle(job.fyle_org_id, attachments=True).get_stats())
+
+
+def run_backup_worker(worker, stop_event, poll_interval=None, exit_when_idle=False):
+    """
+    Process queued jobs until stop_event is set
+    :param worker: name of this worker
+    :param stop_event: threading.Event to stop the worker
+    :param poll_interval: seconds to wait on an empty queue,
+    settings.BACKUP_WORKER_POLL_INTERVAL by default
+    :param exit_when_idle: return once the queue is empty
+    """
+    if poll_interval is None:
+        poll_interval = settings.BACKUP_WORKER_POLL_INTERVAL
+    while not stop_event.is_set():
+        close_old_connections()
+        job = claim_backup_job(worker)
+        if job is None:
+            if exit_when_idle:
+                return
+            stop_event.wait(poll_interval)
+            continue
+        run_backup_job(job)
+
+
+def start_backup_workers(concurrency=None, **kwargs):
+    """
+    Start worker threads in this process
+    :param concurrency: number of workers, settings.BACKUP_WORKER_CONCURRENCY by default
+    :return: (stop_event, threads)
+    """
+    concurrency = concurrency or settings.BACKUP_WORKER_CONCURRENCY
+    stop_event = threading.Event()
+    threads = []
+    for index in range(concurrency):
+        worker = '{0}:{1}:{2}'.format(socket.gethostname(), os.getpid(), index)
+        thread = threading.Thread(target=run_backup_worker, name=worker,
+                                  args=(worker, stop_event), kwargs=kwargs, daemon=True)
+        thread.start()
+        threads.append(thread)
+    return stop_event, threads
@@ -0,0 +1,21 @@
+def make_expense_pages(expenses, page_size, attachment_ratio=0):
+    """
+    Generate pages of synthetic expenses with nested fields, one page at a time
+    :param expenses: number of expenses
+    :param page_size: expenses per page
+    :param attachment_ratio: share of the expenses that have attachments
+    """
+    every = round(1 / attachment_ratio) if attachment_ratio else 0
+    for start in range(0, expenses, page_size):
+        yield [{
+            'id': 'tx{0}'.format(i),
+            'amount': i % 10000 / 100,
+            'currency': 'USD',
+            'state': 'PAID',
+            'spent_at': '2020-03-17T10:20:30.123Z',
+            'updated_at': '2020-03-18T08:00:00.000Z',
+            'has_attachments': bool(every) and i % every == 0,
+            'employee': {'id': 'ou{0}'.format(i % 100),
+                         'email': 'user{0}@test.com'.format(i % 100)},
+            'custom_properties': [{'name': 'Project', 'value': 'Backup {0}'.format(i % 7)}]
+        } for i in range(start, min(start + page_size, expenses))]
@@ -0,0 +1,49 @@
+import os
+import tempfile
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand
+
+from apps.data_fetcher.formats import get_data_file_extension
+from apps.data_fetcher.management.benchmarks import make_expense_pages
+from apps.data_fetcher.utils import Dumper, DirectoryArchive
+from fyle_backup_app import settings
+
+
+class Command(BaseCommand):
+    """
+    Compare the data file writers of the backup formats on synthetic expenses
+    """
+    help = 'Benchmark time, peak memory and file size of the backup data formats'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000000,
+                            help='Number of synthetic expenses to write')
+        parser.add_argument('--formats', nargs='+', default=['CSV', 'JSONL', 'JSONL_GZ'],
+                            help='Data formats to benchmark')
+        parser.add_argument('--memory', action='store_true',
+                            help='Trace peak memory, slows down the writers')
+
+    def handle(self, *args, **options):
+        page_size = settings.EXPENSES_PAGE_SIZE
+        for data_format in options['formats']:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                archive = DirectoryArchive(os.path.join(tmp_dir, 'benchmark'))
+                dumper = Dumper(None, name='benchmark', data_format=data_format)
+                if options['memory']:
+                    tracemalloc.start()
+                start = time.perf_counter()
+                for page in make_expense_pages(options['rows'], page_size):
+                    dumper.dump_page(archive, page)
+                dumper.close_data_file()
+                archive.abort()
+                elapsed = time.perf_counter() - start
+                peak = 0
+                if options['memory']:
+                    peak = tracemalloc.get_traced_memory()[1]
+                    tracemalloc.stop()
+                filename = 'benchmark' + get_data_file_extension(data_format)
+                size = os.path.getsize(os.path.join(archive.dir_name, filename))
+            self.stdout.write('{0:<12} {1:8.2f} s {2:10.1f} MB file {3:8.1f} MB peak'.format(
+                data_format, elapsed, size / 1024 / 1024, peak / 1024 / 1024))
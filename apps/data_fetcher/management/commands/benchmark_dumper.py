@@ -0,0 +1,258 @@
+import base64
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from django.core.management.base import BaseCommand
+
+from apps.data_fetcher.management.benchmarks import make_expense_pages
+from apps.data_fetcher.utils import CloudStorage, Dumper
+from fyle_backup_app import settings
+
+
+class FakeFyleConnection():
+    """
+    Stands in for FyleSdkConnector, serving the same base64 attachments for every expense
+    """
+    def __init__(self, attachments, attachment_size):
+        content = base64.b64encode(os.urandom(attachment_size)).decode()
+        self.attachments = [{'filename': 'receipt{0}.pdf'.format(index), 'content': content}
+                            for index in range(attachments)]
+
+    def extract_attachments(self, expense_id):
+        return {'data': [dict(attachment) for attachment in self.attachments]}
+
+
+class FakeS3Client():
+    """
+    Stands in for the boto3 S3 client, writing objects to a local directory
+    """
+    def __init__(self, root):
+        self.root = root
+        self.bytes_uploaded = 0
+        self.lock = threading.Lock()
+
+    def object_path(self, key, part_number=None):
+        name = key.replace('/', '_')
+        if part_number is not None:
+            name = '{0}.part{1:05d}'.format(name, part_number)
+        return os.path.join(self.root, name)
+
+    def count(self, size):
+        with self.lock:
+            self.bytes_uploaded += size
+
+    def create_multipart_upload(self, Bucket, Key):
+        return {'UploadId': uuid.uuid4().hex}
+
+    def upload_part(self, Bucket, Key, PartNumber, UploadId, Body):
+        with open(self.object_path(Key, PartNumber), 'wb') as part_file:
+            part_file.write(Body)
+        self.count(len(Body))
+        return {'ETag': str(PartNumber)}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        with open(self.object_path(Key), 'wb') as object_file:
+            for part in MultipartUpload['Parts']:
+                part_path = self.object_path(Key, part['PartNumber'])
+                with open(part_path, 'rb') as part_file:
+                    shutil.copyfileobj(part_file, object_file)
+                os.remove(part_path)
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        pass
+
+    def put_object(self, Bucket, Key, Body):
+        with open(self.object_path(Key), 'wb') as object_file:
+            if isinstance(Body, bytes):
+                object_file.write(Body)
+            else:
+                shutil.copyfileobj(Body, object_file)
+        self.count(os.path.getsize(self.object_path(Key)))
+
+    def upload_file(self, Filename, Bucket, Key, Config=None):
+        shutil.copyfile(Filename, self.object_path(Key))
+        self.count(os.path.getsize(Filename))
+
+
+def get_rss():
+    """
+    Resident memory of this process in bytes, the peak so far where /proc is missing
+    """
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def get_disk_usage(path):
+    """
+    Bytes of the files under a directory
+    """
+    size = 0
+    for dir_path, _, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                size += os.path.getsize(os.path.join(dir_path, filename))
+            except OSError:
+                pass
+    return size
+
+
+class ResourceSampler(threading.Thread):
+    """
+    Track the peak resident memory and temp disk usage while a benchmark runs
+    """
+    def __init__(self, tmp_dir, interval):
+        super().__init__(daemon=True)
+        self.tmp_dir = tmp_dir
+        self.interval = interval
+        self.stop_event = threading.Event()
+        self.start_rss = get_rss()
+        self.peak_rss = self.start_rss
+        self.peak_disk = 0
+
+    def sample(self):
+        self.peak_rss = max(self.peak_rss, get_rss())
+        self.peak_disk = max(self.peak_disk, get_disk_usage(self.tmp_dir))
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            self.sample()
+
+    def stop(self):
+        self.stop_event.set()
+        self.join()
+        self.sample()
+
+
+def get_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    """
+    Run Dumper.dump_data and the upload end to end on a synthetic org, with the Fyle
+    API and S3 replaced by local fakes
+    """
+    help = 'Benchmark throughput, peak RSS and temp disk usage of the backup pipeline'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--expenses', type=int, default=100000,
+                            help='Number of synthetic expenses')
+        parser.add_argument('--attachment-ratio', type=float, default=0.1,
+                            help='Share of the expenses that have attachments')
+        parser.add_argument('--attachments', type=int, default=1,
+                            help='Attachments per expense with attachments')
+        parser.add_argument('--attachment-size', type=int, default=200,
+                            help='Size of each attachment in KB')
+        parser.add_argument('--archive-modes', nargs='+',
+                            default=['directory', 'stream', 'multipart'],
+                            help='Archive modes to benchmark')
+        parser.add_argument('--formats', nargs='+', default=['CSV'],
+                            help='Data formats to benchmark')
+        parser.add_argument('--sample-interval', type=float, default=0.05,
+                            help='Seconds between memory and disk samples')
+        parser.add_argument('--output', help='Write the results to this JSON file')
+        parser.add_argument('--compare', help='JSON results of an earlier run to compare with')
+
+    def run_once(self, archive_mode, data_format, options):
+        """
+        Dump and upload one synthetic backup
+        :return: dict of measurements
+        """
+        connection = FakeFyleConnection(options['attachments'], options['attachment_size'] * 1024)
+        with tempfile.TemporaryDirectory() as tmp_dir, \
+                tempfile.TemporaryDirectory() as bucket_dir:
+            s3_client = FakeS3Client(bucket_dir)
+            s3_clients = CloudStorage._s3_clients
+            CloudStorage._s3_clients = {os.getpid(): s3_client}
+            pages = make_expense_pages(options['expenses'], settings.EXPENSES_PAGE_SIZE,
+                                       options['attachment_ratio'])
+            dumper = Dumper(connection, path=tmp_dir + '/', pages=pages,
+                            fyle_org_id='orBenchmark', name='benchmark',
+                            download_attachments=options['attachments'] > 0,
+                            archive_mode=archive_mode, dedup_attachments=False,
+                            data_format=data_format)
+            sampler = ResourceSampler(tmp_dir, options['sample_interval'])
+            sampler.start()
+            start = time.perf_counter()
+            try:
+                file_path = dumper.dump_data()
+                if archive_mode != 'multipart':
+                    CloudStorage().upload(file_path, 'orBenchmark')
+                elapsed = time.perf_counter() - start
+            finally:
+                sampler.stop()
+                CloudStorage._s3_clients = s3_clients
+        archive_mb = s3_client.bytes_uploaded / 1024 / 1024
+        return {
+            'archive_mode': archive_mode,
+            'data_format': data_format,
+            'seconds': round(elapsed, 3),
+            'expenses_per_second': round(options['expenses'] / elapsed, 1),
+            'archive_mb': round(archive_mb, 2),
+            'mb_per_second': round(archive_mb / elapsed, 2),
+            'peak_rss_mb': round(sampler.peak_rss / 1024 / 1024, 1),
+            'rss_growth_mb': round((sampler.peak_rss - sampler.start_rss) / 1024 / 1024, 1),
+            'peak_disk_mb': round(sampler.peak_disk / 1024 / 1024, 2)
+        }
+
+    def compare(self, results, path):
+        """
+        Print the change of each measurement against an earlier run
+        """
+        with open(path) as previous_file:
+            previous = json.load(previous_file)
+        previous_runs = {(run['archive_mode'], run['data_format']): run
+                         for run in previous['results']}
+        self.stdout.write('Compared with {0} ({1}):'.format(path, previous.get('commit')))
+        for run in results:
+            before = previous_runs.get((run['archive_mode'], run['data_format']))
+            if before is None:
+                continue
+            changes = ['{0} {1:+.1f}%'.format(key, (run[key] - before[key]) / before[key] * 100)
+                       for key in ('seconds', 'peak_rss_mb', 'rss_growth_mb', 'peak_disk_mb')
+                       if before[key]]
+            self.stdout.write('{0:<10} {1:<10} {2}'.format(run['archive_mode'],
+                                                          run['data_format'], ', '.join(changes)))
+
+    def handle(self, *args, **options):
+        results = []
+        for archive_mode in options['archive_modes']:
+            for data_format in options['formats']:
+                run = self.run_once(archive_mode, data_format, options)
+                results.append(run)
+                self.stdout.write(
+                    '{archive_mode:<10} {data_format:<10} {seconds:8.2f} s '
+                    '{expenses_per_second:10.0f} expenses/s {mb_per_second:8.2f} MB/s '
+                    '{peak_rss_mb:8.1f} MB peak RSS (+{rss_growth_mb:.1f}) '
+                    '{peak_disk_mb:8.1f} MB peak disk'.format(**run))
+
+        report = {
+            'commit': get_commit(),
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'parameters': {key: options[key] for key in ('expenses', 'attachment_ratio',
+                                                         'attachments', 'attachment_size')},
+            'results': results
+        }
+        if options['output']:
+            with open(options['output'], 'w') as output_file:
+                json.dump(report, output_file, indent=2)
+            self.stdout.write('Results written to {0}'.format(options['output']))
+        if options['compare']:
+            self.compare(results, options['compare'])
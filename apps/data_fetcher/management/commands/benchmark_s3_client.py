@@ -0,0 +1,45 @@
+import time
+
+import boto3
+from django.core.management.base import BaseCommand
+
+from apps.data_fetcher.utils import CloudStorage
+from fyle_backup_app import settings
+
+
+class Command(BaseCommand):
+    """
+    Compare a fresh boto3 S3 client per call against the shared CloudStorage client
+    """
+    help = 'Benchmark per-call cost of creating S3 clients vs reusing the pooled client'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--calls', type=int, default=200,
+                            help='Number of presigned URLs to generate per run')
+
+    def handle(self, *args, **options):
+        calls = options['calls']
+        object_name = 'benchmark/backup.zip'
+
+        def presign(s3_client):
+            s3_client.generate_presigned_url('get_object',
+                                             Params={'Bucket': settings.S3_BUCKET_NAME,
+                                                     'Key': object_name},
+                                             ExpiresIn=60)
+
+        start = time.perf_counter()
+        for _ in range(calls):
+            presign(boto3.client('s3', aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
+                                 aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
+                                 region_name=settings.S3_REGION_NAME))
+        fresh = (time.perf_counter() - start) / calls
+
+        CloudStorage.get_s3_client()
+        start = time.perf_counter()
+        for _ in range(calls):
+            presign(CloudStorage.get_s3_client())
+        pooled = (time.perf_counter() - start) / calls
+
+        self.stdout.write('fresh client per call: {0:.3f} ms'.format(fresh * 1000))
+        self.stdout.write('pooled client:         {0:.3f} ms'.format(pooled * 1000))
+        self.stdout.write('saved per call:        {0:.3f} ms'.format((fresh - pooled) * 1000))
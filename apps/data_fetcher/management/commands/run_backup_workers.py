@@ -0,0 +1,78 @@
+import asyncio
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from fyle_backup_app import settings
+
+from apps.data_fetcher import metrics
+from apps.data_fetcher.engine import AsyncBackupEngine
+from apps.data_fetcher.jobs import start_backup_workers, requeue_stale_jobs, get_queue_stats
+
+
+class Command(BaseCommand):
+    """
+    Run backup workers that process the queued backups
+    """
+    help = 'Process queued backups with a pool of worker threads'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=None,
+                            help='Number of workers, BACKUP_WORKER_CONCURRENCY by default')
+        parser.add_argument('--poll-interval', type=float, default=None,
+                            help='Seconds to wait when the queue is empty')
+        parser.add_argument('--once', action='store_true',
+                            help='Exit once the queue is drained')
+        parser.add_argument('--stats', action='store_true',
+                            help='Print the queue depth and exit')
+        parser.add_argument('--engine', choices=['threads', 'async'], default=None,
+                            help='Worker threads, or backups as coroutines on one event loop. '
+                                 'BACKUP_ENGINE by default')
+        parser.add_argument('--metrics-port', type=int, default=None,
+                            help='Serve the backup metrics of the workers on this port')
+
+    def handle(self, *args, **options):
+        if options['stats']:
+            self.stdout.write(json.dumps(get_queue_stats(), indent=2))
+            return
+
+        if options['metrics_port']:
+            if metrics.prometheus_client is None:
+                raise CommandError('Install prometheus_client to serve metrics')
+            metrics.prometheus_client.start_http_server(options['metrics_port'],
+                                                        registry=metrics.get_metrics_registry())
+
+        if (options['engine'] or settings.BACKUP_ENGINE) == 'async':
+            self.run_async_engine(options)
+            return
+
+        requeue_stale_jobs()
+        stop_event, threads = start_backup_workers(options['concurrency'],
+                                                   poll_interval=options['poll_interval'],
+                                                   exit_when_idle=options['once'])
+        self.stdout.write('Started {0} backup worker(s)'.format(len(threads)))
+        try:
+            for thread in threads:
+                while thread.is_alive():
+                    thread.join(timeout=1)
+        except KeyboardInterrupt:
+            self.stdout.write('Stopping after the running backups finish')
+            stop_event.set()
+            for thread in threads:
+                thread.join()
+
+    def run_async_engine(self, options):
+        """
+        Run the backups as coroutines, with --concurrency backups at a time
+        """
+        engine = AsyncBackupEngine(options['concurrency'], poll_interval=options['poll_interval'])
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        self.stdout.write('Started the async backup engine')
+        try:
+            loop.run_until_complete(engine.start(exit_when_idle=options['once']))
+        except KeyboardInterrupt:
+            self.stdout.write('Stopping after the running backups finish')
+            loop.run_until_complete(engine.stop())
+        finally:
+            loop.close()
@@ -0,0 +1,104 @@
+import os
+import time
+from contextlib import contextmanager
+
+try:
+    import prometheus_client
+    from prometheus_client import multiprocess
+except ImportError:
+    prometheus_client = None
+
+
+class NoopMetric():
+    """
+    Stands in for prometheus metrics when prometheus_client is not installed
+    """
+    def labels(self, *args, **kwargs):
+        return self
+
+    def observe(self, amount):
+        pass
+
+    def inc(self, amount=1):
+        pass
+
+
+def make_metric(kind, name, documentation, labelnames=(), **kwargs):
+    """
+    :param kind: 'Counter' or 'Histogram'
+    :return: prometheus metric, or NoopMetric without prometheus_client
+    """
+    if prometheus_client is None:
+        return NoopMetric()
+    return getattr(prometheus_client, kind)(name, documentation, labelnames, **kwargs)
+
+
+# Seconds, from single API pages up to backups of large orgs
+DURATION_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600, 7200)
+
+STAGE_SECONDS = make_metric('Histogram', 'fyle_backup_stage_seconds',
+                            'Time spent per backup in each stage: extract, dump, attachments, '
+                            'archive, upload and notify', ['stage'], buckets=DURATION_BUCKETS)
+BACKUP_SECONDS = make_metric('Histogram', 'fyle_backup_duration_seconds',
+                             'Total time of a backup by outcome', ['outcome'],
+                             buckets=DURATION_BUCKETS)
+BACKUP_ROWS = make_metric('Counter', 'fyle_backup_rows', 'Expenses written to backups',
+                          ['data_format'])
+BACKUP_ATTACHMENTS = make_metric('Counter', 'fyle_backup_attachments',
+                                 'Attachments written to backups or the attachment store')
+BACKUP_BYTES = make_metric('Counter', 'fyle_backup_bytes',
+                           'Bytes of backup archives and of the attachments in them', ['kind'])
+
+
+class StageTimer():
+    """
+    Adds up the time a backup spends in each stage, as stages interleave page by page,
+    and records the totals once the backup is done
+    """
+    def __init__(self):
+        self.seconds = {}
+
+    @contextmanager
+    def time(self, stage):
+        """
+        Context manager adding the time spent in its block to a stage
+        :param stage: stage name
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[stage] = self.seconds.get(stage, 0) + time.perf_counter() - start
+
+    def iterate(self, stage, iterable):
+        """
+        Iterate, adding the time spent waiting for each item to a stage
+        :param stage: stage name
+        :param iterable: iterable to time, e.g. lazily fetched pages
+        """
+        iterator = iter(iterable)
+        while True:
+            with self.time(stage):
+                item = next(iterator, StopIteration)
+            if item is StopIteration:
+                return
+            yield item
+
+    def observe(self):
+        """
+        Record the stage totals in the stage histogram
+        """
+        for stage, seconds in self.seconds.items():
+            STAGE_SECONDS.labels(stage).observe(seconds)
+
+
+def get_metrics_registry():
+    """
+    Registry to expose. With PROMETHEUS_MULTIPROC_DIR set, the web and backup worker
+    processes write their metrics there and they are collected across processes.
+    """
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR') or os.environ.get('prometheus_multiproc_dir'):
+        registry = prometheus_client.CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+    return prometheus_client.REGISTRY
@@ -0,0 +1,36 @@
+# Generated by Django 3.0.4 on 2026-10-17 21:19
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('backups', '0003_archived_attachments'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BackupJob',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('fyle_org_id', models.CharField(help_text='Fyle org_id of the backup', max_length=255)),
+                ('state', models.CharField(choices=[('QUEUED', 'Queued'), ('RUNNING', 'Running'), ('DONE', 'Done'), ('FAILED', 'Failed')], default='QUEUED', help_text='Current state of the job', max_length=16)),
+                ('worker', models.CharField(help_text='Worker running the job', max_length=255, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True, help_text='Created at datetime')),
+                ('started_at', models.DateTimeField(help_text='Started at datetime', null=True)),
+                ('finished_at', models.DateTimeField(help_text='Finished at datetime', null=True)),
+                ('backup', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='backups.Backups')),
+            ],
+            options={
+                'ordering': ['id'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='backupjob',
+            index=models.Index(fields=['state', 'fyle_org_id'], name='data_fetche_state_febe93_idx'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 3.0.4 on 2026-10-17 21:22
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backups', '0003_archived_attachments'),
+        ('data_fetcher', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BackupCheckpoint',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('stage', models.CharField(choices=[('DUMPING', 'Dumping'), ('ARCHIVED', 'Archived'), ('UPLOADED', 'Uploaded')], default='DUMPING', help_text='Last completed stage', max_length=16)),
+                ('page_size', models.IntegerField(help_text='Expenses per page when the backup started')),
+                ('pages_done', models.IntegerField(default=0, help_text='Pages completely written')),
+                ('attachments_done', models.IntegerField(default=0, help_text='Expenses whose attachments are written')),
+                ('dumper_state', models.TextField(help_text='State to resume the dump from', null=True)),
+                ('file_path', models.CharField(help_text='Local archive path', max_length=512, null=True)),
+                ('upload_id', models.CharField(help_text='Multipart upload id', max_length=1024, null=True)),
+                ('upload_part_size', models.IntegerField(help_text='Bytes per uploaded part', null=True)),
+                ('uploaded_parts', models.TextField(default='[]', help_text='Parts uploaded so far')),
+                ('modified_at', models.DateTimeField(auto_now=True, help_text='Updated at datetime')),
+                ('backup', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to='backups.Backups')),
+            ],
+        ),
+    ]
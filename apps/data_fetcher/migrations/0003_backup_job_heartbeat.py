@@ -0,0 +1,18 @@
+# Generated by Django 3.0.4 on 2026-10-17 21:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data_fetcher', '0002_backup_checkpoints'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='backupjob',
+            name='heartbeat_at',
+            field=models.DateTimeField(help_text='Last heartbeat of the running job', null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.0.4 on 2026-10-17 21:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data_fetcher', '0003_backup_job_heartbeat'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='backupcheckpoint',
+            name='shards',
+            field=models.TextField(help_text='Shards of the expenses query and their pages written', null=True),
+        ),
+    ]
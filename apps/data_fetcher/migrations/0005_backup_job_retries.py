@@ -0,0 +1,23 @@
+# Generated by Django 3.0.4 on 2026-10-17 22:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data_fetcher', '0004_checkpoint_shards'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='backupjob',
+            name='attempts',
+            field=models.IntegerField(default=0, help_text='Times the job was claimed'),
+        ),
+        migrations.AddField(
+            model_name='backupjob',
+            name='run_after',
+            field=models.DateTimeField(help_text='Queued job waits until then', null=True),
+        ),
+    ]
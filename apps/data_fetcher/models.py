@@ -1,3 +1,72 @@
 from django.db import models
+from apps.backups.models import Backups
 
-# Create your models here.
+
+class JobState(models.TextChoices):
+    """
+    States of a queued backup job
+    """
+    QUEUED = 'QUEUED'
+    RUNNING = 'RUNNING'
+    DONE = 'DONE'
+    FAILED = 'FAILED'
+
+
+class BackupJob(models.Model):
+    """
+    Queue of backups waiting to be processed by the backup workers
+    """
+    id = models.AutoField(primary_key=True)
+    backup = models.ForeignKey(Backups, on_delete=models.CASCADE)
+    fyle_org_id = models.CharField(max_length=255, help_text='Fyle org_id of the backup')
+    state = models.CharField(max_length=16, choices=JobState.choices, default=JobState.QUEUED,
+                             help_text='Current state of the job')
+    worker = models.CharField(max_length=255, null=True, help_text='Worker running the job')
+    created_at = models.DateTimeField(auto_now_add=True, help_text='Created at datetime')
+    started_at = models.DateTimeField(null=True, help_text='Started at datetime')
+    finished_at = models.DateTimeField(null=True, help_text='Finished at datetime')
+    heartbeat_at = models.DateTimeField(null=True,
+                                        help_text='Last heartbeat of the running job')
+    attempts = models.IntegerField(default=0, help_text='Times the job was claimed')
+    run_after = models.DateTimeField(null=True, help_text='Queued job waits until then')
+
+    def __str__(self):
+        return '{0} ({1})'.format(self.backup_id, self.state)
+
+    class Meta:
+        ordering = ['id']
+        indexes = [models.Index(fields=['state', 'fyle_org_id'])]
+
+
+class CheckpointStage(models.TextChoices):
+    """
+    Stages of a backup that can be resumed
+    """
+    DUMPING = 'DUMPING'
+    ARCHIVED = 'ARCHIVED'
+    UPLOADED = 'UPLOADED'
+
+
+class BackupCheckpoint(models.Model):
+    """
+    Progress of a backup, so that a retried backup resumes where it stopped
+    """
+    id = models.AutoField(primary_key=True)
+    backup = models.OneToOneField(Backups, on_delete=models.CASCADE)
+    stage = models.CharField(max_length=16, choices=CheckpointStage.choices,
+                             default=CheckpointStage.DUMPING, help_text='Last completed stage')
+    page_size = models.IntegerField(help_text='Expenses per page when the backup started')
+    pages_done = models.IntegerField(default=0, help_text='Pages completely written')
+    attachments_done = models.IntegerField(default=0,
+                                           help_text='Expenses whose attachments are written')
+    dumper_state = models.TextField(null=True, help_text='State to resume the dump from')
+    shards = models.TextField(null=True, help_text='Shards of the expenses query and their '
+                                                   'pages written')
+    file_path = models.CharField(max_length=512, null=True, help_text='Local archive path')
+    upload_id = models.CharField(max_length=1024, null=True, help_text='Multipart upload id')
+    upload_part_size = models.IntegerField(null=True, help_text='Bytes per uploaded part')
+    uploaded_parts = models.TextField(default='[]', help_text='Parts uploaded so far')
+    modified_at = models.DateTimeField(auto_now=True, help_text='Updated at datetime')
+
+    def __str__(self):
+        return '{0} ({1})'.format(self.backup_id, self.stage)
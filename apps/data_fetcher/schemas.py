@@ -0,0 +1,127 @@
+import json
+
+# Fields that are not columns of the schema are kept in this column as a JSON object
+EXTRA_FIELDS_COLUMN = 'extra_fields'
+
+# Column order of the backup files per object type and schema version. Columns of a
+# released version never change, new fields go into a new version.
+SCHEMAS = {
+    'expenses': {
+        1: [
+            'id', 'org_id', 'org_name', 'employee_id', 'employee_email', 'employee_code',
+            'employee_full_name', 'employee_title', 'employee_department',
+            'employee_department_id', 'employee_department_code', 'state', 'fund_source',
+            'amount', 'currency', 'foreign_amount', 'foreign_currency', 'purpose', 'vendor',
+            'category_id', 'category_code', 'category_name', 'sub_category', 'project_id',
+            'project_code', 'project_name', 'cost_center_id', 'cost_center_code',
+            'cost_center_name', 'report_id', 'settlement_id', 'reimbursement_id',
+            'reimbursable', 'billable', 'verified', 'paid', 'has_attachments',
+            'custom_properties', 'spent_at', 'created_at', 'updated_at', 'approved_at',
+            'verified_at', 'reimbursed_at'
+        ]
+    }
+}
+
+# Types of the columns in typed data formats like Parquet, other columns are strings.
+# Like the columns, the types of a released version never change.
+COLUMN_TYPES = {
+    'expenses': {
+        1: {
+            'amount': 'float', 'foreign_amount': 'float', 'reimbursable': 'bool',
+            'billable': 'bool', 'verified': 'bool', 'paid': 'bool', 'has_attachments': 'bool',
+            'spent_at': 'timestamp', 'created_at': 'timestamp', 'updated_at': 'timestamp',
+            'approved_at': 'timestamp', 'verified_at': 'timestamp', 'reimbursed_at': 'timestamp'
+        }
+    }
+}
+
+
+def flatten_fields(record, prefix=''):
+    """
+    Flatten nested objects into dotted keys, e.g. {'employee': {'id': 1}} becomes
+    {'employee.id': 1}. Lists are kept as JSON strings.
+    :param record: dict from the Fyle API
+    :param prefix: key prefix of the nested object
+    :return: flat dict
+    """
+    flat = {}
+    for key, value in record.items():
+        if isinstance(value, dict):
+            flat.update(flatten_fields(value, prefix + key + '.'))
+        elif isinstance(value, list):
+            flat[prefix + key] = json.dumps(value)
+        else:
+            flat[prefix + key] = value
+    return flat
+
+
+class Schema():
+    """
+    Fixed column layout of the backup files of an object type
+    """
+    def __init__(self, object_type, version):
+        """
+        :param object_type: object type of the backup, e.g. 'expenses'
+        :param version: schema version
+        """
+        self.object_type = object_type
+        self.version = version
+        self.columns = SCHEMAS[object_type][version]
+        self.column_set = set(self.columns)
+        self.column_types = COLUMN_TYPES.get(object_type, {}).get(version, {})
+
+    @property
+    def fieldnames(self):
+        """
+        Header of the backup file
+        """
+        return self.columns + [EXTRA_FIELDS_COLUMN]
+
+    def get_column_type(self, column):
+        """
+        :param column: column name
+        :return: 'string', 'float', 'bool' or 'timestamp'
+        """
+        return self.column_types.get(column, 'string')
+
+    def split_fields(self, record):
+        """
+        Flatten a record and split its fields into columns and extra fields
+        :param record: dict from the Fyle API
+        :return: (dict of column values, dict of the fields that are not columns)
+        """
+        row = {}
+        extra_fields = {}
+        for key, value in flatten_fields(record).items():
+            if key in self.column_set:
+                row[key] = value
+            else:
+                extra_fields[key] = value
+        return row, extra_fields
+
+    def to_row(self, record):
+        """
+        Flatten a record into the columns of the schema. Fields that are not
+        columns are kept as JSON in the extra fields column.
+        :param record: dict from the Fyle API
+        :return: dict with the keys of fieldnames, missing columns left out
+        """
+        row, extra_fields = self.split_fields(record)
+        if extra_fields:
+            row[EXTRA_FIELDS_COLUMN] = json.dumps(extra_fields, default=str)
+        return row
+
+
+def get_schema(object_type, version=None):
+    """
+    Get the schema of an object type
+    :param object_type: object type of the backup, e.g. 'expenses'
+    :param version: schema version, the latest by default
+    :return: Schema object
+    """
+    if object_type not in SCHEMAS or version is not None and \
+            version not in SCHEMAS[object_type]:
+        raise NotImplementedError
+    if version is None:
+        version = max(SCHEMAS[object_type])
+    return Schema(object_type, version)
@@ -1,3 +1,1044 @@
-from django.test import TestCase
+import asyncio
+import base64
+import binascii
+import csv
+import gzip
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import boto3
+import requests
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from moto import mock_s3
+
+from apps.data_fetcher.utils import FyleSdkConnector, Dumper, AttachmentDownloader, \
+    DirectoryArchive, ZipStreamArchive, S3MultipartWriter, FyleConnectionCache, \
+    get_incremental_updated_at, CloudStorage, fetch_and_notify_expenses, get_expense_shards, \
+    FyleApiThrottle, FyleApiRetryableError, parse_retry_after, check_response_throttling, \
+    get_http_session, iter_base64_chunks, record_job_heartbeat, get_fyle_api_stats
+from apps.backups.models import ArchivedAttachment, Backups, ObjectLookup
+from apps.data_fetcher.formats import is_columnar_available, is_zstd_available, pyarrow, \
+    zstandard
+from apps.data_fetcher.engine import AsyncBackupEngine, BackupEngineApplication
+from apps.data_fetcher.metrics import StageTimer, prometheus_client
+from apps.data_fetcher.jobs import enqueue_backup, claim_backup_job, get_queue_stats, \
+    run_backup_worker, requeue_stale_jobs
+from apps.data_fetcher.models import BackupJob, JobState, BackupCheckpoint, CheckpointStage
+from apps.data_fetcher.schemas import get_schema, EXTRA_FIELDS_COLUMN
+from apps.user.models import UserProfile
+from fyle_backup_app import settings
+
+
+def make_expenses(count, start=0):
+    """
+    Build synthetic expense dicts
+    """
+    return [{'id': 'tx{0}'.format(i), 'amount': i, 'has_attachments': False}
+            for i in range(start, start + count)]
+
+
+class ExpensesStreamingTest(SimpleTestCase):
+    """
+    Test cases for page by page expense extraction and dumping
+    """
+
+    def setUp(self):
+        self.connector = FyleSdkConnector.__new__(FyleSdkConnector)
+        self.connector.connection = mock.Mock()
+        self.expenses = make_expenses(7)
+
+        def get_page(offset, limit, **kwargs):
+            return {'data': self.expenses[offset:offset + limit]}
+        self.connector.connection.Expenses.get.side_effect = get_page
+
+    def test_iter_expenses_yields_pages(self):
+        pages = list(self.connector.iter_expenses(None, None, None, page_size=3))
+        self.assertEqual([len(page) for page in pages], [3, 3, 1])
+        self.assertEqual(self.connector.connection.Expenses.get.call_count, 3)
+
+    def test_dump_data_consumes_pages(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            pages = self.connector.iter_expenses(None, None, None, page_size=3)
+            dumper = Dumper(self.connector, path=tmp_dir + '/', pages=pages, name='test',
+                            fyle_org_id='orTest', download_attachments=False)
+            archive = dumper.dump_data()
+            dir_name = archive.split('.zip')[0]
+            with open(os.path.join(dir_name, 'test.csv')) as csv_file:
+                rows = list(csv.DictReader(csv_file))
+            self.assertEqual([row['id'] for row in rows], [e['id'] for e in self.expenses])
+
+
+class AttachmentDownloaderTest(SimpleTestCase):
+    """
+    Test cases for the concurrent attachment downloader
+    """
+
+    def setUp(self):
+        self.connector = mock.Mock()
+        self.calls = {}
+
+        def extract_attachments(expense_id):
+            self.calls[expense_id] = self.calls.get(expense_id, 0) + 1
+            if expense_id == 'tx1' and self.calls[expense_id] == 1:
+                raise ConnectionError('flaky')
+            return {'data': [{'filename': 'receipt.jpg',
+                              'content': base64.b64encode(expense_id.encode()).decode()}]}
+        self.connector.extract_attachments.side_effect = extract_attachments
+
+    @mock.patch.object(settings, 'ATTACHMENT_RETRY_BACKOFF', 0)
+    def test_download_is_ordered_and_retried(self):
+        downloader = AttachmentDownloader(self.connector, workers=3, retries=1)
+        expense_ids = ['tx{0}'.format(i) for i in range(10)]
+        results = list(downloader.download(expense_ids))
+        self.assertEqual([result[0] for result in results], expense_ids)
+        self.assertTrue(all(error is None for _, _, error in results))
+        self.assertEqual(self.calls['tx1'], 2)
+
+    @mock.patch.object(settings, 'ATTACHMENT_RETRY_BACKOFF', 0)
+    def test_dump_attachments_file_layout(self):
+        data = [{'id': 'tx1', 'has_attachments': True}, {'id': 'tx2', 'has_attachments': False}]
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            dir_name = os.path.join(tmp_dir, 'backup')
+            dumper = Dumper(self.connector, data=data, name='test')
+            dumper.dump_attachments(DirectoryArchive(dir_name))
+            self.assertEqual(os.listdir(dir_name), ['tx1_receipt.jpg'])
+            with open(os.path.join(dir_name, 'tx1_receipt.jpg'), 'rb') as attachment:
+                self.assertEqual(attachment.read(), b'tx1')
+
+    @mock.patch.object(settings, 'ATTACHMENT_RETRY_BACKOFF', 0)
+    def test_dump_data_stream_mode(self):
+        data = [{'id': 'tx1', 'has_attachments': True}, {'id': 'tx2', 'has_attachments': False}]
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            dumper = Dumper(self.connector, path=tmp_dir + '/', data=data, name='test',
+                            fyle_org_id='orTest', download_attachments=True,
+                            archive_mode='stream')
+            archive = dumper.dump_data()
+            self.assertEqual(os.listdir(tmp_dir), [os.path.basename(archive)])
+            with zipfile.ZipFile(archive) as zip_file:
+                self.assertEqual(sorted(zip_file.namelist()),
+                                 ['manifest.json', 'test.csv', 'tx1_receipt.jpg'])
+                self.assertEqual(zip_file.getinfo('tx1_receipt.jpg').compress_type,
+                                 zipfile.ZIP_STORED)
+                self.assertEqual(zip_file.getinfo('test.csv').compress_type,
+                                 zipfile.ZIP_DEFLATED)
+                self.assertEqual(zip_file.read('tx1_receipt.jpg'), b'tx1')
+
+
+class AttachmentDecodingTest(SimpleTestCase):
+    """
+    Test cases for decoding attachments in blocks
+    """
+
+    def test_chunks_decode_to_the_whole_attachment(self):
+        content = os.urandom(10000)
+        encoded = base64.b64encode(content).decode()
+        for chunk_size in (1, 3, 100, 1024, 20000):
+            chunks = list(iter_base64_chunks(encoded, chunk_size))
+            self.assertEqual(b''.join(chunks), content)
+            self.assertLessEqual(max(len(chunk) for chunk in chunks), max(chunk_size, 3))
+        self.assertEqual(b''.join(iter_base64_chunks(base64.encodebytes(content).decode(), 99)),
+                         content)
+        self.assertEqual(list(iter_base64_chunks('')), [b''])
+
+    def test_broken_padding_fails_before_writing(self):
+        encoded = base64.b64encode(os.urandom(1000)).decode()[:-1]
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            archive = DirectoryArchive(os.path.join(tmp_dir, 'backup'))
+            with self.assertRaises(binascii.Error):
+                archive.write_attachment('tx1_receipt.pdf', iter_base64_chunks(encoded, 100))
+            with open(os.path.join(archive.dir_name, 'tx1_receipt.pdf'), 'rb') as attachment:
+                self.assertEqual(attachment.read(), b'')
+
+    def test_payload_is_released_after_writing(self):
+        attachment = {'filename': 'receipt.pdf',
+                      'content': base64.b64encode(b'%PDF').decode()}
+        connector = mock.Mock()
+        connector.extract_attachments.return_value = {'data': [attachment]}
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            archive = ZipStreamArchive(os.path.join(tmp_dir, 'backup.zip'))
+            dumper = Dumper(connector, name='test', dedup_attachments=False)
+            dumper.dump_attachments(archive, [{'id': 'tx1', 'has_attachments': True}])
+            archive.close()
+            with zipfile.ZipFile(os.path.join(tmp_dir, 'backup.zip')) as zip_file:
+                self.assertEqual(zip_file.read('tx1_receipt.pdf'), b'%PDF')
+        self.assertNotIn('content', attachment)
+
+
+@mock_s3
+class S3MultipartWriterTest(SimpleTestCase):
+    """
+    Test cases for streaming multipart uploads, against a moto S3 stand-in
+    """
+    bucket = 'fyle-backup-test'
+
+    def setUp(self):
+        self.s3_client = boto3.client('s3', region_name='us-east-1')
+        self.s3_client.create_bucket(Bucket=self.bucket)
+
+    def test_upload_in_parts(self):
+        part_size = 5 * 1024 * 1024
+        body = os.urandom(2 * part_size + 1024)
+        writer = S3MultipartWriter(self.s3_client, self.bucket, 'orTest/backup.zip',
+                                   part_size=part_size, max_pending_parts=1)
+        for index in range(0, len(body), 64 * 1024):
+            writer.write(body[index:index + 64 * 1024])
+        writer.close()
+        self.assertEqual(len(writer.futures), 3)
+        response = self.s3_client.get_object(Bucket=self.bucket, Key='orTest/backup.zip')
+        self.assertEqual(response['Body'].read(), body)
+
+    def test_zip_stream_to_s3(self):
+        writer = S3MultipartWriter(self.s3_client, self.bucket, 'orTest/backup.zip')
+        archive = ZipStreamArchive(writer)
+        archive.write_attachment('tx1_receipt.pdf', b'%PDF')
+        archive.open_data_file('test.csv').write('id\ntx1\n')
+        archive.close()
+        response = self.s3_client.get_object(Bucket=self.bucket, Key='orTest/backup.zip')
+        with zipfile.ZipFile(io.BytesIO(response['Body'].read())) as zip_file:
+            self.assertEqual(zip_file.read('test.csv'), b'id\ntx1\n')
+            self.assertEqual(zip_file.read('tx1_receipt.pdf'), b'%PDF')
+
+    def test_abort(self):
+        writer = S3MultipartWriter(self.s3_client, self.bucket, 'orTest/backup.zip')
+        writer.write(b'partial')
+        writer.abort()
+        uploads = self.s3_client.list_multipart_uploads(Bucket=self.bucket)
+        self.assertFalse(uploads.get('Uploads'))
+
+
+@mock.patch('apps.data_fetcher.utils.FyleSDK')
+class FyleConnectionCacheTest(SimpleTestCase):
+    """
+    Test cases for the Fyle SDK connection cache
+    """
+
+    def test_connection_is_reused(self, fyle_sdk):
+        cache = FyleConnectionCache(max_size=2, ttl=60)
+        self.assertIs(cache.get('token1'), cache.get('token1'))
+        self.assertEqual(fyle_sdk.call_count, 1)
+
+    def test_expired_connection_is_refreshed(self, fyle_sdk):
+        cache = FyleConnectionCache(max_size=2, ttl=60)
+        cache.get('token1')
+        later = time.monotonic() + 61
+        with mock.patch('apps.data_fetcher.utils.time.monotonic', return_value=later):
+            cache.get('token1')
+        self.assertEqual(fyle_sdk.call_count, 2)
+
+    def test_least_recently_used_is_evicted(self, fyle_sdk):
+        cache = FyleConnectionCache(max_size=2, ttl=60)
+        cache.get('token1')
+        cache.get('token2')
+        cache.get('token1')
+        cache.get('token3')
+        self.assertEqual(list(cache.connections), ['token1', 'token3'])
+
+    def test_concurrent_refresh_exchanges_token_once(self, fyle_sdk):
+        cache = FyleConnectionCache(max_size=2, ttl=60)
+        fyle_sdk.side_effect = lambda **kwargs: time.sleep(0.05) or mock.Mock()
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            connections = list(executor.map(cache.get, ['token1'] * 8))
+        self.assertEqual(fyle_sdk.call_count, 1)
+        self.assertEqual(len(set(map(id, connections))), 1)
+
+    def test_failed_exchange_drops_lock(self, fyle_sdk):
+        cache = FyleConnectionCache(max_size=2, ttl=60)
+        fyle_sdk.side_effect = Exception('invalid_grant')
+        with self.assertRaises(Exception):
+            cache.get('token1')
+        self.assertEqual(cache.refresh_locks, {})
+
+
+class IncrementalBackupTest(SimpleTestCase):
+    """
+    Test cases for incremental backup watermarks
+    """
+
+    def test_updated_at_starts_at_watermark(self):
+        base_backup = mock.Mock(watermark=datetime(2020, 3, 17, 10, 20, 30, 123000,
+                                                   tzinfo=timezone.utc))
+        updated_at = get_incremental_updated_at(['gte:2020-01-01T00:00:00.000Z',
+                                                 'lte:2020-12-31T23:59:59.000Z'], base_backup)
+        self.assertEqual(updated_at, ['lte:2020-12-31T23:59:59.000Z',
+                                      'gte:2020-03-17T10:20:30.123Z'])
+
+    def test_manifest_records_watermark(self):
+        data = [{'id': 'tx1', 'updated_at': '2020-03-17T10:20:30.123Z', 'has_attachments': False},
+                {'id': 'tx2', 'updated_at': '2020-03-18T08:00:00.000Z', 'has_attachments': False}]
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            dumper = Dumper(mock.Mock(), path=tmp_dir + '/', data=data, name='test',
+                            fyle_org_id='orTest', archive_mode='stream',
+                            manifest={'backup_id': 2, 'incremental': True, 'base_backup_id': 1})
+            with zipfile.ZipFile(dumper.dump_data()) as zip_file:
+                manifest = json.loads(zip_file.read('manifest.json'))
+        self.assertEqual(manifest['base_backup_id'], 1)
+        self.assertEqual(manifest['expense_count'], 2)
+        self.assertEqual(manifest['watermark'], '2020-03-18T08:00:00.000Z')
+
+
+@mock_s3
+class AttachmentDedupTest(TestCase):
+    """
+    Test cases for the content addressed attachment store
+    """
+    bucket = 'fyle-backup-test'
+
+    def setUp(self):
+        boto3.client('s3', region_name='us-east-1').create_bucket(Bucket=self.bucket)
+        patchers = [mock.patch.object(settings, 'S3_BUCKET_NAME', self.bucket),
+                    mock.patch.object(settings, 'S3_REGION_NAME', 'us-east-1'),
+                    mock.patch.object(settings, 'CLOUD_STORAGE_PROVIDER', 'awss3'),
+                    mock.patch.object(CloudStorage, '_s3_clients', {})]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.connector = mock.Mock()
+        self.connector.extract_attachments.side_effect = lambda expense_id: {'data': [
+            {'filename': 'receipt.jpg', 'content': base64.b64encode(b'receipt').decode()}]}
+        self.data = [{'id': 'tx1', 'updated_at': '2020-03-17T10:20:30.123Z',
+                      'has_attachments': True},
+                     {'id': 'tx2', 'updated_at': '2020-03-17T10:20:30.123Z',
+                      'has_attachments': True}]
+
+    def dump(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            dumper = Dumper(self.connector, path=tmp_dir + '/', data=self.data, name='test',
+                            fyle_org_id='orTest', download_attachments=True,
+                            archive_mode='stream', dedup_attachments=True)
+            with zipfile.ZipFile(dumper.dump_data()) as zip_file:
+                return zip_file.namelist(), zip_file.read('attachments.csv').decode()
+
+    def test_unchanged_attachments_are_not_downloaded_again(self):
+        names, index = self.dump()
+        self.assertEqual(sorted(names), ['attachments.csv', 'manifest.json', 'test.csv'])
+        self.assertEqual(self.connector.extract_attachments.call_count, 2)
+        self.assertEqual(ArchivedAttachment.objects.values('content_hash').distinct().count(), 1)
+
+        names, second_index = self.dump()
+        self.assertEqual(self.connector.extract_attachments.call_count, 2)
+        self.assertEqual(sorted(index.splitlines()), sorted(second_index.splitlines()))
+
+        self.data[0]['updated_at'] = '2020-03-18T08:00:00.000Z'
+        self.dump()
+        self.assertEqual(self.connector.extract_attachments.call_count, 3)
+
+    def test_attachments_with_the_same_name_are_archived_once(self):
+        self.connector.extract_attachments.side_effect = lambda expense_id: {'data': [
+            {'filename': 'receipt.jpg', 'content': base64.b64encode(b'front').decode()},
+            {'filename': 'receipt.jpg', 'content': base64.b64encode(b'back').decode()}]}
+        self.dump()
+        self.assertEqual(self.connector.extract_attachments.call_count, 2)
+        self.dump()
+        self.assertEqual(self.connector.extract_attachments.call_count, 2)
+
+    def test_partly_archived_expense_is_downloaded_again(self):
+        invoice = {'filename': 'invoice.pdf', 'content': 'broken'}
+        self.connector.extract_attachments.side_effect = lambda expense_id: {'data': [
+            {'filename': 'receipt.jpg', 'content': base64.b64encode(b'receipt').decode()},
+            dict(invoice)]}
+        self.data = self.data[:1]
+        _, index = self.dump()
+        self.assertEqual(len(index.splitlines()), 2)
+
+        invoice['content'] = base64.b64encode(b'invoice').decode()
+        _, index = self.dump()
+        self.assertEqual(self.connector.extract_attachments.call_count, 2)
+        self.assertEqual(len(index.splitlines()), 3)
+
+        _, index = self.dump()
+        self.assertEqual(self.connector.extract_attachments.call_count, 2)
+        self.assertEqual(len(index.splitlines()), 3)
+
+
+class BackupQueueTest(TestCase):
+    """
+    Test cases for the backup job queue
+    """
+
+    def setUp(self):
+        self.user = UserProfile.objects.create_user(email='user1@test.com', password='foo')
+
+    def create_backup(self, fyle_org_id, user=None):
+        return Backups.objects.create(name='test', current_state='ONGOING',
+                                      object_type=ObjectLookup.expenses, filters='{}',
+                                      data_format='CSV', fyle_org_id=fyle_org_id,
+                                      user=user or self.user, fyle_refresh_token='token')
+
+    def test_enqueue_is_idempotent(self):
+        backup = self.create_backup('orA')
+        self.assertEqual(enqueue_backup(backup), enqueue_backup(backup))
+        self.assertEqual(get_queue_stats()['queued'], 1)
+
+    @mock.patch.object(settings, 'BACKUP_USER_MAX_RUNNING', 3)
+    def test_claim_is_fair_across_orgs(self):
+        for _ in range(3):
+            enqueue_backup(self.create_backup('orA'))
+        enqueue_backup(self.create_backup('orB'))
+        claimed = [claim_backup_job('worker').fyle_org_id for _ in range(3)]
+        self.assertEqual(claimed, ['orA', 'orB', 'orA'])
+        self.assertEqual(get_queue_stats()['orgs'], {'orA': {'queued': 1, 'running': 2},
+                                                     'orB': {'queued': 0, 'running': 1}})
+
+    @mock.patch.object(settings, 'BACKUP_ORG_MAX_RUNNING', 2)
+    @mock.patch.object(settings, 'BACKUP_USER_MAX_RUNNING', 1)
+    def test_claim_respects_running_limits(self):
+        other_user = UserProfile.objects.create_user(email='user2@test.com', password='foo')
+        for _ in range(2):
+            enqueue_backup(self.create_backup('orA'))
+        for user in (self.user, other_user):
+            for _ in range(2):
+                enqueue_backup(self.create_backup('orB', user))
+        claimed = [(job.fyle_org_id, job.backup.user_id) for job in
+                   iter(lambda: claim_backup_job('worker'), None)]
+        self.assertEqual(claimed, [('orA', self.user.id), ('orB', other_user.id)])
+
+        BackupJob.objects.filter(state=JobState.RUNNING, fyle_org_id='orA').update(
+            state=JobState.DONE)
+        self.assertEqual(claim_backup_job('worker').backup.user_id, self.user.id)
+        self.assertIsNone(claim_backup_job('worker'))
+
+    @mock.patch('apps.data_fetcher.jobs.connection')
+    def test_claim_waits_for_the_claim_lock(self, connection):
+        enqueue_backup(self.create_backup('orA'))
+        connection.vendor = 'mysql'
+        cursor = connection.cursor.return_value.__enter__.return_value
+        cursor.fetchone.return_value = (0,)
+        self.assertIsNone(claim_backup_job('worker'))
+        cursor.execute.assert_called_once_with('SELECT GET_LOCK(%s, %s)',
+                                               ['fyle_backup_job_claim', 10])
+
+        cursor.fetchone.return_value = (1,)
+        connection.features.has_select_for_update_skip_locked = False
+        self.assertIsNotNone(claim_backup_job('worker'))
+        cursor.execute.assert_called_with('SELECT RELEASE_LOCK(%s)', ['fyle_backup_job_claim'])
+
+    @mock.patch.object(settings, 'BACKUP_ORG_WEIGHTS', {'orA': 2})
+    def test_claim_is_weighted_by_recent_jobs(self):
+        for fyle_org_id in ('orA', 'orB', 'orC'):
+            for _ in range(4):
+                enqueue_backup(self.create_backup(fyle_org_id))
+        claimed = []
+        for _ in range(8):
+            job = claim_backup_job('worker')
+            job.state = JobState.DONE
+            job.save()
+            claimed.append(job.fyle_org_id)
+        self.assertEqual(claimed, ['orA', 'orA', 'orB', 'orC', 'orA', 'orA', 'orB', 'orC'])
+
+    def test_jobs_without_heartbeat_are_queued_again(self):
+        backup = self.create_backup('orA')
+        enqueue_backup(backup)
+        job = claim_backup_job('worker')
+        long_ago = datetime.now(timezone.utc) - timedelta(
+            seconds=settings.BACKUP_JOB_STALE_AFTER + 1)
+        BackupJob.objects.filter(id=job.id).update(started_at=long_ago, heartbeat_at=long_ago)
+        record_job_heartbeat(backup.id)
+        self.assertEqual(requeue_stale_jobs(), 0)
+
+        BackupJob.objects.filter(id=job.id).update(heartbeat_at=long_ago)
+        self.assertEqual(requeue_stale_jobs(), 1)
+        self.assertEqual(BackupJob.objects.get(id=job.id).state, JobState.QUEUED)
+
+    @mock.patch.object(settings, 'BACKUP_JOB_HEARTBEAT_INTERVAL', 0)
+    def test_dumper_sends_heartbeat_per_page(self):
+        heartbeat = mock.Mock()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            Dumper(mock.Mock(), path=tmp_dir + '/', pages=[make_expenses(2), make_expenses(2)],
+                   name='test', fyle_org_id='orTest', download_attachments=False,
+                   heartbeat=heartbeat).dump_data()
+        self.assertEqual(heartbeat.call_count, 2)
+
+    @mock.patch('apps.data_fetcher.jobs.fetch_and_notify_expenses', return_value=True)
+    def test_worker_drains_queue(self, fetch_and_notify_expenses):
+        enqueue_backup(self.create_backup('orA'))
+        enqueue_backup(self.create_backup('orB'))
+        run_backup_worker('worker', threading.Event(), exit_when_idle=True)
+        self.assertEqual(fetch_and_notify_expenses.call_count, 2)
+        self.assertEqual(BackupJob.objects.filter(state=JobState.DONE).count(), 2)
+
+
+class BackupCheckpointTest(TestCase):
+    """
+    Test cases for resuming failed backups from their checkpoint
+    """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        user = UserProfile.objects.create_user(email='user1@test.com', password='foo')
+        self.backup = Backups.objects.create(name='test', current_state='ONGOING',
+                                             object_type=ObjectLookup.expenses,
+                                             filters='{}', data_format='CSV',
+                                             fyle_org_id='orTest', user=user,
+                                             fyle_refresh_token='token')
+        self.expenses = make_expenses(7)
+        self.fail_at_offset = 3
+        self.offsets = []
+
+        def get_page(offset, limit, **kwargs):
+            self.offsets.append(offset)
+            if offset == self.fail_at_offset:
+                raise Exception('Connection reset')
+            return {'data': self.expenses[offset:offset + limit]}
+        connection = mock.Mock()
+        connection.Expenses.get.side_effect = get_page
+        self.connection = connection
+        patchers = [mock.patch.object(settings, 'DOWNLOAD_PATH', self.tmp_dir.name + '/'),
+                    mock.patch.object(settings, 'EXPENSES_PAGE_SIZE', 3),
+                    mock.patch.object(settings, 'BACKUP_ARCHIVE_MODE', 'directory'),
+                    mock.patch('apps.data_fetcher.utils.fyle_connections.get',
+                               return_value=connection),
+                    mock.patch('apps.data_fetcher.utils.notify_user'),
+                    mock.patch('apps.data_fetcher.utils.CloudStorage')]
+        for patcher in patchers:
+            self.addCleanup(patcher.stop)
+        self.upload = patchers[-1].start().return_value.upload
+        for patcher in patchers[:-1]:
+            patcher.start()
+
+    def test_failed_dump_resumes_from_last_page(self):
+        self.assertFalse(fetch_and_notify_expenses(self.backup))
+        checkpoint = BackupCheckpoint.objects.get(backup=self.backup)
+        self.assertEqual(checkpoint.stage, CheckpointStage.DUMPING)
+        self.assertEqual(checkpoint.pages_done, 1)
+
+        self.fail_at_offset = None
+        self.offsets = []
+        with mock.patch('apps.data_fetcher.utils.remove_items_from_tmp') as remove_items:
+            self.assertTrue(fetch_and_notify_expenses(self.backup))
+        self.assertEqual(self.offsets, [3, 6])
+        file_path = remove_items.call_args[0][0]
+        with zipfile.ZipFile(file_path) as zip_file:
+            rows = list(csv.DictReader(io.StringIO(zip_file.read('test.csv').decode())))
+        self.assertEqual([row['id'] for row in rows], [e['id'] for e in self.expenses])
+        self.assertEqual(self.backup.current_state, 'READY')
+        self.assertFalse(BackupCheckpoint.objects.filter(backup=self.backup).exists())
+
+    def test_sharded_dump_resumes_each_shard(self):
+        self.backup.filters = json.dumps({'state': ['PAID', 'APPROVED']})
+        self.backup.save()
+        for index, expense in enumerate(self.expenses):
+            expense['state'] = 'APPROVED' if index % 2 else 'PAID'
+        fail_at = [('APPROVED', 3)]
+
+        def get_page(state, offset, limit, **kwargs):
+            self.offsets.append((state[0], offset))
+            if (state[0], offset) in fail_at:
+                raise Exception('Connection reset')
+            matching = [expense for expense in self.expenses if expense['state'] == state[0]]
+            return {'data': matching[offset:offset + limit]}
+        self.connection.Expenses.get.side_effect = get_page
+        self.assertFalse(fetch_and_notify_expenses(self.backup))
+        shards = json.loads(BackupCheckpoint.objects.get(backup=self.backup).shards)
+        self.assertEqual([shard['state'] for shard in shards], [['PAID'], ['APPROVED']])
+        self.assertEqual(shards[1]['pages_done'], 1)
+
+        fail_at.clear()
+        self.offsets = []
+        with mock.patch('apps.data_fetcher.utils.remove_items_from_tmp') as remove_items:
+            self.assertTrue(fetch_and_notify_expenses(self.backup))
+        self.assertEqual([offset for offset in self.offsets if offset[0] == 'APPROVED'],
+                         [('APPROVED', 3)])
+        self.assertIn(('PAID', shards[0]['pages_done'] * 3), self.offsets)
+        with zipfile.ZipFile(remove_items.call_args[0][0]) as zip_file:
+            rows = list(csv.DictReader(io.StringIO(zip_file.read('test.csv').decode())))
+        self.assertEqual(sorted(row['id'] for row in rows),
+                         sorted(expense['id'] for expense in self.expenses))
+
+    def test_failed_upload_skips_dump(self):
+        self.fail_at_offset = None
+        self.upload.side_effect = Exception('Upload failed')
+        self.assertFalse(fetch_and_notify_expenses(self.backup))
+        self.assertEqual(BackupCheckpoint.objects.get(backup=self.backup).stage,
+                         CheckpointStage.ARCHIVED)
+
+        self.upload.side_effect = None
+        self.offsets = []
+        self.assertTrue(fetch_and_notify_expenses(self.backup))
+        self.assertEqual(self.offsets, [])
+        self.assertEqual(self.upload.call_count, 2)
+
+    @mock.patch.object(settings, 'EXPENSE_SHARD_WINDOW_DAYS', 0)
+    def test_incremental_backup_resumes_from_base_watermark(self):
+        base_backup = Backups.objects.create(name='base', current_state='READY',
+                                             object_type=ObjectLookup.expenses, filters='{}',
+                                             data_format='CSV', fyle_org_id='orTest',
+                                             user=self.backup.user, fyle_refresh_token='token',
+                                             watermark=datetime(2020, 3, 17, tzinfo=timezone.utc))
+        Backups.objects.filter(id=base_backup.id).update(
+            created_at=self.backup.created_at - timedelta(days=1))
+        Backups.objects.filter(id=self.backup.id).update(is_incremental=True)
+        self.backup.refresh_from_db()
+        get_page = self.connection.Expenses.get.side_effect
+
+        def crash(offset, limit, **kwargs):
+            if offset == self.fail_at_offset:
+                raise SystemExit('Worker killed')
+            return get_page(offset, limit, **kwargs)
+        self.connection.Expenses.get.side_effect = crash
+        with self.assertRaises(SystemExit):
+            fetch_and_notify_expenses(self.backup)
+        self.assertEqual(Backups.objects.get(id=self.backup.id).base_backup_id, base_backup.id)
+
+        self.fail_at_offset = None
+        self.offsets = []
+        backup = Backups.objects.get(id=self.backup.id)
+        with mock.patch('apps.data_fetcher.utils.remove_items_from_tmp'):
+            self.assertTrue(fetch_and_notify_expenses(backup))
+        self.assertEqual(self.offsets, [3, 6])
+        for page_call in self.connection.Expenses.get.call_args_list:
+            self.assertIn('gte:2020-03-17T00:00:00.000Z', page_call[1]['updated_at'])
+
+    @mock.patch.object(settings, 'BACKUP_JOB_RETRY_BACKOFF', 0)
+    def test_failed_job_is_claimed_again_and_resumes(self):
+        get_page = self.connection.Expenses.get.side_effect
+
+        def fail_once(offset, limit, **kwargs):
+            try:
+                return get_page(offset, limit, **kwargs)
+            except Exception:
+                self.fail_at_offset = None
+                raise
+        self.connection.Expenses.get.side_effect = fail_once
+        enqueue_backup(self.backup)
+        with mock.patch('apps.data_fetcher.utils.remove_items_from_tmp'):
+            run_backup_worker('worker', threading.Event(), exit_when_idle=True)
+        self.assertEqual(self.offsets, [0, 3, 3, 6])
+        job = BackupJob.objects.get(backup=self.backup)
+        self.assertEqual((job.state, job.attempts), (JobState.DONE, 2))
+        self.backup.refresh_from_db()
+        self.assertEqual(self.backup.current_state, 'READY')
+
+    def test_job_fails_after_max_attempts(self):
+        enqueue_backup(self.backup)
+        with mock.patch.object(settings, 'BACKUP_JOB_MAX_ATTEMPTS', 2):
+            run_backup_worker('worker', threading.Event(), exit_when_idle=True)
+            job = BackupJob.objects.get(backup=self.backup)
+            self.assertEqual((job.state, job.attempts), (JobState.QUEUED, 1))
+            self.backup.refresh_from_db()
+            self.assertEqual(self.backup.current_state, 'ONGOING')
+            self.assertIsNone(claim_backup_job('worker'))
+
+            job.run_after = None
+            job.save()
+            run_backup_worker('worker', threading.Event(), exit_when_idle=True)
+        job.refresh_from_db()
+        self.assertEqual((job.state, job.attempts), (JobState.FAILED, 2))
+        self.backup.refresh_from_db()
+        self.assertEqual(self.backup.current_state, 'FAILED')
+
+
+@skipUnless(is_columnar_available(), 'pyarrow is not installed')
+class ColumnarFormatTest(SimpleTestCase):
+    """
+    Test cases for Parquet and Arrow backups
+    """
+
+    def setUp(self):
+        self.pages = [[{'id': 'tx{0}'.format(i), 'amount': i + 0.5, 'currency': 'USD',
+                        'spent_at': '2020-03-17T10:20:30.123Z', 'has_attachments': False,
+                        'custom_properties': [{'name': 'Project', 'value': 'Backup'}]}
+                       for i in range(start, start + 3)] for start in (0, 3, 6)]
+
+    def dump(self, data_format, archive_mode='stream'):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            dumper = Dumper(mock.Mock(), path=tmp_dir + '/', pages=iter(self.pages),
+                            name='test', fyle_org_id='orTest', archive_mode=archive_mode,
+                            data_format=data_format)
+            with zipfile.ZipFile(dumper.dump_data()) as zip_file:
+                return {info.filename: (info, zip_file.read(info))
+                        for info in zip_file.infolist()}
+
+    def test_parquet_has_typed_columns_and_row_groups(self):
+        with mock.patch.object(settings, 'COLUMNAR_ROW_GROUP_SIZE', 6):
+            entries = self.dump('PARQUET')
+        info, content = entries['test.parquet']
+        self.assertEqual(info.compress_type, zipfile.ZIP_STORED)
+        parquet_file = pyarrow.parquet.ParquetFile(pyarrow.BufferReader(content))
+        self.assertEqual(parquet_file.metadata.num_rows, 9)
+        self.assertEqual(parquet_file.metadata.num_row_groups, 2)
+        table = parquet_file.read()
+        self.assertEqual(table.schema.field('amount').type, pyarrow.float64())
+        self.assertTrue(pyarrow.types.is_timestamp(table.schema.field('spent_at').type))
+        self.assertEqual(table.column('spent_at')[0].as_py(),
+                         datetime(2020, 3, 17, 10, 20, 30, 123000, tzinfo=timezone.utc))
+        self.assertEqual(json.loads(table.column('custom_properties')[0].as_py()),
+                         self.pages[0][0]['custom_properties'])
+
+    def test_arrow_file_in_directory_archive(self):
+        entries = self.dump('ARROW', archive_mode='directory')
+        table = pyarrow.ipc.open_file(pyarrow.BufferReader(entries['test.arrow'][1])).read_all()
+        self.assertEqual(table.column('id').to_pylist(),
+                         [expense['id'] for page in self.pages for expense in page])
+        self.assertEqual(json.loads(entries['manifest.json'][1])['data_format'], 'ARROW')
+
+    def test_columns_come_from_the_schema(self):
+        self.pages[0][0]['approved_at'] = None
+        self.pages[1][0].update(purpose='Client visit', project_id=42, vendor_code='V1')
+        table = pyarrow.parquet.read_table(pyarrow.BufferReader(
+            self.dump('PARQUET')['test.parquet'][1]))
+        schema = get_schema('expenses')
+        self.assertEqual(table.schema.names, schema.fieldnames)
+        self.assertTrue(pyarrow.types.is_timestamp(table.schema.field('approved_at').type))
+        self.assertEqual(table.column('purpose').to_pylist()[3], 'Client visit')
+        self.assertEqual(table.column('project_id').to_pylist()[3], '42')
+        self.assertEqual(json.loads(table.column(EXTRA_FIELDS_COLUMN)[3].as_py()),
+                         {'vendor_code': 'V1'})
+        self.assertIsNone(table.column(EXTRA_FIELDS_COLUMN)[0].as_py())
+
+    def test_values_of_another_type_go_to_extra_fields(self):
+        self.pages[2][0].update(foreign_amount='N/A', spent_at='yesterday', billable='yes')
+        table = pyarrow.parquet.read_table(pyarrow.BufferReader(
+            self.dump('PARQUET')['test.parquet'][1]))
+        self.assertEqual(table.schema.field('foreign_amount').type, pyarrow.float64())
+        self.assertEqual(table.schema.field('billable').type, pyarrow.bool_())
+        self.assertIsNone(table.column('foreign_amount')[6].as_py())
+        self.assertIsNone(table.column('spent_at')[6].as_py())
+        self.assertEqual(json.loads(table.column(EXTRA_FIELDS_COLUMN)[6].as_py()),
+                         {'foreign_amount': 'N/A', 'spent_at': 'yesterday', 'billable': 'yes'})
+        self.assertEqual(table.column('amount')[6].as_py(), 6.5)
+
+
+class JSONLinesFormatTest(SimpleTestCase):
+    """
+    Test cases for JSON Lines backups
+    """
+
+    def setUp(self):
+        self.data = [{'id': 'tx1', 'amount': 10.5, 'has_attachments': False,
+                      'custom_properties': [{'name': 'Project', 'value': 'Backup'}]},
+                     {'id': 'tx2', 'amount': 20, 'has_attachments': False,
+                      'employee': {'id': 'ou1'}}]
+
+    def dump(self, data_format):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            dumper = Dumper(mock.Mock(), path=tmp_dir + '/', data=self.data, name='test',
+                            fyle_org_id='orTest', archive_mode='stream', data_format=data_format)
+            with zipfile.ZipFile(dumper.dump_data()) as zip_file:
+                return {name: zip_file.read(name) for name in zip_file.namelist()}
+
+    def test_nested_fields_are_kept(self):
+        content = self.dump('JSONL')['test.jsonl']
+        self.assertEqual([json.loads(line) for line in content.splitlines()], self.data)
+
+    def test_gzip_compression(self):
+        content = gzip.decompress(self.dump('JSONL_GZ')['test.jsonl.gz'])
+        self.assertEqual([json.loads(line) for line in content.splitlines()], self.data)
+
+    @skipUnless(is_zstd_available(), 'zstandard is not installed')
+    def test_zstd_compression(self):
+        content = self.dump('JSONL_ZSTD')['test.jsonl.zst']
+        content = zstandard.ZstdDecompressor().decompressobj().decompress(content)
+        self.assertEqual([json.loads(line) for line in content.splitlines()], self.data)
+
+
+class ExpenseSchemaTest(SimpleTestCase):
+    """
+    Test cases for the versioned CSV column layout
+    """
+
+    def test_heterogeneous_rows(self):
+        pages = [[{'id': 'tx1', 'amount': 10, 'has_attachments': False}],
+                 [{'id': 'tx2', 'has_attachments': False, 'state': 'PAID',
+                   'employee': {'id': 'ou1', 'email': 'user1@test.com'},
+                   'custom_properties': [{'name': 'Project', 'value': 'Backup'}]}]]
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            dumper = Dumper(mock.Mock(), path=tmp_dir + '/', pages=iter(pages), name='test',
+                            fyle_org_id='orTest', archive_mode='stream')
+            with zipfile.ZipFile(dumper.dump_data()) as zip_file:
+                reader = csv.DictReader(io.StringIO(zip_file.read('test.csv').decode()))
+                rows = list(reader)
+                manifest = json.loads(zip_file.read('manifest.json'))
+        schema = get_schema('expenses', manifest['schema_version'])
+        self.assertEqual(reader.fieldnames, schema.columns + [EXTRA_FIELDS_COLUMN])
+        self.assertEqual([row['amount'] for row in rows], ['10', ''])
+        self.assertEqual(rows[1]['state'], 'PAID')
+        self.assertEqual(json.loads(rows[1]['custom_properties']),
+                         pages[1][0]['custom_properties'])
+        self.assertEqual(json.loads(rows[1][EXTRA_FIELDS_COLUMN]),
+                         {'employee.id': 'ou1', 'employee.email': 'user1@test.com'})
+        self.assertEqual(rows[0][EXTRA_FIELDS_COLUMN], '')
+
+
+class ShardedExtractionTest(SimpleTestCase):
+    """
+    Test cases for fetching shards of an expenses query concurrently
+    """
+
+    def test_shards_by_state_and_window(self):
+        shards = get_expense_shards(['PAID', 'APPROVED'], ['gte:2020-01-01T00:00:00.000Z',
+                                                          'lte:2020-03-10T23:59:59.000Z'],
+                                    window_days=30)
+        self.assertEqual(len(shards), 6)
+        self.assertEqual(shards[:3], [
+            (['PAID'], ['gte:2020-01-01T00:00:00.000Z', 'lte:2020-01-30T23:59:59.999Z']),
+            (['PAID'], ['gte:2020-01-31T00:00:00.000Z', 'lte:2020-02-29T23:59:59.999Z']),
+            (['PAID'], ['gte:2020-03-01T00:00:00.000Z', 'lte:2020-03-10T23:59:59.000Z'])])
+        self.assertEqual(get_expense_shards(None, [], window_days=30), [(None, [])])
+
+    def test_shards_are_merged_and_deduped(self):
+        expenses = [{'id': 'tx{0}'.format(i), 'state': state, 'has_attachments': False}
+                    for i, state in enumerate(['PAID', 'APPROVED'] * 10)]
+
+        def get_page(state, offset, limit, **kwargs):
+            # tx0 changed state while the shards were fetched
+            matching = [e for e in expenses if e['state'] in state or e['id'] == 'tx0']
+            return {'data': matching[offset:offset + limit]}
+        connector = FyleSdkConnector.__new__(FyleSdkConnector)
+        connector.connection = mock.Mock()
+        connector.connection.Expenses.get.side_effect = get_page
+        pages = connector.iter_expenses_sharded([(['PAID'], []), (['APPROVED'], [])],
+                                                approved_at=None, page_size=3, workers=2)
+        ids = [expense['id'] for page in pages for expense in page]
+        self.assertEqual(sorted(ids), sorted(expense['id'] for expense in expenses))
+
+    def test_shard_error_is_raised(self):
+        connector = FyleSdkConnector.__new__(FyleSdkConnector)
+        connector.connection = mock.Mock()
+        connector.connection.Expenses.get.side_effect = Exception('Too many requests')
+        with self.assertRaises(Exception):
+            list(connector.iter_expenses_sharded([(['PAID'], []), (['APPROVED'], [])],
+                                                 approved_at=None))
+
+
+class FyleApiThrottleTest(SimpleTestCase):
+    """
+    Test cases for per org throttling of Fyle API calls
+    """
+
+    def setUp(self):
+        patcher = mock.patch('apps.data_fetcher.utils.time.sleep')
+        self.sleep = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.throttle = FyleApiThrottle('orTest', rate=1000, max_concurrency=8)
+
+    def test_throttled_call_is_retried_and_backs_off(self):
+        sdk_error = type('FyleSDKError', (Exception,), {})
+        func = mock.Mock(side_effect=[sdk_error('Status code 429'),
+                                      FyleApiRetryableError(503, retry_after=7), 'ok'])
+        self.assertEqual(self.throttle.call(func), 'ok')
+        self.assertEqual(func.call_count, 3)
+        self.assertIn(mock.call(7), self.sleep.call_args_list)
+        stats = self.throttle.get_stats()
+        self.assertEqual((stats['throttled'], stats['server_errors'], stats['retries']), (1, 1, 2))
+        self.assertLess(stats['concurrency_limit'], 8)
+
+    def test_other_errors_are_not_retried(self):
+        func = mock.Mock(side_effect=ValueError('Some of the parameters are wrong'))
+        with self.assertRaises(ValueError):
+            self.throttle.call(func)
+        self.assertEqual(func.call_count, 1)
+        self.assertEqual(self.throttle.get_stats()['concurrency_limit'], 8)
+
+    def test_concurrency_grows_back_after_success(self):
+        self.throttle.acquire()
+        self.throttle.release(429)
+        self.assertEqual(self.throttle.get_stats()['concurrency_limit'], 4)
+        for _ in range(40):
+            self.throttle.call(lambda: None)
+        self.assertEqual(self.throttle.get_stats()['concurrency_limit'], 8)
+
+    @mock.patch.dict('apps.data_fetcher.utils.fyle_api_throttles', clear=True)
+    @mock.patch('apps.data_fetcher.utils.fyle_connections.get')
+    def test_attachment_downloads_have_their_own_bucket(self, get_connection):
+        connector = FyleSdkConnector('token', fyle_org_id='orTest')
+        connector.extract_attachments('tx1')
+        connector.extract_employee_details()
+        stats = get_fyle_api_stats()
+        self.assertEqual((stats['orTest']['calls'], stats['orTest:attachments']['calls']), (1, 1))
+        self.assertEqual(connector.attachment_throttle.bucket.rate,
+                         settings.FYLE_ORG_ATTACHMENT_RATE_LIMIT)
+        self.assertEqual(connector.throttle.bucket.rate, settings.FYLE_ORG_API_RATE_LIMIT)
+
+    def test_retry_after_header(self):
+        self.assertEqual(parse_retry_after('120'), 120)
+        self.assertIsNone(parse_retry_after(None))
+        response = mock.Mock(status_code=429, headers={'Retry-After': '3'})
+        with self.assertRaises(FyleApiRetryableError) as context:
+            check_response_throttling(response)
+        self.assertEqual(context.exception.retry_after, 3)
+
+
+class HttpSessionTest(SimpleTestCase):
+    """
+    Test cases for the pooled HTTP session used for Jobs and OAuth calls
+    """
+
+    def test_session_is_shared_with_timeouts_and_retries(self):
+        session = get_http_session()
+        self.assertIs(get_http_session(), session)
+        adapter = session.get_adapter('https://api.fyle.in/')
+        self.assertEqual(adapter.timeout, (settings.HTTP_CONNECT_TIMEOUT,
+                                           settings.HTTP_READ_TIMEOUT))
+        self.assertEqual(adapter.max_retries.total, settings.HTTP_MAX_RETRIES)
+        self.assertEqual(adapter.max_retries.read, 0)
+
+    @mock.patch('requests.adapters.HTTPAdapter.send')
+    def test_default_timeout_is_applied(self, send):
+        send.return_value = requests.Response()
+        send.return_value.status_code = 200
+        get_http_session().post('https://api.fyle.in/jobs', json={})
+        self.assertEqual(send.call_args[1]['timeout'], (settings.HTTP_CONNECT_TIMEOUT,
+                                                       settings.HTTP_READ_TIMEOUT))
+        get_http_session().post('https://api.fyle.in/jobs', json={}, timeout=1)
+        self.assertEqual(send.call_args[1]['timeout'], 1)
+
+
+class BackupMetricsTest(SimpleTestCase):
+    """
+    Test cases for the backup stage timings and the metrics endpoint
+    """
+
+    def test_stage_timer_adds_up_interleaved_stages(self):
+        timer = StageTimer()
+
+        def pages():
+            for page in range(3):
+                time.sleep(0.01)
+                yield [page]
+        for _ in timer.iterate('extract', pages()):
+            with timer.time('dump'):
+                pass
+        self.assertEqual(set(timer.seconds), {'extract', 'dump'})
+        self.assertGreaterEqual(timer.seconds['extract'], 0.03)
+        self.assertLess(timer.seconds['dump'], timer.seconds['extract'])
+
+    @skipUnless(prometheus_client, 'prometheus_client is not installed')
+    def test_metrics_endpoint(self):
+        timer = StageTimer()
+        with timer.time('upload'):
+            pass
+        timer.observe()
+        response = self.client.get('/fetcher/metrics/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'fyle_backup_stage_seconds_count{stage="upload"}', response.content)
+
+
+class DumperBenchmarkTest(SimpleTestCase):
+    """
+    Test cases for the end to end backup benchmark with local fakes
+    """
+
+    @mock.patch.object(settings, 'CLOUD_STORAGE_PROVIDER', 'awss3')
+    @mock.patch.object(settings, 'EXPENSES_PAGE_SIZE', 10)
+    def test_results_are_written_as_json(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            output = os.path.join(tmp_dir, 'results.json')
+            call_command('benchmark_dumper', '--expenses', '30', '--attachment-ratio', '0.5',
+                         '--attachment-size', '4', '--archive-modes', 'directory', 'multipart',
+                         '--output', output, stdout=io.StringIO())
+            with open(output) as output_file:
+                report = json.load(output_file)
+        self.assertEqual(report['parameters']['expenses'], 30)
+        self.assertEqual([run['archive_mode'] for run in report['results']],
+                         ['directory', 'multipart'])
+        for run in report['results']:
+            self.assertGreater(run['archive_mb'], 15 * 4 / 1024)
+            self.assertGreater(run['peak_rss_mb'], 0)
+
+
+class AsyncBackupEngineTest(TransactionTestCase):
+    """
+    Test cases for running queued backups as coroutines
+    """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        user = UserProfile.objects.create_user(email='user1@test.com', password='foo')
+        self.backups = [Backups.objects.create(name='test{0}'.format(index),
+                                               current_state='ONGOING',
+                                               object_type=ObjectLookup.expenses,
+                                               filters='{"download_attachments": true}',
+                                               data_format='CSV', fyle_org_id='orTest',
+                                               user=user, fyle_refresh_token='token')
+                        for index in range(3)]
+        self.expenses = make_expenses(7)
+        for expense in self.expenses[::2]:
+            expense['has_attachments'] = True
+        connection = mock.Mock()
+        connection.Expenses.get.side_effect = \
+            lambda offset, limit, **kwargs: {'data': self.expenses[offset:offset + limit]}
+        connection.Expenses.get_attachments.side_effect = lambda expense_id: {'data': [
+            {'filename': 'receipt.pdf', 'content': base64.b64encode(expense_id.encode()).decode()}]}
+        patchers = [mock.patch.object(settings, 'DOWNLOAD_PATH', self.tmp_dir.name + '/'),
+                    mock.patch.object(settings, 'EXPENSES_PAGE_SIZE', 3),
+                    mock.patch.object(settings, 'BACKUP_ARCHIVE_MODE', 'stream'),
+                    mock.patch.object(settings, 'ATTACHMENT_DEDUP_ENABLED', False),
+                    mock.patch('apps.data_fetcher.utils.fyle_connections.get',
+                               return_value=connection),
+                    mock.patch('apps.data_fetcher.utils.notify_user'),
+                    mock.patch('apps.data_fetcher.utils.remove_items_from_tmp'),
+                    mock.patch('apps.data_fetcher.utils.CloudStorage')]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+
+    def test_queued_backups_run_concurrently(self):
+        for backup in self.backups:
+            enqueue_backup(backup)
+        engine = AsyncBackupEngine(max_backups=2, workers=4, poll_interval=0)
+        self.loop.run_until_complete(engine.consume_queue(exit_when_idle=True))
+        self.loop.run_until_complete(engine.stop())
+
+        self.assertEqual(BackupJob.objects.filter(state=JobState.DONE).count(), 3)
+        for backup in Backups.objects.all():
+            self.assertEqual(backup.current_state, 'READY')
+            file_name, = [name for name in os.listdir(self.tmp_dir.name)
+                          if name.startswith('orTest-{0}-'.format(backup.name))]
+            with zipfile.ZipFile(os.path.join(self.tmp_dir.name, file_name)) as zip_file:
+                rows = list(csv.DictReader(io.StringIO(zip_file.read(backup.name + '.csv')
+                                                       .decode())))
+                self.assertEqual([row['id'] for row in rows],
+                                 [expense['id'] for expense in self.expenses])
+                self.assertEqual(zip_file.read('tx6_receipt.pdf'), b'tx6')
+        self.assertFalse(BackupCheckpoint.objects.exists())
+
+    @mock.patch.object(settings, 'BACKUP_JOB_MAX_ATTEMPTS', 1)
+    def test_failed_extraction_fails_the_backup(self):
+        enqueue_backup(self.backups[0])
+        self.expenses = None
+        engine = AsyncBackupEngine(workers=2, poll_interval=0)
+        self.loop.run_until_complete(engine.consume_queue(exit_when_idle=True))
+        self.assertEqual(BackupJob.objects.get().state, JobState.FAILED)
+        self.assertEqual(Backups.objects.get(id=self.backups[0].id).current_state, 'FAILED')
+
+    @mock.patch('apps.data_fetcher.engine.close_old_connections')
+    def test_blocking_calls_close_old_connections(self, close_old_connections):
+        engine = AsyncBackupEngine(workers=1, poll_interval=0)
+        self.addCleanup(engine.executor.shutdown)
+        self.assertEqual(self.loop.run_until_complete(engine.run_sync(sum, [1, 2])), 3)
+        self.assertEqual(close_old_connections.call_count, 2)
+        with self.assertRaises(ZeroDivisionError):
+            self.loop.run_until_complete(engine.run_sync(divmod, 1, 0))
+        self.assertEqual(close_old_connections.call_count, 4)
+
+    def test_lifespan_starts_and_stops_engine(self):
+        engine = mock.Mock()
+        engine.stop.side_effect = lambda: asyncio.sleep(0)
+        django_application = mock.Mock(side_effect=lambda *args: asyncio.sleep(0))
+        application = BackupEngineApplication(django_application, engine)
+        messages = iter([{'type': 'lifespan.startup'}, {'type': 'lifespan.shutdown'}])
+        sent = []
+
+        async def receive():
+            return next(messages)
+
+        async def send(message):
+            sent.append(message['type'])
+        self.loop.run_until_complete(application({'type': 'lifespan'}, receive, send))
+        self.assertEqual(sent, ['lifespan.startup.complete', 'lifespan.shutdown.complete'])
+        engine.start.assert_called_once_with()
+        self.loop.run_until_complete(application({'type': 'http'}, receive, send))
+        django_application.assert_called_once()
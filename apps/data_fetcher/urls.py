@@ -4,4 +4,7 @@ from . import views
 
 urlpatterns = [
     path('callback/expenses/', views.ExpensesFetchView.as_view(), name='fetcher-expenses'),
+    path('queue/', views.QueueStatsView.as_view(), name='fetcher-queue'),
+    path('fyle-api/', views.FyleApiStatsView.as_view(), name='fetcher-fyle-api'),
+    path('metrics/', views.MetricsView.as_view(), name='fetcher-metrics'),
 ]
\ No newline at end of file
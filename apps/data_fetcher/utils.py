@@ -1,33 +1,440 @@
-import base64
+import binascii
 import csv
+import functools
+import hashlib
+import itertools
 import os
+import queue
 import shutil
 import json
 import logging
-from datetime import datetime
+import random
+import re
+import tempfile
+import threading
+import time
+import zipfile
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait as futures_wait
+from datetime import datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
+from dateutil import parser
+from django.db import transaction
 from django.template.loader import render_to_string
 import boto3
+import requests
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
 from botocore.exceptions import ClientError
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from sendgrid import SendGridAPIClient
 from sendgrid.helpers.mail import Mail
 
 from fylesdk import FyleSDK
+from apps.backups.models import Backups, ArchivedAttachment
+from apps.data_fetcher import metrics
+from apps.data_fetcher.formats import open_data_writer, get_data_file_extension
+from apps.data_fetcher.models import BackupCheckpoint, CheckpointStage, BackupJob, JobState
+from apps.data_fetcher.schemas import get_schema
 from fyle_backup_app import settings
 
 logger = logging.getLogger('app')
 
 
+class FyleConnectionCache():
+    """
+    LRU cache of FyleSDK connections keyed by refresh token. Creating a FyleSDK
+    exchanges the refresh token for an access token, so connections are reused
+    until shortly before that access token expires.
+    """
+    def __init__(self, max_size=None, ttl=None):
+        """
+        :param max_size: connections kept, settings.FYLE_CONNECTION_CACHE_SIZE by default
+        :param ttl: seconds a connection is reused, settings.FYLE_CONNECTION_TTL by default
+        """
+        self.max_size = max_size or settings.FYLE_CONNECTION_CACHE_SIZE
+        self.ttl = ttl or settings.FYLE_CONNECTION_TTL
+        self.connections = OrderedDict()
+        self.refresh_locks = {}
+        self.lock = threading.Lock()
+
+    def lookup(self, refresh_token):
+        """
+        Get a cached connection that has not expired, marking it as recently used
+        """
+        entry = self.connections.get(refresh_token)
+        if entry is None or entry[1] <= time.monotonic():
+            return None
+        self.connections.move_to_end(refresh_token)
+        return entry[0]
+
+    def get(self, refresh_token):
+        """
+        Get a connection for the refresh token, creating it when missing or expired.
+        Concurrent callers for the same token wait for a single token exchange.
+        :param refresh_token: Fyle refresh token
+        :return: FyleSDK connection
+        """
+        with self.lock:
+            connection = self.lookup(refresh_token)
+            if connection is not None:
+                return connection
+            refresh_lock = self.refresh_locks.setdefault(refresh_token, threading.Lock())
+
+        with refresh_lock:
+            with self.lock:
+                connection = self.lookup(refresh_token)
+            if connection is not None:
+                return connection
+            try:
+                connection = FyleSDK(
+                    base_url=settings.BASE_URL,
+                    client_id=settings.CLIENT_ID,
+                    client_secret=settings.CLIENT_SECRET,
+                    refresh_token=refresh_token
+                )
+            except Exception:
+                # Locks live only as long as their cache entry, so tokens that
+                # fail the exchange do not leave one behind
+                with self.lock:
+                    if self.refresh_locks.get(refresh_token) is refresh_lock:
+                        del self.refresh_locks[refresh_token]
+                raise
+            with self.lock:
+                self.connections[refresh_token] = (connection, time.monotonic() + self.ttl)
+                self.connections.move_to_end(refresh_token)
+                while len(self.connections) > self.max_size:
+                    evicted_token, _ = self.connections.popitem(last=False)
+                    self.refresh_locks.pop(evicted_token, None)
+            return connection
+
+    def invalidate(self, refresh_token):
+        """
+        Drop the connection for a refresh token
+        :param refresh_token: Fyle refresh token
+        """
+        with self.lock:
+            self.connections.pop(refresh_token, None)
+            self.refresh_locks.pop(refresh_token, None)
+
+
+fyle_connections = FyleConnectionCache()
+
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    """
+    HTTPAdapter that applies a default timeout to requests made without one
+    """
+    def __init__(self, *args, timeout=None, **kwargs):
+        """
+        :param timeout: (connect, read) timeout in seconds
+        """
+        self.timeout = timeout
+        super().__init__(*args, **kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.timeout
+        return super().send(request, **kwargs)
+
+
+http_sessions = {}
+http_sessions_lock = threading.Lock()
+
+
+def get_http_session():
+    """
+    Get the requests session of this process for direct calls to Fyle, creating it
+    on first use. Connections are kept alive and pooled, requests time out, and
+    failed connections and 502/503/504 responses of idempotent requests are retried.
+    POST requests are not retried once sent, as the Jobs API is not idempotent.
+    Sessions are keyed by pid so that forked workers do not share connections.
+    :return: requests.Session
+    """
+    pid = os.getpid()
+    session = http_sessions.get(pid)
+    if session is None:
+        with http_sessions_lock:
+            session = http_sessions.get(pid)
+            if session is None:
+                retry = Retry(total=settings.HTTP_MAX_RETRIES, read=0,
+                              backoff_factor=settings.HTTP_RETRY_BACKOFF,
+                              status_forcelist=(502, 503, 504), raise_on_status=False)
+                adapter = TimeoutHTTPAdapter(
+                    timeout=(settings.HTTP_CONNECT_TIMEOUT, settings.HTTP_READ_TIMEOUT),
+                    pool_connections=settings.HTTP_POOL_SIZE,
+                    pool_maxsize=settings.HTTP_POOL_SIZE, max_retries=retry)
+                session = requests.Session()
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                http_sessions.clear()
+                http_sessions[pid] = session
+    return session
+
+
+class TokenBucket():
+    """
+    Rate limiter that lets through rate calls per second on average, with bursts
+    of up to capacity calls. Callers block until a token is available.
+    """
+    def __init__(self, rate, capacity=None):
+        """
+        :param rate: tokens added per second, 0 turns off the limit
+        :param capacity: most tokens held at once, rate by default
+        """
+        self.rate = rate
+        self.capacity = capacity or max(rate, 1)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Take a token, waiting for one if the bucket is empty
+        """
+        if self.rate <= 0:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity,
+                                  self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+# Shared by all backups of this process, so concurrent extraction stays within the limit
+fyle_api_rate_limit = TokenBucket(settings.FYLE_API_RATE_LIMIT, settings.FYLE_API_BURST)
+
+
+class FyleApiRetryableError(Exception):
+    """
+    Fyle API call that was throttled or failed on the server, and can be retried
+    """
+    def __init__(self, status_code, retry_after=None):
+        """
+        :param status_code: HTTP status code of the response
+        :param retry_after: seconds to wait from the Retry-After header, if any
+        """
+        super().__init__('Status code {0}'.format(status_code))
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+def parse_retry_after(value):
+    """
+    Parse a Retry-After header, given either in seconds or as an HTTP date
+    :param value: header value, None if missing
+    :return: seconds to wait, None if missing or invalid
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+def check_response_throttling(response):
+    """
+    Raise FyleApiRetryableError for throttled and server error responses
+    of direct requests to Fyle
+    :param response: requests Response
+    """
+    if response.status_code == 429 or response.status_code >= 500:
+        raise FyleApiRetryableError(response.status_code,
+                                    parse_retry_after(response.headers.get('Retry-After')))
+
+
+# FyleSDK raises FyleSDKError('Status code 429') for statuses it does not map to an
+# exception of its own, and drops the response headers
+SDK_RETRYABLE_STATUS = re.compile(r'Status code (429|5\d\d)')
+
+
+def get_retryable_status(error):
+    """
+    Status code of an error worth retrying after backing off
+    :param error: exception raised by a Fyle API call
+    :return: (status code, seconds from Retry-After or None), status None for other errors
+    """
+    if isinstance(error, FyleApiRetryableError):
+        return error.status_code, error.retry_after
+    if type(error).__name__ == 'InternalServerError':
+        return 500, None
+    match = SDK_RETRYABLE_STATUS.search(str(getattr(error, 'message', error)))
+    if match:
+        return int(match.group(1)), None
+    return None, None
+
+
+class FyleApiThrottle():
+    """
+    Client side throttling of the Fyle API calls of an org. Calls take a token from
+    the org's token bucket and a concurrency slot. The concurrency limit grows by one
+    per limit successful calls and is halved when Fyle throttles or fails a call,
+    which is then retried after Retry-After or an exponential backoff.
+    """
+    def __init__(self, fyle_org_id, rate=None, max_concurrency=None):
+        """
+        :param fyle_org_id: org the calls are made for
+        :param rate: calls per second, settings.FYLE_ORG_API_RATE_LIMIT by default
+        :param max_concurrency: calls in flight, settings.FYLE_ORG_API_CONCURRENCY by default
+        """
+        self.fyle_org_id = fyle_org_id
+        self.bucket = TokenBucket(rate or settings.FYLE_ORG_API_RATE_LIMIT)
+        self.max_concurrency = max_concurrency or settings.FYLE_ORG_API_CONCURRENCY
+        self.concurrency_limit = float(self.max_concurrency)
+        self.in_flight = 0
+        self.condition = threading.Condition()
+        self.metrics = {'calls': 0, 'throttled': 0, 'server_errors': 0, 'retries': 0,
+                        'failures': 0, 'wait_seconds': 0.0, 'backoff_seconds': 0.0}
+
+    def acquire(self):
+        """
+        Wait for a token from the process and org buckets and a free concurrency slot
+        """
+        start = time.monotonic()
+        fyle_api_rate_limit.acquire()
+        self.bucket.acquire()
+        with self.condition:
+            while self.in_flight >= int(self.concurrency_limit):
+                self.condition.wait()
+            self.in_flight += 1
+            self.metrics['calls'] += 1
+            self.metrics['wait_seconds'] += time.monotonic() - start
+
+    def release(self, status_code=None, failed=False):
+        """
+        Free the concurrency slot of a call and adapt the concurrency limit
+        :param status_code: status of a throttled or server error response, None otherwise
+        :param failed: whether the call failed for another reason
+        """
+        with self.condition:
+            self.in_flight -= 1
+            if status_code is not None:
+                self.metrics['throttled' if status_code == 429 else 'server_errors'] += 1
+                self.concurrency_limit = max(1.0, self.concurrency_limit / 2)
+            elif failed:
+                self.metrics['failures'] += 1
+            else:
+                self.concurrency_limit = min(float(self.max_concurrency),
+                                             self.concurrency_limit + 1 / self.concurrency_limit)
+            self.condition.notify_all()
+
+    def call(self, func, *args, **kwargs):
+        """
+        Make a Fyle API call, retrying throttled and server error responses
+        :param func: function making the call
+        :return: what func returns
+        """
+        attempt = 0
+        while True:
+            self.acquire()
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                status_code, retry_after = get_retryable_status(e)
+                self.release(status_code, failed=status_code is None)
+                if status_code is None or attempt >= settings.FYLE_API_MAX_RETRIES:
+                    raise
+                delay = retry_after
+                if delay is None:
+                    delay = settings.FYLE_API_RETRY_BACKOFF * 2 ** attempt * random.uniform(1, 1.5)
+                attempt += 1
+                with self.condition:
+                    self.metrics['retries'] += 1
+                    self.metrics['backoff_seconds'] += delay
+                logger.warning('Fyle API returned %s for org %s, retry %s/%s in %.1fs',
+                               status_code, self.fyle_org_id, attempt,
+                               settings.FYLE_API_MAX_RETRIES, delay)
+                time.sleep(delay)
+                continue
+            self.release()
+            return result
+
+    def get_stats(self):
+        """
+        Metrics of the calls made so far, with the current concurrency
+        """
+        with self.condition:
+            return dict(self.metrics, concurrency_limit=round(self.concurrency_limit, 2),
+                        in_flight=self.in_flight)
+
+
+fyle_api_throttles = {}
+fyle_api_throttles_lock = threading.Lock()
+
+
+def get_fyle_api_throttle(fyle_org_id, attachments=False):
+    """
+    Get the throttle shared by the Fyle API calls of an org. Attachment downloads
+    have their own, at FYLE_ORG_ATTACHMENT_RATE_LIMIT, so they are not held to the
+    rate of the expense pages.
+    :param fyle_org_id: Fyle org id, None for calls not tied to a known org
+    :param attachments: get the throttle of attachment downloads
+    :return: FyleApiThrottle object
+    """
+    key = '{0}:attachments'.format(fyle_org_id) if attachments else str(fyle_org_id)
+    with fyle_api_throttles_lock:
+        if key not in fyle_api_throttles:
+            rate = settings.FYLE_ORG_ATTACHMENT_RATE_LIMIT if attachments else None
+            fyle_api_throttles[key] = FyleApiThrottle(fyle_org_id, rate=rate)
+        return fyle_api_throttles[key]
+
+
+def get_fyle_api_stats():
+    """
+    Metrics of the Fyle API calls made by this process, per org and per org's
+    attachment downloads
+    """
+    with fyle_api_throttles_lock:
+        throttles = list(fyle_api_throttles.items())
+    return {key: throttle.get_stats() for key, throttle in throttles}
+
+
+class ShardPage(list):
+    """
+    Page of expenses from one shard of a sharded expenses query
+    """
+    def __init__(self, expenses, shard):
+        """
+        :param expenses: list of expense dicts
+        :param shard: index of the shard the page was fetched from
+        """
+        super().__init__(expenses)
+        self.shard = shard
+
+
 class FyleSdkConnector():
     """
-    Class with utils functions for FyleSDK
+    Class with utils functions for FyleSDK. Calls are throttled per org.
     """
-    def __init__(self, refresh_token):
-        self.connection = FyleSDK(
-            base_url=settings.BASE_URL,
-            client_id=settings.CLIENT_ID,
-            client_secret=settings.CLIENT_SECRET,
-            refresh_token=refresh_token
-        )
+    fyle_org_id = None
+
+    def __init__(self, refresh_token, fyle_org_id=None):
+        """
+        :param refresh_token: Fyle refresh token
+        :param fyle_org_id: org of the refresh token, if known
+        """
+        self.connection = fyle_connections.get(refresh_token)
+        self.fyle_org_id = fyle_org_id
+
+    @property
+    def throttle(self):
+        return get_fyle_api_throttle(self.fyle_org_id)
+
+    @property
+    def attachment_throttle(self):
+        return get_fyle_api_throttle(self.fyle_org_id, attachments=True)
 
     def extract_expenses(self, state, approved_at, updated_at):
         """
@@ -38,31 +445,227 @@ class FyleSdkConnector():
                                             'APPROVER_PENDING' , 'COMPLETE' ]
         :return: List with dicts in Expenses schema.
         """
-        expenses = self.connection.Expenses.get_all(state=state, approved_at=approved_at,
-                                                    updated_at=updated_at)
+        expenses = self.throttle.call(self.connection.Expenses.get_all, state=state,
+                                      approved_at=approved_at, updated_at=updated_at)
         return expenses
 
+    def iter_expenses(self, state, approved_at, updated_at, page_size=None, offset=0):
+        """
+        Lazily fetch Expenses that match the parameters, one page at a time.
+        Only the page being yielded is held in memory.
+        :param updated_at: Date string in yyyy-MM-ddTHH:mm:ss.SSSZ format
+        :param approved_at: Date string in yyyy-MM-ddTHH:mm:ss.SSSZ format
+        :param state: state of the expense [ 'PAID' , 'DRAFT' , 'APPROVED' ,
+                                            'APPROVER_PENDING' , 'COMPLETE' ]
+        :param page_size: expenses per page, settings.EXPENSES_PAGE_SIZE by default
+        :param offset: number of expenses to skip
+        :return: Generator of lists with dicts in Expenses schema.
+        """
+        if page_size is None:
+            page_size = settings.EXPENSES_PAGE_SIZE
+        while True:
+            page = self.throttle.call(self.connection.Expenses.get, state=state,
+                                      approved_at=approved_at, updated_at=updated_at,
+                                      offset=offset, limit=page_size).get('data')
+            if not page:
+                return
+            yield page
+            if len(page) < page_size:
+                return
+            offset += page_size
+
+    def iter_expenses_sharded(self, shards, approved_at, page_size=None, workers=None,
+                              offsets=None):
+        """
+        Fetch the pages of several shards of a query concurrently and merge them.
+        An expense that moves between shards while they are fetched, e.g. because
+        it was updated, is only yielded once.
+        :param shards: list of (state, updated_at) filters, see get_expense_shards()
+        :param approved_at: Date string in yyyy-MM-ddTHH:mm:ss.SSSZ format
+        :param page_size: expenses per page, settings.EXPENSES_PAGE_SIZE by default
+        :param workers: shards fetched at once, settings.EXPENSE_SHARD_WORKERS by default
+        :param offsets: number of expenses to skip per shard
+        :return: Generator of ShardPage objects. Every page of a shard is yielded,
+        even when all its expenses were yielded from other shards already.
+        """
+        workers = workers or settings.EXPENSE_SHARD_WORKERS
+        offsets = offsets or [0] * len(shards)
+        pages = queue.Queue(maxsize=workers * 2)
+        stop = threading.Event()
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    pages.put(item, timeout=1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def fetch_shard(index):
+            state, updated_at = shards[index]
+            try:
+                for page in self.iter_expenses(state, approved_at, updated_at, page_size,
+                                               offset=offsets[index]):
+                    if not put(ShardPage(page, index)):
+                        return
+                # None marks the end of a shard
+                put(None)
+            except Exception as e:
+                put(e)
+
+        executor = ThreadPoolExecutor(max_workers=workers)
+        try:
+            for index in range(len(shards)):
+                executor.submit(fetch_shard, index)
+            seen_ids = set()
+            remaining = len(shards)
+            while remaining:
+                page = pages.get()
+                if page is None:
+                    remaining -= 1
+                    continue
+                if isinstance(page, Exception):
+                    raise page
+                page = ShardPage([expense for expense in page if expense['id'] not in seen_ids],
+                                 page.shard)
+                seen_ids.update(expense['id'] for expense in page)
+                yield page
+        finally:
+            stop.set()
+            executor.shutdown(wait=True)
+
     def extract_attachments(self, expense_id):
         """
         Get all the file attachments associated with an Expense.
         :param expense_id: Unique ID to find an Expense.
         :return: List with dicts in Attachments schema.
         """
-        attachment = self.connection.Expenses.get_attachments(expense_id)
+        attachment = self.attachment_throttle.call(self.connection.Expenses.get_attachments,
+                                                   expense_id)
         return attachment
 
     def extract_employee_details(self):
         """
         Extract fyle profile details of user
         """
-        employee_data = self.connection.Employees.get_my_profile()
+        employee_data = self.throttle.call(self.connection.Employees.get_my_profile)
         return employee_data.get('data')
 
 
+class S3MultipartWriter():
+    """
+    Write-only stream that uploads to S3 as multipart parts while it is being produced
+    """
+    def __init__(self, s3_client, bucket, object_name, part_size=None, max_pending_parts=None,
+                 executor=None):
+        """
+        :param s3_client: boto3 S3 client
+        :param bucket: S3 bucket name
+        :param object_name: S3 object name
+        :param part_size: bytes per part, settings.S3_MULTIPART_PART_SIZE by default
+        :param max_pending_parts: parts buffered or in flight before write() blocks,
+        settings.S3_MULTIPART_MAX_PENDING_PARTS by default
+        :param executor: executor to upload the parts with, shared with other uploads.
+        By default the writer starts its own with S3_MULTIPART_UPLOAD_WORKERS threads.
+        """
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.object_name = object_name
+        self.part_size = part_size or settings.S3_MULTIPART_PART_SIZE
+        self.pending_parts = threading.BoundedSemaphore(
+            max_pending_parts or settings.S3_MULTIPART_MAX_PENDING_PARTS)
+        self.own_executor = executor is None
+        self.executor = executor or ThreadPoolExecutor(
+            max_workers=settings.S3_MULTIPART_UPLOAD_WORKERS)
+        self.buffer = bytearray()
+        self.position = 0
+        self.futures = []
+        self.error = None
+        response = s3_client.create_multipart_upload(Bucket=bucket, Key=object_name)
+        self.upload_id = response['UploadId']
+
+    def write(self, data):
+        """
+        Buffer data and hand every full part to the upload workers
+        :param data: bytes to write
+        :return: number of bytes written
+        """
+        self.buffer += data
+        self.position += len(data)
+        while len(self.buffer) >= self.part_size:
+            self.submit_part(bytes(self.buffer[:self.part_size]))
+            del self.buffer[:self.part_size]
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        """
+        Parts are only uploaded once full, so there is nothing to flush
+        """
+
+    def submit_part(self, body):
+        """
+        Upload a part in the background, blocking while max_pending_parts are in flight
+        :param body: part bytes
+        """
+        if self.error is not None:
+            raise self.error
+        self.pending_parts.acquire()
+        future = self.executor.submit(self.upload_part, len(self.futures) + 1, body)
+        future.add_done_callback(self.part_done)
+        self.futures.append(future)
+
+    def part_done(self, future):
+        if future.exception() is not None:
+            self.error = future.exception()
+        self.pending_parts.release()
+
+    def upload_part(self, part_number, body):
+        response = self.s3_client.upload_part(Bucket=self.bucket, Key=self.object_name,
+                                              PartNumber=part_number, UploadId=self.upload_id,
+                                              Body=body)
+        return {'PartNumber': part_number, 'ETag': response['ETag']}
+
+    def close(self):
+        """
+        Upload the last part and complete the multipart upload
+        """
+        if self.buffer or not self.futures:
+            self.submit_part(bytes(self.buffer))
+            self.buffer = bytearray()
+        parts = [future.result() for future in self.futures]
+        if self.own_executor:
+            self.executor.shutdown()
+        self.s3_client.complete_multipart_upload(Bucket=self.bucket, Key=self.object_name,
+                                                 UploadId=self.upload_id,
+                                                 MultipartUpload={'Parts': parts})
+
+    def abort(self):
+        """
+        Drop the parts uploaded so far
+        """
+        if self.own_executor:
+            self.executor.shutdown()
+        else:
+            for future in self.futures:
+                future.cancel()
+            futures_wait(self.futures)
+        self.s3_client.abort_multipart_upload(Bucket=self.bucket, Key=self.object_name,
+                                              UploadId=self.upload_id)
+
+
 class CloudStorage():
     """
     Utility class for cloud file upload
     """
+    # boto3 clients are thread safe, so one client and its connection pool
+    # are shared by every thread of a process
+    _s3_clients = {}
+    _s3_clients_lock = threading.Lock()
+
     def __init__(self, provider=None):
         """
         :param provider: cloud provider, awss3 by default
@@ -71,6 +674,27 @@ class CloudStorage():
             provider = settings.CLOUD_STORAGE_PROVIDER
         self.provider = provider
 
+    @classmethod
+    def get_s3_client(cls):
+        """
+        Get the S3 client of this process, creating it on first use. Clients are
+        keyed by pid so that forked workers do not share connections.
+        :return: boto3 S3 client
+        """
+        pid = os.getpid()
+        s3_client = cls._s3_clients.get(pid)
+        if s3_client is None:
+            with cls._s3_clients_lock:
+                s3_client = cls._s3_clients.get(pid)
+                if s3_client is None:
+                    s3_client = boto3.client(
+                        's3', aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
+                        aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
+                        region_name=settings.S3_REGION_NAME,
+                        config=Config(max_pool_connections=settings.S3_MAX_POOL_CONNECTIONS))
+                    cls._s3_clients = {pid: s3_client}
+        return s3_client
+
     def s3_upload_file(self, path, fyle_org_id):
         """
         Upload a file to AWS S3
@@ -81,24 +705,142 @@ class CloudStorage():
         """
         file_name = path
         object_name = fyle_org_id +'/'+ path.split('/')[2]
-        s3_client = boto3.client('s3', aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
-                                 aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY)
+        s3_client = self.get_s3_client()
+        transfer_config = TransferConfig(max_concurrency=settings.S3_TRANSFER_MAX_CONCURRENCY,
+                                         multipart_chunksize=settings.S3_MULTIPART_PART_SIZE)
+        try:
+            s3_client.upload_file(file_name, settings.S3_BUCKET_NAME, object_name,
+                                  Config=transfer_config)
+        except ClientError as e:
+            logging.error('Error while uploading to s3 for oject %s. Error: %s', object_name, e)
+            raise
+
+    def s3_upload_file_resumable(self, path, fyle_org_id, checkpoint):
+        """
+        Upload a file to AWS S3 as a multipart upload, recording every uploaded part
+        in the checkpoint so that a retry only uploads the missing parts
+        :param path: path to find the local file
+        :param fyle_org_id: fyle org_id of the user
+        :param checkpoint: BackupCheckpoint of the backup
+        """
+        object_name = fyle_org_id +'/'+ path.split('/')[2]
+        s3_client = self.get_s3_client()
         try:
-            s3_client.upload_file(file_name, settings.S3_BUCKET_NAME, object_name)
+            try:
+                self.upload_missing_parts(s3_client, path, object_name, checkpoint)
+            except ClientError as e:
+                if e.response['Error']['Code'] != 'NoSuchUpload':
+                    raise
+                logger.info('Upload of %s expired, uploading it again', object_name)
+                checkpoint.upload_id = None
+                self.upload_missing_parts(s3_client, path, object_name, checkpoint)
         except ClientError as e:
             logging.error('Error while uploading to s3 for oject %s. Error: %s', object_name, e)
             raise
 
-    def upload(self, path, fyle_org_id):
+    @staticmethod
+    def upload_missing_parts(s3_client, path, object_name, checkpoint):
+        """
+        Upload the parts of a file missing from the checkpoint and complete the upload
+        :param s3_client: boto3 S3 client
+        :param path: path to find the local file
+        :param object_name: S3 object name
+        :param checkpoint: BackupCheckpoint of the backup
+        """
+        if checkpoint.upload_id is None:
+            response = s3_client.create_multipart_upload(Bucket=settings.S3_BUCKET_NAME,
+                                                         Key=object_name)
+            checkpoint.upload_id = response['UploadId']
+            checkpoint.upload_part_size = settings.S3_MULTIPART_PART_SIZE
+            checkpoint.uploaded_parts = '[]'
+            checkpoint.save()
+        part_size = checkpoint.upload_part_size
+        parts = json.loads(checkpoint.uploaded_parts)
+        uploaded = {part['PartNumber'] for part in parts}
+        part_count = max(1, -(-os.path.getsize(path) // part_size))
+
+        def upload_part(part_number):
+            with open(path, 'rb') as archive_file:
+                archive_file.seek((part_number - 1) * part_size)
+                response = s3_client.upload_part(Bucket=settings.S3_BUCKET_NAME,
+                                                 Key=object_name, PartNumber=part_number,
+                                                 UploadId=checkpoint.upload_id,
+                                                 Body=archive_file.read(part_size))
+            return {'PartNumber': part_number, 'ETag': response['ETag']}
+
+        missing = [number for number in range(1, part_count + 1) if number not in uploaded]
+        with ThreadPoolExecutor(max_workers=settings.S3_TRANSFER_MAX_CONCURRENCY) as executor:
+            for future in as_completed([executor.submit(upload_part, number)
+                                        for number in missing]):
+                parts.append(future.result())
+                checkpoint.uploaded_parts = json.dumps(parts)
+                checkpoint.save()
+        s3_client.complete_multipart_upload(
+            Bucket=settings.S3_BUCKET_NAME, Key=object_name, UploadId=checkpoint.upload_id,
+            MultipartUpload={'Parts': sorted(parts, key=lambda part: part['PartNumber'])})
+
+    def upload(self, path, fyle_org_id, checkpoint=None):
         """
         Factory method to upload file to cloud storage
         :param path: path to find the local file
         :param fyle_org_id: fyle org_id of the user
+        :param checkpoint: BackupCheckpoint to make the upload resumable
         """
         if self.provider == 'awss3':
+            if checkpoint is not None:
+                return self.s3_upload_file_resumable(path, fyle_org_id, checkpoint)
             return self.s3_upload_file(path, fyle_org_id)
         raise NotImplementedError
 
+    def s3_put_object(self, object_name, content):
+        """
+        Upload bytes to AWS S3
+        :param object_name: S3 object name
+        :param content: bytes or binary file object to store
+        """
+        try:
+            self.get_s3_client().put_object(Bucket=settings.S3_BUCKET_NAME, Key=object_name,
+                                            Body=content)
+        except ClientError as e:
+            logging.error('Error while uploading to s3 for object %s. Error: %s', object_name, e)
+            raise
+
+    def put(self, object_name, content):
+        """
+        Factory method to store bytes in cloud storage
+        :param object_name: object name in cloud storage
+        :param content: bytes or binary file object to store
+        """
+        if self.provider == 'awss3':
+            return self.s3_put_object(object_name, content)
+        raise NotImplementedError
+
+    def s3_open_upload(self, object_name, executor=None):
+        """
+        Open a multipart upload to AWS S3
+        :param object_name: S3 object name
+        :param executor: executor to upload the parts with
+        :return: S3MultipartWriter
+        """
+        s3_client = self.get_s3_client()
+        try:
+            return S3MultipartWriter(s3_client, settings.S3_BUCKET_NAME, object_name,
+                                     executor=executor)
+        except ClientError as e:
+            logging.error('Error while starting s3 upload for object %s. Error: %s',
+                          object_name, e)
+            raise
+
+    def open_upload(self, object_name, executor=None):
+        """
+        Factory method to open a stream that uploads to cloud storage as it is written
+        :param object_name: object name in cloud storage
+        :param executor: executor shared for uploading, if the provider uploads in parallel
+        """
+        if self.provider == 'awss3':
+            return self.s3_open_upload(object_name, executor=executor)
+        raise NotImplementedError
+
     @staticmethod
     def create_presigned_url(object_name):
         """Generate a presigned URL to share an S3 object
@@ -106,9 +848,7 @@ class CloudStorage():
         :param object_name: string - s3 object name
         :return: Presigned URL as string. If error, returns None.
         """
-        s3_client = boto3.client('s3', aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
-                                 aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
-                                 region_name=settings.S3_REGION_NAME)
+        s3_client = CloudStorage.get_s3_client()
         try:
             response = s3_client.generate_presigned_url('get_object',
                                                         Params={'Bucket': settings.S3_BUCKET_NAME,
@@ -121,102 +861,712 @@ class CloudStorage():
         return response
 
 
+def iter_base64_chunks(encoded, chunk_size=None):
+    """
+    Decode base64 in blocks, so that a large attachment is never held decoded as a whole.
+    The last block is decoded first, so that a payload with broken padding fails before
+    anything has been written.
+    :param encoded: base64 string
+    :param chunk_size: decoded bytes per block, settings.ATTACHMENT_DECODE_CHUNK_SIZE by default
+    :return: Generator of bytes
+    """
+    if any(char in encoded for char in '\r\n '):
+        encoded = ''.join(encoded.split())
+    # 4 base64 characters decode to 3 bytes, blocks must not split such a group
+    step = (chunk_size or settings.ATTACHMENT_DECODE_CHUNK_SIZE) // 3 * 4 or 4
+    last_start = max(0, (len(encoded) - 1) // step * step)
+    last_chunk = binascii.a2b_base64(encoded[last_start:])
+    for start in range(0, last_start, step):
+        yield binascii.a2b_base64(encoded[start:start + step])
+    yield last_chunk
+
+
+class AttachmentDownloader():
+    """
+    Fetch expense attachments concurrently using a bounded pool of workers
+    """
+    def __init__(self, fyle_connection, workers=None, retries=None):
+        """
+        :param fyle_connection: FyleSdkConnector instance
+        :param workers: concurrent downloads, settings.ATTACHMENT_DOWNLOAD_WORKERS by default
+        :param retries: retries per expense, settings.ATTACHMENT_DOWNLOAD_RETRIES by default
+        """
+        self.connection = fyle_connection
+        self.workers = workers or settings.ATTACHMENT_DOWNLOAD_WORKERS
+        self.retries = settings.ATTACHMENT_DOWNLOAD_RETRIES if retries is None else retries
+
+    def fetch(self, expense_id):
+        """
+        Fetch the attachments of an expense, retrying with exponential backoff
+        :param expense_id: Unique ID to find an Expense.
+        :return: List with dicts in Attachments schema.
+        """
+        attempt = 0
+        while True:
+            try:
+                return self.connection.extract_attachments(expense_id)['data']
+            except Exception as e:
+                if attempt >= self.retries:
+                    raise
+                attempt += 1
+                logger.warning('Attachment fetch failed for expense %s, attempt %s/%s. Error: %s',
+                               expense_id, attempt, self.retries, e)
+                time.sleep(settings.ATTACHMENT_RETRY_BACKOFF * 2 ** (attempt - 1))
+
+    def download(self, expense_ids):
+        """
+        Fetch attachments for the given expenses concurrently. At most twice the
+        number of workers are in flight, and results are yielded in input order.
+        :param expense_ids: list of expense ids
+        :return: Generator of (expense_id, attachments, error) tuples
+        """
+        expense_ids = iter(expense_ids)
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            pending = deque()
+            for expense_id in itertools.islice(expense_ids, self.workers * 2):
+                pending.append((expense_id, executor.submit(self.fetch, expense_id)))
+            while pending:
+                expense_id, future = pending.popleft()
+                next_id = next(expense_ids, None)
+                if next_id is not None:
+                    pending.append((next_id, executor.submit(self.fetch, next_id)))
+                try:
+                    yield expense_id, future.result(), None
+                except Exception as e:
+                    yield expense_id, None, e
+
+
+class DirectoryArchive():
+    """
+    Backup written as files in a local directory and zipped when closed
+    """
+    def __init__(self, dir_name, data_file_sizes=None):
+        """
+        :param dir_name: path of the directory to create
+        :param data_file_sizes: dict of data file name to size, to resume the
+        partially written backup in an existing directory
+        """
+        self.dir_name = dir_name
+        self.data_files = []
+        self.data_file_sizes = data_file_sizes or {}
+        if not self.data_file_sizes:
+            os.mkdir(dir_name)
+
+    def is_resumed(self, filename):
+        """
+        Whether a data file continues from an earlier run
+        :param filename: name of the file inside the backup
+        """
+        return filename in self.data_file_sizes
+
+    def open_data_file(self, filename, binary=False):
+        """
+        Open a file for the backup data. Resumed files are cut back to their
+        checkpointed size, dropping rows written after the last checkpoint.
+        :param filename: name of the file inside the backup
+        :param binary: open in binary instead of text mode
+        :return: writable file object
+        """
+        path = self.dir_name + '/' + filename
+        mode = 'b' if binary else ''
+        if self.is_resumed(filename):
+            os.truncate(path, self.data_file_sizes[filename])
+            data_file = open(path, 'a' + mode)
+        else:
+            data_file = open(path, 'w' + mode)
+        self.data_files.append((filename, data_file))
+        return data_file
+
+    def get_data_file_sizes(self):
+        """
+        Flush the data files and get their sizes, for checkpointing
+        :return: dict of data file name to size
+        """
+        sizes = dict(self.data_file_sizes)
+        for filename, data_file in self.data_files:
+            data_file.flush()
+            sizes[filename] = os.path.getsize(self.dir_name + '/' + filename)
+        return sizes
+
+    def write_attachment(self, filename, chunks):
+        """
+        :param filename: name of the file inside the backup
+        :param chunks: decoded attachment bytes, or an iterable of them
+        """
+        if isinstance(chunks, bytes):
+            chunks = [chunks]
+        with open(self.dir_name + '/' + filename, "wb") as fh:
+            for chunk in chunks:
+                fh.write(chunk)
+
+    def close(self):
+        """
+        Zip the backup directory
+        :return: path of the zip file
+        """
+        for _, data_file in self.data_files:
+            data_file.close()
+        shutil.make_archive(self.dir_name, 'zip', self.dir_name)
+        return self.dir_name + '.zip'
+
+    def abort(self):
+        for _, data_file in self.data_files:
+            data_file.close()
+
+
+class ZipStreamArchive():
+    """
+    Backup written straight into a zip stream, without a temp directory
+    """
+    # Receipt formats that are already compressed are stored as is
+    STORED_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.heic', '.pdf', '.zip', '.gz',
+                         '.zst', '.parquet')
+
+    def __init__(self, file, compresslevel=None, spool_dir=None):
+        """
+        :param file: path or writable file object for the zip, need not be seekable.
+        File objects are closed along with the archive.
+        :param compresslevel: deflate level 0-9, settings.BACKUP_ZIP_COMPRESSION_LEVEL by default
+        :param spool_dir: directory for data files that outgrow the in-memory spool
+        """
+        if compresslevel is None:
+            compresslevel = settings.BACKUP_ZIP_COMPRESSION_LEVEL
+        self.file = file
+        self.spool_dir = spool_dir
+        self.data_files = []
+        self.zip_file = zipfile.ZipFile(file, 'w', compression=zipfile.ZIP_DEFLATED,
+                                        compresslevel=compresslevel)
+
+    def is_resumed(self, filename):
+        """
+        Streamed archives always start from scratch
+        """
+        return False
+
+    def open_data_file(self, filename, binary=False):
+        """
+        Open a spooled file for the backup data. The zip format allows only one
+        entry to be written at a time, so the data file is copied into the archive
+        on close while attachments are streamed in as they arrive.
+        :param filename: name of the file inside the backup
+        :param binary: open in binary instead of text mode
+        :return: writable file object
+        """
+        data_file = tempfile.SpooledTemporaryFile(max_size=settings.BACKUP_DATA_SPOOL_SIZE,
+                                                  mode='w+b' if binary else 'w+',
+                                                  dir=self.spool_dir)
+        self.data_files.append((filename, data_file))
+        return data_file
+
+    def write_attachment(self, filename, chunks):
+        """
+        :param filename: name of the file inside the backup
+        :param chunks: decoded attachment bytes, or an iterable of them
+        """
+        if isinstance(chunks, bytes):
+            chunks = [chunks]
+        with self.zip_file.open(self.get_zip_entry(filename), 'w') as entry:
+            for chunk in chunks:
+                entry.write(chunk)
+
+    def get_zip_entry(self, filename):
+        """
+        Name of the zip entry for a file, or a header that turns off compression
+        for formats that are already compressed
+        :param filename: name of the file inside the backup
+        """
+        if not filename.lower().endswith(self.STORED_EXTENSIONS):
+            return filename
+        zip_info = zipfile.ZipInfo(filename, date_time=time.localtime(time.time())[:6])
+        zip_info.compress_type = zipfile.ZIP_STORED
+        zip_info.external_attr = 0o600 << 16
+        return zip_info
+
+    def close(self):
+        """
+        Copy the data files into the zip and write the central directory
+        :return: the path or file object the zip was written to
+        """
+        for filename, data_file in self.data_files:
+            data_file.seek(0)
+            with self.zip_file.open(self.get_zip_entry(filename), 'w', force_zip64=True) as entry:
+                chunk = data_file.read(settings.BACKUP_COPY_CHUNK_SIZE)
+                while chunk:
+                    entry.write(chunk.encode() if isinstance(chunk, str) else chunk)
+                    chunk = data_file.read(settings.BACKUP_COPY_CHUNK_SIZE)
+            data_file.close()
+        self.zip_file.close()
+        if not isinstance(self.file, str):
+            self.file.close()
+        return self.file
+
+    def abort(self):
+        for _, data_file in self.data_files:
+            data_file.close()
+        if isinstance(self.file, str):
+            self.zip_file.close()
+            os.unlink(self.file)
+        else:
+            self.file.abort()
+
+
 class Dumper():
     """
-    Used to Dump the expenses data into a CSV or JSON file
+    Used to Dump the expenses data into a CSV, JSON Lines, Parquet or Arrow file
     """
     def __init__(self, fyle_connection, **kwargs):
         """
         :param fyle_connection: connection to fyle through FyleSDK
         :param path: path to find the local file
         :param data: List of dicts containing expense data
+        :param pages: Iterable of lists of expense dicts, used instead of data
         :param fyle_org_id: string
         :param name: backup name
         :param download_attachments: string 'True'/'False'
+        :param archive_mode: 'directory', 'stream' or 'multipart',
+        settings.BACKUP_ARCHIVE_MODE by default
+        :param manifest: dict describing the backup, written to manifest.json
+        :param dedup_attachments: keep attachments in the shared attachment store and
+        only reference them from the backup, settings.ATTACHMENT_DEDUP_ENABLED by default
+        :param checkpoint: BackupCheckpoint to record progress in, and resume from
+        in directory mode
+        :param data_format: 'CSV', 'JSONL', 'JSONL_GZ', 'JSONL_ZSTD', 'PARQUET' or 'ARROW',
+        CSV by default
+        :param schema_version: version of the expenses schema for CSV columns, the latest
+        by default
+        :param stage_timer: metrics.StageTimer adding up the time of the backup stages
+        :param upload_executor: executor shared for the part uploads of multipart archives,
+        each archive starts its own by default
+        :param heartbeat: called while pages are written, at most every
+        settings.BACKUP_JOB_HEARTBEAT_INTERVAL seconds
         """
         self.connection = fyle_connection
         self.path = kwargs.get('path')
         self.data = kwargs.get('data')
+        self.pages = kwargs.get('pages')
         self.fyle_org_id = kwargs.get('fyle_org_id')
         self.name = kwargs.get('name')
         self.download_attachments = kwargs.get('download_attachments')
+        self.archive_mode = kwargs.get('archive_mode') or settings.BACKUP_ARCHIVE_MODE
+        self.manifest = kwargs.get('manifest') or {}
+        self.dedup_attachments = kwargs.get('dedup_attachments',
+                                            settings.ATTACHMENT_DEDUP_ENABLED)
+        self.attachment_index_writer = None
+        self.partly_archived = {}
+        self.csv_file = None
+        self.csv_writer = None
+        self.expense_count = 0
+        self.watermark = None
+        self.schema = get_schema('expenses', kwargs.get('schema_version'))
+        self.data_format = kwargs.get('data_format') or 'CSV'
+        self.data_writer = None
+        self.dir_name = None
+        self.data_file_sizes = None
+        self.stage_timer = kwargs.get('stage_timer') or metrics.StageTimer()
+        self.upload_executor = kwargs.get('upload_executor')
+        self.heartbeat = kwargs.get('heartbeat')
+        self.heartbeat_sent_at = time.monotonic()
+        self.checkpoint = kwargs.get('checkpoint')
+        if self.checkpoint is not None and self.checkpoint.dumper_state:
+            self.restore_state(json.loads(self.checkpoint.dumper_state))
+
+    def restore_state(self, state):
+        """
+        Continue from the state saved by an earlier, interrupted run
+        :param state: dict saved by save_checkpoint()
+        """
+        self.dir_name = state.get('dir_name')
+        self.schema = get_schema('expenses', state.get('schema_version'))
+        self.expense_count = state.get('expense_count')
+        self.watermark = state.get('watermark')
+        self.manifest.update(state.get('manifest'))
+        self.data_file_sizes = state.get('data_file_sizes')
+        logger.info('Resuming %s from page %s', self.name, self.checkpoint.pages_done)
+
+    def save_checkpoint(self, archive, attachments_done, page=None):
+        """
+        Record that one more page is completely written. Only uncompressed CSV and
+        JSON Lines backups in directory archives can be resumed, others are restarted.
+        :param archive: DirectoryArchive or ZipStreamArchive of this backup
+        :param attachments_done: expenses of the page whose attachments were saved
+        :param page: the page written, a ShardPage also counts for its shard
+        """
+        if self.checkpoint is None or not isinstance(archive, DirectoryArchive) or \
+                self.data_format not in ('CSV', 'JSONL'):
+            return
+        self.checkpoint.pages_done += 1
+        if isinstance(page, ShardPage):
+            shards = json.loads(self.checkpoint.shards)
+            shards[page.shard]['pages_done'] += 1
+            self.checkpoint.shards = json.dumps(shards)
+        self.checkpoint.attachments_done += attachments_done
+        self.checkpoint.dumper_state = json.dumps({
+            'dir_name': self.dir_name,
+            'schema_version': self.schema.version,
+            'expense_count': self.expense_count,
+            'watermark': self.watermark,
+            'manifest': self.manifest,
+            'data_file_sizes': archive.get_data_file_sizes()
+        })
+        self.checkpoint.save()
 
-    def dump_csv(self, dir_name):
+    def send_heartbeat(self):
         """
-        :param data: Takes existing Expenses Data, that match the parameters
-        :param path: Takes the path of the file
+        Signal that the backup is still making progress, unless it did so recently
+        """
+        now = time.monotonic()
+        if self.heartbeat is None or \
+                now - self.heartbeat_sent_at < settings.BACKUP_JOB_HEARTBEAT_INTERVAL:
+            return
+        self.heartbeat_sent_at = now
+        self.heartbeat()
+
+    def iter_pages(self):
+        """
+        Yield the expense data page by page
+        """
+        if self.pages is not None:
+            yield from self.pages
+        elif self.data:
+            yield self.data
+
+    def dump_csv(self, archive, data=None):
+        """
+        Append a page of expenses to the backup CSV, writing the header on first call.
+        Columns come from the expenses schema, nested fields are flattened into them.
+        :param archive: DirectoryArchive or ZipStreamArchive of this backup
+        :param data: page of expense dicts, self.data by default
         :return: CSV file with the list of existing Expenses
         """
-        data = self.data
-        filename = dir_name + '/{0}.csv'.format(self.name)
+        if data is None:
+            data = self.data
         try:
-            with open(filename, 'w') as export_file:
-                keys = data[0].keys()
-                dict_writer = csv.DictWriter(export_file, fieldnames=keys, delimiter=',')
-                dict_writer.writeheader()
-                dict_writer.writerows(data)
+            if self.csv_writer is None:
+                filename = '{0}.csv'.format(self.name)
+                self.csv_file = archive.open_data_file(filename)
+                self.csv_writer = csv.DictWriter(self.csv_file, fieldnames=self.schema.fieldnames,
+                                                 delimiter=',')
+                if not archive.is_resumed(filename):
+                    self.csv_writer.writeheader()
+            self.csv_writer.writerows(self.schema.to_row(expense) for expense in data)
         except (OSError, csv.Error) as e:
             logger.error('CSV dump failed for %s, Error: %s', self.name, e)
             raise
 
-    def dump_attachments(self, dir_name):
+    def dump_rows(self, archive, data):
         """
-        :param data: Takes existing Expenses Data, that match the parameters
-        :param path: Takes the path of the file
-        :return:  Expenses Attachments
+        Add a page of expenses to the JSON Lines, Parquet or Arrow file of the backup
+        :param archive: DirectoryArchive or ZipStreamArchive of this backup
+        :param data: page of expense dicts
         """
-        fyle_connection = self.connection
-        expense_ids = [(i.get('id')) for i in self.data if i['has_attachments'] is True]
-        if not expense_ids:
-            logger.error('No attachments found for: %s', dir_name)
-            return
+        try:
+            if self.data_writer is None:
+                filename = self.name + get_data_file_extension(self.data_format)
+                self.data_writer = open_data_writer(archive.open_data_file(filename, binary=True),
+                                                    self.data_format, self.schema)
+            self.data_writer.write(data)
+        except (OSError, ValueError, TypeError) as e:
+            logger.error('%s dump failed for %s, Error: %s', self.data_format, self.name, e)
+            raise
+
+    def dump_page(self, archive, data):
+        """
+        Write a page of expenses in the data format of the backup
+        :param archive: DirectoryArchive or ZipStreamArchive of this backup
+        :param data: page of expense dicts
+        """
+        if self.data_format == 'CSV':
+            self.dump_csv(archive, data)
+        else:
+            self.dump_rows(archive, data)
+
+    def close_data_file(self):
+        """
+        Write out the rows buffered by the data writer and the end of the data file
+        """
+        if self.data_writer is not None:
+            self.data_writer.close()
+
+    def dump_attachments(self, archive, data=None):
+        """
+        :param archive: DirectoryArchive or ZipStreamArchive of this backup
+        :param data: page of expense dicts, self.data by default
+        :return: number of expenses with attachments in the page
+        """
+        if data is None:
+            data = self.data
+        expenses, expense_ids = self.get_attachment_expenses(archive, data)
+        if not expenses:
+            return 0
+
+        downloader = AttachmentDownloader(self.connection)
+        downloads = downloader.download(expense_ids)
+        for position, (expense_id, attachments, error) in enumerate(downloads, 1):
+            if error is not None:
+                logger.error('Attachment dump failed for expense %s, Error: %s', expense_id, error)
+                continue
+            self.write_expense_attachments(archive, expenses[expense_id], attachments)
+            self.log_attachment_progress(position, len(expense_ids))
+        return len(expenses)
+
+    def get_attachment_expenses(self, archive, data):
+        """
+        Find the expenses of a page whose attachments need to be downloaded
+        :param archive: DirectoryArchive or ZipStreamArchive of this backup
+        :param data: page of expense dicts
+        :return: (dict of expense id to expense with attachments, ids to download)
+        """
+        expenses = {i.get('id'): i for i in data if i['has_attachments'] is True}
+        if not expenses:
+            logger.info('No attachments found in this page for: %s', self.name)
+            return expenses, []
+        expense_ids = list(expenses)
+        if self.dedup_attachments:
+            expense_ids = self.reference_archived_attachments(archive, expenses)
         logger.info('%s Expense(s) have attachment(s) . Downloading now.', len(expense_ids))
+        return expenses, expense_ids
 
-        for expense_id in expense_ids:
+    def write_expense_attachments(self, archive, expense, attachments):
+        """
+        Decode and write the downloaded attachments of an expense
+        :param archive: DirectoryArchive or ZipStreamArchive of this backup
+        :param expense: expense dict the attachments belong to
+        :param attachments: list of dicts in Attachments schema
+        """
+        expense_id = expense.get('id')
+        archived = self.partly_archived.pop(expense_id, {})
+        # The attachment store keeps one attachment per file name of an expense
+        attachment_count = len({attachment.get('filename') for attachment in attachments})
+        for attachment in attachments:
+            filename = expense_id + '_' + attachment.get('filename')
+            # The payload is dropped from the response as soon as it is written
+            encoded = attachment.pop('content', None) or ''
             try:
-                attachment = fyle_connection.extract_attachments(expense_id)
-                attachment_data = attachment['data']
-                attachment_content = [item.get('content') for item in attachment_data]
-
-                if attachment['data']:
-                    attachment = attachment['data'][0]
-                    attachment['expense_id'] = expense_id
-                    attachment_names = [item.get('filename') for item in attachment_data]
-
-                    for index, img_data in enumerate(attachment_content):
-                        img_data = (attachment_content[index])
-                        with open(dir_name + '/' + expense_id + '_' +
-                                    attachment_names[index], "wb") as fh:
-                            fh.write(base64.b64decode(img_data))
-                            # logger.info('%s_%s Download completed', expense_id,
-                            #              attachment_names[index])
-            except Exception as e:
-                logger.error('Attachment dump failed for %s, Error: %s', attachment_names[index], e)
+                archived_attachment = archived.get(attachment.get('filename'))
+                if archived_attachment is not None:
+                    archived_attachment.expense_attachment_count = attachment_count
+                    archived_attachment.save(update_fields=['expense_attachment_count'])
+                    self.write_attachment_reference(archive, archived_attachment)
+                    continue
+                chunks = self.count_attachment_bytes(iter_base64_chunks(encoded))
+                if self.dedup_attachments:
+                    self.store_attachment(archive, expense, attachment.get('filename'), chunks,
+                                          attachment_count)
+                else:
+                    archive.write_attachment(filename, chunks)
+                metrics.BACKUP_ATTACHMENTS.inc()
+            except (OSError, binascii.Error, ClientError) as e:
+                logger.error('Attachment dump failed for %s, Error: %s', filename, e)
+            del encoded
+
+    def log_attachment_progress(self, position, total):
+        if position % settings.ATTACHMENT_PROGRESS_LOG_INTERVAL == 0 or position == total:
+            logger.info('Attachments downloaded for %s/%s expense(s) of %s',
+                        position, total, self.name)
+
+    @staticmethod
+    def count_attachment_bytes(chunks):
+        """
+        Pass decoded attachment blocks through, counting their bytes
+        :param chunks: iterable of bytes
+        """
+        for chunk in chunks:
+            metrics.BACKUP_BYTES.labels('attachments').inc(len(chunk))
+            yield chunk
+
+    def write_attachment_reference(self, archive, archived_attachment):
+        """
+        Add an attachment from the attachment store to attachments.csv of the backup
+        :param archive: DirectoryArchive or ZipStreamArchive of this backup
+        :param archived_attachment: ArchivedAttachment object
+        """
+        if self.attachment_index_writer is None:
+            index_file = archive.open_data_file('attachments.csv')
+            self.attachment_index_writer = csv.writer(index_file)
+            if not archive.is_resumed('attachments.csv'):
+                self.attachment_index_writer.writerow(['expense_id', 'filename', 'object_name',
+                                                       'content_hash'])
+            self.manifest.update(attachment_index='attachments.csv',
+                                 attachment_bucket=settings.S3_BUCKET_NAME)
+        self.attachment_index_writer.writerow([archived_attachment.expense_id,
+                                               archived_attachment.filename,
+                                               archived_attachment.object_name,
+                                               archived_attachment.content_hash])
+
+    def reference_archived_attachments(self, archive, expenses):
+        """
+        Reference the attachments of expenses that have not changed since they were
+        archived by an earlier backup
+        :param archive: DirectoryArchive or ZipStreamArchive of this backup
+        :param expenses: dict of expense id to expense
+        :return: ids of the expenses whose attachments still need to be downloaded
+        """
+        archived_attachments = ArchivedAttachment.objects.filter(
+            fyle_org_id=self.fyle_org_id, expense_id__in=list(expenses))
+        archived_by_expense = {}
+        for archived_attachment in archived_attachments:
+            expense = expenses[archived_attachment.expense_id]
+            if archived_attachment.expense_updated_at == expense.get('updated_at'):
+                archived_by_expense.setdefault(archived_attachment.expense_id, {})[
+                    archived_attachment.filename] = archived_attachment
+        archived_expense_ids = set()
+        for expense_id, archived in archived_by_expense.items():
+            if all(archived_attachment.expense_attachment_count == len(archived)
+                   for archived_attachment in archived.values()):
+                for archived_attachment in archived.values():
+                    self.write_attachment_reference(archive, archived_attachment)
+                archived_expense_ids.add(expense_id)
+            else:
+                # Partly archived expenses are downloaded again for their missing attachments
+                self.partly_archived[expense_id] = archived
+        logger.info('%s Expense(s) have attachments in the attachment store for %s',
+                    len(archived_expense_ids), self.name)
+        return [expense_id for expense_id in expenses if expense_id not in archived_expense_ids]
+
+    def store_attachment(self, archive, expense, filename, chunks, attachment_count=None):
+        """
+        Put an attachment into the content addressed attachment store, unless the
+        same content is already there, and reference it from the backup
+        :param archive: DirectoryArchive or ZipStreamArchive of this backup
+        :param expense: expense dict the attachment belongs to
+        :param filename: attachment file name
+        :param chunks: iterable of decoded attachment bytes
+        :param attachment_count: number of distinct attachment file names of the expense
+        """
+        content_hash = hashlib.sha256()
+        with tempfile.SpooledTemporaryFile(max_size=settings.BACKUP_DATA_SPOOL_SIZE,
+                                           dir=self.path) as content:
+            for chunk in chunks:
+                content_hash.update(chunk)
+                content.write(chunk)
+            content_hash = content_hash.hexdigest()
+            object_name = '{0}/attachments/{1}'.format(self.fyle_org_id, content_hash)
+            if not ArchivedAttachment.objects.filter(fyle_org_id=self.fyle_org_id,
+                                                     content_hash=content_hash).exists():
+                content.seek(0)
+                CloudStorage().put(object_name, content)
+        # Attachments archived for an older version of the expense are replaced
+        ArchivedAttachment.objects.filter(fyle_org_id=self.fyle_org_id,
+                                          expense_id=expense.get('id')).exclude(
+                                              expense_updated_at=expense.get('updated_at')).delete()
+        archived_attachment, _ = ArchivedAttachment.objects.update_or_create(
+            fyle_org_id=self.fyle_org_id, expense_id=expense.get('id'), filename=filename,
+            defaults={'expense_updated_at': expense.get('updated_at'),
+                      'expense_attachment_count': attachment_count,
+                      'content_hash': content_hash, 'object_name': object_name})
+        self.write_attachment_reference(archive, archived_attachment)
+
+    def track_page(self, data):
+        """
+        Count the expenses of a page and track the highest updated_at seen
+        :param data: page of expense dicts
+        """
+        self.expense_count += len(data)
+        updated_at = max((expense.get('updated_at') or '' for expense in data), default='')
+        if updated_at and (self.watermark is None or updated_at > self.watermark):
+            self.watermark = updated_at
+
+    def dump_manifest(self, archive):
+        """
+        Write manifest.json, linking incremental backups to their base backup
+        :param archive: DirectoryArchive or ZipStreamArchive of this backup
+        """
+        manifest = dict(self.manifest, name=self.name, fyle_org_id=self.fyle_org_id,
+                        data_format=self.data_format, schema_version=self.schema.version,
+                        expense_count=self.expense_count,
+                        watermark=self.watermark)
+        json.dump(manifest, archive.open_data_file('manifest.json'), indent=2)
+
+    def open_archive(self, dir_name):
+        """
+        Create the archive this backup is written into, based on archive_mode
+        :param dir_name: path of the backup without extension
+        """
+        if self.archive_mode == 'directory' and self.data_file_sizes:
+            return DirectoryArchive(dir_name, self.data_file_sizes)
+        if self.archive_mode == 'stream':
+            return ZipStreamArchive(dir_name + '.zip', spool_dir=self.path)
+        if self.archive_mode == 'multipart':
+            object_name = self.fyle_org_id + '/' + os.path.basename(dir_name) + '.zip'
+            upload = CloudStorage().open_upload(object_name, executor=self.upload_executor)
+            return ZipStreamArchive(upload, spool_dir=self.path)
+        if self.archive_mode == 'directory':
+            return DirectoryArchive(dir_name)
+        raise NotImplementedError
 
     def dump_data(self):
         """
-        Wrapper function for dumping backup to local file
+        Wrapper function for dumping backup to local file. In multipart mode
+        the archive is uploaded to cloud storage while it is written instead.
+        :return: path of the zip file
         """
         try:
-            now = datetime.now().strftime("%d-%m-%Y-%H:%M:%S")
-            dir_name = self.path + '{}-{}-Date--{}'.format(self.fyle_org_id, self.name, now)
-            os.mkdir(dir_name)
-            self.dump_csv(dir_name)
-            if self.download_attachments is True:
-                logger.info('Going to download attachment for backup: %s', self.name)
-                self.dump_attachments(dir_name)
-            logger.info('Attachment dump finished for %s', self.name)
-            shutil.make_archive(dir_name, 'zip', dir_name)
-            logger.info('Archive file created at %s for %s', dir_name, self.name)
-            return dir_name+'.zip'
+            archive = self.start_dump()
+            try:
+                timer = self.stage_timer
+                for page in timer.iterate('extract', self.iter_pages()):
+                    with timer.time('dump'):
+                        self.write_page(archive, page)
+                    attachments_done = 0
+                    if self.download_attachments is True:
+                        with timer.time('attachments'):
+                            attachments_done = self.dump_attachments(archive, page)
+                    self.save_checkpoint(archive, attachments_done, page)
+                    self.send_heartbeat()
+                with timer.time('archive'):
+                    return self.finish_dump(archive)
+            except Exception:
+                archive.abort()
+                raise
         except Exception as e:
             logger.error('Error in dump_data() : %s', e)
             raise
 
+    def start_dump(self):
+        """
+        Name the backup and open its archive
+        :return: DirectoryArchive or ZipStreamArchive of this backup
+        """
+        if self.dir_name is None or self.archive_mode != 'directory':
+            now = datetime.now().strftime("%d-%m-%Y-%H:%M:%S")
+            self.dir_name = self.path + '{}-{}-Date--{}'.format(self.fyle_org_id,
+                                                                self.name, now)
+        if self.download_attachments is True:
+            logger.info('Going to download attachment for backup: %s', self.name)
+        return self.open_archive(self.dir_name)
+
+    def write_page(self, archive, page):
+        """
+        Count a page of expenses and write it to the data file
+        :param archive: DirectoryArchive or ZipStreamArchive of this backup
+        :param page: page of expense dicts
+        """
+        self.track_page(page)
+        self.dump_page(archive, page)
+        metrics.BACKUP_ROWS.labels(self.data_format).inc(len(page))
+
+    def finish_dump(self, archive):
+        """
+        Write the end of the data file and the manifest, and close the archive
+        :param archive: DirectoryArchive or ZipStreamArchive of this backup
+        :return: path of the zip file
+        """
+        logger.info('Attachment dump finished for %s', self.name)
+        self.close_data_file()
+        self.dump_manifest(archive)
+        archive_file = archive.close()
+        metrics.BACKUP_BYTES.labels('archive').inc(
+            os.path.getsize(archive_file) if isinstance(archive_file, str)
+            else archive_file.tell())
+        logger.info('Archive file created at %s for %s', self.dir_name, self.name)
+        return self.dir_name + '.zip'
+
 def remove_items_from_tmp(dir_path):
     try:
         os.unlink(dir_path)
-        shutil.rmtree(dir_path.split('.zip')[0])
+        # Streamed archives are written without a backup directory
+        if os.path.isdir(dir_path.split('.zip')[0]):
+            shutil.rmtree(dir_path.split('.zip')[0])
     except OSError as e:
         logger.error('Error while deleting %s. Error: %s', dir_path, e)
         raise
@@ -243,18 +1593,20 @@ def send_email(from_email, to_email, subject, content):
         raise
 
 
-def notify_user(fyle_connection, file_path, fyle_org_id, object_type):
+def notify_user(fyle_connection, file_path, fyle_org_id, object_type, user_data=None):
     """
     Get a presigned URL and mail it to user
     :param fyle_connection: fyle SDK connection
     :param file_path: S3 object name
     :param fyle_org_id: fyle org id to which user belongs
     :param object_type: business object type eg: expenses
+    :param user_data: Fyle profile of the user, fetched when not passed
     """
     try:
         object_name = fyle_org_id +'/'+ file_path
         presigned_url = CloudStorage().create_presigned_url(object_name)
-        user_data = fyle_connection.extract_employee_details()
+        if user_data is None:
+            user_data = fyle_connection.extract_employee_details()
         email_to = user_data.get('employee_email')
         subject = 'The {0} backup you requested from Fyle\
                    is ready for download'.format(object_type.capitalize())
@@ -265,54 +1617,327 @@ def notify_user(fyle_connection, file_path, fyle_org_id, object_type):
         raise
 
 
+def format_fyle_datetime(value):
+    """
+    Format a datetime as the yyyy-MM-ddTHH:mm:ss.SSSZ string used in Fyle filters
+    :param value: aware datetime
+    """
+    return value.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
+
+
+def get_expense_shards(state, updated_at, window_days=None):
+    """
+    Split an expenses query into independent shards, one per state and
+    updated_at window. Time windows need a lower updated_at bound to start from.
+    :param state: list of states, None for all
+    :param updated_at: list of updated_at filters
+    :param window_days: days per updated_at window, settings.EXPENSE_SHARD_WINDOW_DAYS
+    by default, 0 to not split by time
+    :return: list of (state, updated_at) filters
+    """
+    if window_days is None:
+        window_days = settings.EXPENSE_SHARD_WINDOW_DAYS
+    updated_at = updated_at or []
+    gte = next((value[4:] for value in updated_at if value.startswith('gte:')), None)
+    lte = next((value[4:] for value in updated_at if value.startswith('lte:')), None)
+    windows = [updated_at]
+    if gte and window_days > 0:
+        start = parser.isoparse(gte)
+        end = parser.isoparse(lte) if lte else datetime.now(timezone.utc)
+        window = timedelta(days=window_days)
+        windows = []
+        while start + window <= end:
+            window_end = start + window - timedelta(milliseconds=1)
+            windows.append(['gte:' + format_fyle_datetime(start),
+                            'lte:' + format_fyle_datetime(window_end)])
+            start += window
+        # The last window is left open ended when the query has no upper bound
+        windows.append(['gte:' + format_fyle_datetime(start)] + (['lte:' + lte] if lte else []))
+    states = [[value] for value in state] if state else [state]
+    return [(shard_state, window) for shard_state in states for window in windows]
+
+
+def get_base_backup(backup):
+    """
+    Get the latest successful backup with the same configuration, which an
+    incremental backup continues from
+    :param backup: backup object
+    :return: backup object or None
+    """
+    return Backups.objects.filter(user_id=backup.user_id, fyle_org_id=backup.fyle_org_id,
+                                  object_type=backup.object_type, filters=backup.filters,
+                                  data_format=backup.data_format, current_state='READY',
+                                  watermark__isnull=False,
+                                  created_at__lt=backup.created_at).first()
+
+
+def get_incremental_updated_at(updated_at, base_backup):
+    """
+    Replace the lower bound of an updated_at filter with the base backup's watermark.
+    Expenses updated exactly at the watermark are fetched again, as the filter is inclusive.
+    :param updated_at: list of updated_at filters
+    :param base_backup: backup object
+    :return: list of updated_at filters
+    """
+    updated_at = [value for value in updated_at or [] if not value.startswith('gte:')]
+    updated_at.append('gte:{0}'.format(format_fyle_datetime(base_backup.watermark)))
+    return updated_at
+
+
+def get_backup_checkpoint(backup, archive_mode):
+    """
+    Get the checkpoint of a backup, starting over when the local files it
+    refers to are gone or the dump cannot be resumed in this archive mode
+    :param backup: backup object
+    :param archive_mode: archive mode the backup is dumped with
+    :return: BackupCheckpoint object
+    """
+    checkpoint, created = BackupCheckpoint.objects.get_or_create(
+        backup=backup, defaults={'page_size': settings.EXPENSES_PAGE_SIZE})
+    if created:
+        return checkpoint
+    if checkpoint.stage == CheckpointStage.DUMPING:
+        dir_name = json.loads(checkpoint.dumper_state or '{}').get('dir_name')
+        resumable = archive_mode == 'directory' and dir_name and os.path.isdir(dir_name)
+    elif checkpoint.stage == CheckpointStage.ARCHIVED:
+        resumable = os.path.isfile(checkpoint.file_path)
+    else:
+        resumable = True
+    if not resumable:
+        checkpoint.delete()
+        return BackupCheckpoint.objects.create(backup=backup,
+                                               page_size=settings.EXPENSES_PAGE_SIZE)
+    logger.info('Resuming backup_id: %s from stage %s, page %s', backup.id,
+                checkpoint.stage, checkpoint.pages_done)
+    return checkpoint
+
+
 def fetch_and_notify_expenses(backup):
     """
     Fetch expenses matching the filters, upload to cloud,
-    notify user via email
+    notify user via email. Progress is checkpointed, so a retried
+    backup resumes where the failed attempt stopped.
     :param backup: backup object for which expense needs to be procesed
     :return : False for errored cases, True otherwise
     """
     backup_id = backup.id
-    filters = json.loads(backup.filters)
-    download_attachments = filters.get('download_attachments')
     refresh_token = backup.fyle_refresh_token
     fyle_org_id = backup.fyle_org_id
-    name = backup.name.replace(' ', '')
-    fyle_connection = FyleSdkConnector(refresh_token)
-    logger.info('Going to fetch data for backup_id: %s', backup_id)
-    response_data = fyle_connection.extract_expenses(state=filters.get('state'),
-                                                     approved_at=filters.get('approved_at'),
-                                                     updated_at=filters.get('updated_at'))
-    if not response_data:
-        logger.info('No data found for backup_id: %s', backup_id)
-        backup.current_state = 'NO DATA FOUND'
-        backup.save()
+    archive_mode = settings.BACKUP_ARCHIVE_MODE
+    stage_timer = metrics.StageTimer()
+    start = time.perf_counter()
+    outcome = 'failed'
+    fyle_connection = FyleSdkConnector(refresh_token, fyle_org_id)
+    checkpoint = get_backup_checkpoint(backup, archive_mode)
+    try:
+        if checkpoint.stage == CheckpointStage.DUMPING:
+            is_dumped = dump_expenses(backup, fyle_connection, checkpoint, archive_mode,
+                                      stage_timer)
+            if not is_dumped:
+                checkpoint.delete()
+                outcome = 'no_data'
+                return True
+        upload_and_notify(backup, fyle_connection, checkpoint, archive_mode, stage_timer)
+        outcome = 'ready'
         return True
+    except Exception as e:
+        backup.current_state = 'FAILED'
+        backup.save()
+        logger.error('Backup process failed for bkp_id: %s . Error: %s', backup_id, e)
+        return False
+    finally:
+        observe_backup(backup_id, outcome, stage_timer, start)
+        share_backup_result(backup)
 
-    logger.info('Going to dump data to file for backup_id: %s', backup_id)
-    dumper = Dumper(fyle_connection, path=settings.DOWNLOAD_PATH, data=response_data, name=name,
-                    fyle_org_id=fyle_org_id, download_attachments=download_attachments)
-    try:
-        file_path = dumper.dump_data()
-        logger.info('Download Successful for backup_id: %s', backup_id)
 
-        cloud_store = CloudStorage()
-        cloud_store.upload(file_path, fyle_org_id)
-        logger.info('Cloud upload Successful for backup_id: %s', backup_id)
-        # Get only the object name for db save
-        object_name = file_path.split('/')[2]
+def upload_and_notify(backup, fyle_connection, checkpoint, archive_mode, stage_timer):
+    """
+    Upload the dumped archive of a backup unless it is uploaded already, mail its
+    URL to the user and mark the backup ready
+    :param backup: backup object
+    :param fyle_connection: FyleSdkConnector instance
+    :param checkpoint: BackupCheckpoint of the backup
+    :param archive_mode: archive mode the backup was dumped with
+    :param stage_timer: metrics.StageTimer adding up the time of the backup stages
+    """
+    backup_id = backup.id
+    fyle_org_id = backup.fyle_org_id
+    file_path = checkpoint.file_path
+    logger.info('Download Successful for backup_id: %s', backup_id)
+
+    if checkpoint.stage == CheckpointStage.ARCHIVED:
+        with stage_timer.time('upload'):
+            cloud_store = CloudStorage()
+            cloud_store.upload(file_path, fyle_org_id, checkpoint)
+        checkpoint.stage = CheckpointStage.UPLOADED
+        checkpoint.save()
+    logger.info('Cloud upload Successful for backup_id: %s', backup_id)
+    # Get only the object name for db save
+    object_name = file_path.split('/')[2]
 
-        # Get a secure URL for this backup and mail it to user
+    # Get a secure URL for this backup and mail it to user
+    with stage_timer.time('notify'):
         notify_user(fyle_connection, object_name, fyle_org_id, 'expenes')
 
-        backup.file_path = object_name
-        backup.current_state = 'READY'
-        backup.save()
-        # Remove the files from local machine
+    backup.file_path = object_name
+    backup.current_state = 'READY'
+    backup.save()
+    # Remove the files from local machine
+    if archive_mode != 'multipart':
         remove_items_from_tmp(file_path)
-        return True
+    checkpoint.delete()
+
+
+def share_backup_result(backup):
+    """
+    Give the backups coalesced into a finished backup its outcome
+    :param backup: backup object
+    """
+    if backup.current_state == 'ONGOING':
+        return
+    try:
+        with transaction.atomic():
+            # Waits for backups being coalesced into this one right now
+            Backups.objects.select_for_update().get(id=backup.id)
+            count = backup.coalesced_backups.update(
+                current_state=backup.current_state, file_path=backup.file_path,
+                error_message=backup.error_message, watermark=backup.watermark)
+        if count:
+            logger.info('Outcome of backup_id: %s shared with %s coalesced backup(s)',
+                        backup.id, count)
     except Exception as e:
-        backup.current_state = 'FAILED'
-        backup.save()
-        logger.error('Backup process failed for bkp_id: %s . Error: %s', backup_id, e)
+        logger.error('Sharing the outcome of backup_id: %s failed. Error: %s', backup.id, e)
+
+
+def observe_backup(backup_id, outcome, stage_timer, start):
+    """
+    Record the duration and stage timings of a finished backup
+    :param backup_id: id of the backup
+    :param outcome: 'ready', 'no_data' or 'failed'
+    :param stage_timer: metrics.StageTimer of the backup
+    :param start: time.perf_counter() at the start of the backup
+    """
+    stage_timer.observe()
+    metrics.BACKUP_SECONDS.labels(outcome).observe(time.perf_counter() - start)
+    logger.info('Backup_id: %s %s in %.1fs, stage seconds: %s', backup_id, outcome,
+                time.perf_counter() - start,
+                {stage: round(seconds, 2) for stage, seconds in stage_timer.seconds.items()})
+
+
+def dump_expenses(backup, fyle_connection, checkpoint, archive_mode, stage_timer=None):
+    """
+    Fetch the expenses of a backup and dump them to an archive, continuing from
+    the pages already recorded in the checkpoint
+    :param backup: backup object
+    :param fyle_connection: FyleSdkConnector instance
+    :param checkpoint: BackupCheckpoint of the backup
+    :param archive_mode: archive mode to dump with
+    :param stage_timer: metrics.StageTimer adding up the time of the backup stages
+    :return: False when there were no expenses to back up, True otherwise
+    """
+    dumper = get_expense_dumper(backup, fyle_connection, checkpoint, archive_mode, stage_timer)
+    if dumper is None:
         return False
+    save_dumped_expenses(backup, checkpoint, archive_mode, dumper, dumper.dump_data())
+    return True
+
+
+def record_job_heartbeat(backup_id):
+    """
+    Mark the running job of a backup as alive, so that it is not queued again as stale
+    :param backup_id: id of the backup
+    """
+    BackupJob.objects.filter(backup_id=backup_id, state=JobState.RUNNING) \
+                     .update(heartbeat_at=datetime.now(timezone.utc))
+
+
+def get_expense_dumper(backup, fyle_connection, checkpoint, archive_mode, stage_timer=None,
+                       **kwargs):
+    """
+    Start fetching the expenses of a backup, continuing from the pages already
+    recorded in the checkpoint, and set up the Dumper for them
+    :param backup: backup object
+    :param fyle_connection: FyleSdkConnector instance
+    :param checkpoint: BackupCheckpoint of the backup
+    :param archive_mode: archive mode to dump with
+    :param stage_timer: metrics.StageTimer adding up the time of the backup stages
+    :param kwargs: further Dumper arguments
+    :return: Dumper, or None when there are no expenses to back up
+    """
+    backup_id = backup.id
+    filters = json.loads(backup.filters)
+    updated_at = filters.get('updated_at')
+    manifest = {'backup_id': backup_id, 'incremental': False}
+    if backup.is_incremental and not checkpoint.pages_done and not checkpoint.shards:
+        # Saved before the first checkpoint, so a resumed backup keeps the same base
+        backup.base_backup = get_base_backup(backup)
+        backup.save(update_fields=['base_backup'])
+    if backup.base_backup is not None:
+        updated_at = get_incremental_updated_at(updated_at, backup.base_backup)
+        manifest.update(incremental=True, base_backup_id=backup.base_backup.id,
+                        base_file_path=backup.base_backup.file_path, updated_at=updated_at)
+        logger.info('Backup_id: %s is incremental on backup_id: %s', backup_id,
+                    backup.base_backup.id)
+    logger.info('Going to fetch data for backup_id: %s', backup_id)
+    if checkpoint.shards:
+        shards = json.loads(checkpoint.shards)
+    elif not checkpoint.pages_done:
+        # Shards are kept in the checkpoint, as time windows depend on when they are made
+        shards = [{'state': state, 'updated_at': window, 'pages_done': 0}
+                  for state, window in get_expense_shards(filters.get('state'), updated_at)]
+        if len(shards) > 1:
+            checkpoint.shards = json.dumps(shards)
+    if checkpoint.shards:
+        # Each shard resumes after its own pages. Expenses that moved to another
+        # shard while the backup was interrupted may be written twice.
+        logger.info('Fetching %s shards for backup_id: %s', len(shards), backup_id)
+        pages = fyle_connection.iter_expenses_sharded(
+            [(shard['state'], shard['updated_at']) for shard in shards],
+            approved_at=filters.get('approved_at'), page_size=checkpoint.page_size,
+            offsets=[shard['pages_done'] * checkpoint.page_size for shard in shards])
+    else:
+        pages = fyle_connection.iter_expenses(state=filters.get('state'),
+                                              approved_at=filters.get('approved_at'),
+                                              updated_at=updated_at,
+                                              page_size=checkpoint.page_size,
+                                              offset=checkpoint.pages_done * checkpoint.page_size)
+    stage_timer = stage_timer or metrics.StageTimer()
+    with stage_timer.time('extract'):
+        first_page = next(pages, None)
+    if not first_page and not checkpoint.pages_done:
+        logger.info('No data found for backup_id: %s', backup_id)
+        backup.current_state = 'NO DATA FOUND'
+        backup.save()
+        return None
+    if first_page:
+        pages = itertools.chain([first_page], pages)
+
+    logger.info('Going to dump data to file for backup_id: %s', backup_id)
+    kwargs.setdefault('heartbeat', functools.partial(record_job_heartbeat, backup_id))
+    return Dumper(fyle_connection, path=settings.DOWNLOAD_PATH, pages=pages,
+                  name=backup.name.replace(' ', ''), fyle_org_id=backup.fyle_org_id,
+                  download_attachments=filters.get('download_attachments'),
+                  manifest=manifest, archive_mode=archive_mode,
+                  checkpoint=checkpoint, data_format=backup.data_format,
+                  stage_timer=stage_timer, **kwargs)
+
+
+def save_dumped_expenses(backup, checkpoint, archive_mode, dumper, file_path):
+    """
+    Record in the checkpoint and the backup that the expenses are dumped
+    :param backup: backup object
+    :param checkpoint: BackupCheckpoint of the backup
+    :param archive_mode: archive mode the expenses were dumped with
+    :param dumper: Dumper that wrote the archive
+    :param file_path: path of the zip file
+    """
+    checkpoint.file_path = file_path
+    # Multipart archives are uploaded while they are written
+    if archive_mode == 'multipart':
+        checkpoint.stage = CheckpointStage.UPLOADED
+    else:
+        checkpoint.stage = CheckpointStage.ARCHIVED
+    checkpoint.save()
+    if dumper.watermark:
+        backup.watermark = parser.isoparse(dumper.watermark)
+        backup.save()
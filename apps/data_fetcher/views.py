@@ -2,13 +2,17 @@ import logging
 import json
 
 from django.views import View
-from django.http import JsonResponse
+from django.http import JsonResponse, HttpResponse, Http404
 from django.views.decorators.csrf import csrf_exempt
+from django.contrib.admin.views.decorators import staff_member_required
 from django.utils.decorators import method_decorator
 
 from apps.backups.models import Backups
+from fyle_backup_app import settings
 
-from .utils import fetch_and_notify_expenses
+from . import metrics
+from .jobs import enqueue_backup, get_queue_stats
+from .utils import fetch_and_notify_expenses, get_fyle_api_stats
 logger = logging.getLogger('app')
 
 
@@ -27,9 +31,43 @@ class ExpensesFetchView(View):
             logger.error('Invalid backup_id sent by JobsInfra. Request: %s', request.POST)
             return JsonResponse({'status':'error', 'message':'Invalid backup_id.'}, status=400)
 
+        if settings.BACKUP_QUEUE_ENABLED:
+            enqueue_backup(backup)
+            return JsonResponse({'status':'queued', 'message':'Backup queued.'}, status=202)
+
         is_sucess = fetch_and_notify_expenses(backup)
         if is_sucess:
             return JsonResponse({'status':'success', 'message':'Backup processed.'}, status=200)
 
         return JsonResponse({'status':'error', 'message':'Backup failed.'},
                             status=500)
+
+
+@method_decorator(staff_member_required, name='dispatch')
+class QueueStatsView(View):
+    """
+    Depth of the backup queue, in total and per org
+    """
+    def get(self, request):
+        return JsonResponse(get_queue_stats())
+
+
+@method_decorator(staff_member_required, name='dispatch')
+class FyleApiStatsView(View):
+    """
+    Throughput, throttling and concurrency of the Fyle API calls of this process, per org
+    """
+    def get(self, request):
+        return JsonResponse(get_fyle_api_stats())
+
+
+class MetricsView(View):
+    """
+    Backup stage timings and throughput in the Prometheus text format
+    """
+    def get(self, request):
+        if metrics.prometheus_client is None:
+            raise Http404('prometheus_client is not installed')
+        prometheus_client = metrics.prometheus_client
+        return HttpResponse(prometheus_client.generate_latest(metrics.get_metrics_registry()),
+                            content_type=prometheus_client.CONTENT_TYPE_LATEST)
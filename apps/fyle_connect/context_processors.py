@@ -1,4 +1,4 @@
-from apps.data_fetcher.utils import FyleSdkConnector
+from apps.user.utils import get_employee_details
 
 def org_name(request):
     """
@@ -8,8 +8,7 @@ def org_name(request):
     """
     if request.user.is_authenticated:
         try:
-            fyle_sdk_connector = FyleSdkConnector(request.user.refresh_token)
-            fyle_org_name = fyle_sdk_connector.extract_employee_details().get('org_name')
+            fyle_org_name = get_employee_details(request).get('org_name')
             return {'current_org_name': fyle_org_name, 'connected': True}
         except Exception as excp:
             return {}
@@ -1,6 +1,7 @@
 from django.shortcuts import redirect, render
 from django.views import View
 
+from apps.data_fetcher.utils import fyle_connections
 from apps.fyle_connect.utils import FyleOAuth2
 from apps.user.models import UserProfile
 
@@ -28,6 +29,8 @@ class FyleDisconnectView(View):
     """
     def post(self, request):
         user = UserProfile.objects.get(email=request.user)
+        if user.refresh_token:
+            fyle_connections.invalidate(user.refresh_token)
         user.refresh_token = None
         user.fyle_org_id = None
         user.save()
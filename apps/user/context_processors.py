@@ -1,4 +1,4 @@
-from apps.data_fetcher.utils import FyleSdkConnector
+from apps.user.utils import get_employee_details
 
 def user_data(request):
     """
@@ -8,8 +8,7 @@ def user_data(request):
     """
     if request.user.is_authenticated:
         try:
-            fyle_sdk_connector = FyleSdkConnector(request.user.refresh_token)
-            user_details = fyle_sdk_connector.extract_employee_details()
+            user_details = get_employee_details(request)
             return {'username': user_details.get('full_name'), 'org': user_details.get('org_name')}
         except Exception as e:
             return {}
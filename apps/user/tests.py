@@ -1,3 +1,50 @@
-from django.test import TestCase
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.sessions.backends.signed_cookies import SessionStore
+from django.template import engines
+from django.test import SimpleTestCase, RequestFactory
+
+from fyle_backup_app import settings
+
+
+class EmployeeProfileCacheTest(SimpleTestCase):
+    """
+    Test cases for the per request and per session Fyle profile cache
+    """
+    template = '{{ username }} {{ org }} {{ current_org_name }}'
+
+    def setUp(self):
+        self.session = SessionStore()
+        self.user = mock.Mock(is_authenticated=True, refresh_token='token',
+                              fyle_org_id='orTest')
+        patcher = mock.patch('apps.user.utils.FyleSdkConnector')
+        self.connector = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.extract_employee_details = self.connector.return_value.extract_employee_details
+        self.extract_employee_details.return_value = {'full_name': 'Test User',
+                                                      'org_name': 'Test Org',
+                                                      'org_id': 'orTest'}
+
+    def render(self):
+        request = RequestFactory().get('/main/expenses/')
+        request.user = self.user
+        request.session = self.session
+        return engines['django'].from_string(self.template).render({}, request)
+
+    def test_one_profile_call_per_render(self):
+        with mock.patch.object(settings, 'FYLE_PROFILE_SESSION_TTL', 0):
+            self.assertEqual(self.render(), 'Test User Test Org Test Org')
+            self.assertEqual(self.extract_employee_details.call_count, 1)
+            self.render()
+            self.assertEqual(self.extract_employee_details.call_count, 2)
+
+    def test_profile_reused_from_session(self):
+        self.render()
+        self.assertEqual(self.render(), 'Test User Test Org Test Org')
+        self.assertEqual(self.extract_employee_details.call_count, 1)
+
+    def test_profile_refetched_after_org_switch(self):
+        self.render()
+        self.user.fyle_org_id = 'orOther'
+        self.render()
+        self.assertEqual(self.extract_employee_details.call_count, 2)
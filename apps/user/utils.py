@@ -0,0 +1,34 @@
+import time
+
+from apps.data_fetcher.utils import FyleSdkConnector
+from fyle_backup_app import settings
+
+PROFILE_SESSION_KEY = 'fyle_profile'
+
+
+def get_employee_details(request):
+    """
+    Get the Fyle profile of the logged in user. The profile is fetched at most once
+    per request and reused from the session for settings.FYLE_PROFILE_SESSION_TTL
+    seconds, as long as the user stays connected to the same org.
+    :param request: request object
+    :return: dict in Employee profile schema
+    """
+    if hasattr(request, '_fyle_profile'):
+        return request._fyle_profile
+
+    ttl = settings.FYLE_PROFILE_SESSION_TTL
+    cached = request.session.get(PROFILE_SESSION_KEY) if ttl else None
+    if cached and cached.get('fyle_org_id') == request.user.fyle_org_id \
+            and cached.get('expires_at') > time.time():
+        profile = cached.get('profile')
+    else:
+        fyle_sdk_connector = FyleSdkConnector(request.user.refresh_token,
+                                              request.user.fyle_org_id)
+        profile = fyle_sdk_connector.extract_employee_details()
+        if ttl:
+            request.session[PROFILE_SESSION_KEY] = {'fyle_org_id': request.user.fyle_org_id,
+                                                    'expires_at': time.time() + ttl,
+                                                    'profile': profile}
+    request._fyle_profile = profile
+    return profile
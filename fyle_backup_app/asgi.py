@@ -2,6 +2,7 @@
 ASGI config for fyle_backup_app project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+With BACKUP_ENGINE=async the queued backups run as coroutines in this process.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/3.0/howto/deployment/asgi/
@@ -11,6 +12,12 @@ import os
 
 from django.core.asgi import get_asgi_application
 
+from fyle_backup_app import settings
+
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'fyle_backup_app.settings')
 
 application = get_asgi_application()
+
+if settings.BACKUP_ENGINE == 'async':
+    from apps.data_fetcher.engine import BackupEngineApplication
+    application = BackupEngineApplication(application)
@@ -180,8 +180,60 @@ CLIENT_SECRET = os.environ.get('CLIENT_SECRET')
 AUTHORIZE_URI = os.environ.get('AUTHORIZE_URI').format(FYLE_BASE_URL)
 REDIRECT_URI = os.environ.get('REDIRECT_URI')
 TOKEN_URI = os.environ.get('TOKEN_URI').format(FYLE_BASE_URL)
+# Fyle access tokens live for an hour, SDK connections are reused until just before that
+FYLE_CONNECTION_TTL = int(os.environ.get('FYLE_CONNECTION_TTL', 3300))
+FYLE_CONNECTION_CACHE_SIZE = int(os.environ.get('FYLE_CONNECTION_CACHE_SIZE', 256))
+# Seconds the user's Fyle profile is cached in the session, 0 caches per request only
+FYLE_PROFILE_SESSION_TTL = int(os.environ.get('FYLE_PROFILE_SESSION_TTL', 300))
 
 DOWNLOAD_PATH = os.environ.get('DOWNLOAD_PATH')
+# Number of expenses fetched per page while streaming a backup
+EXPENSES_PAGE_SIZE = int(os.environ.get('EXPENSES_PAGE_SIZE', 300))
+# Expense queries are split by state and updated_at window, shards are fetched concurrently
+EXPENSE_SHARD_WORKERS = int(os.environ.get('EXPENSE_SHARD_WORKERS', 4))
+EXPENSE_SHARD_WINDOW_DAYS = int(os.environ.get('EXPENSE_SHARD_WINDOW_DAYS', 90))
+# Fyle API calls per second across the backups of a process, 0 turns off the limit.
+# Every call, attachment downloads included, also takes a token from here.
+FYLE_API_RATE_LIMIT = float(os.environ.get('FYLE_API_RATE_LIMIT', 25))
+FYLE_API_BURST = int(os.environ.get('FYLE_API_BURST', 25))
+# Per org limits; concurrency halves when Fyle throttles and grows back on success.
+# Attachment downloads (one call per expense) have their own per org rate, so
+# ATTACHMENT_DOWNLOAD_WORKERS are not held to the rate of the expense pages.
+FYLE_ORG_API_RATE_LIMIT = float(os.environ.get('FYLE_ORG_API_RATE_LIMIT', 5))
+FYLE_ORG_ATTACHMENT_RATE_LIMIT = float(os.environ.get('FYLE_ORG_ATTACHMENT_RATE_LIMIT', 20))
+FYLE_ORG_API_CONCURRENCY = int(os.environ.get('FYLE_ORG_API_CONCURRENCY', 8))
+# Retries of throttled (429) and server error (5xx) responses, backoff doubles per retry
+FYLE_API_MAX_RETRIES = int(os.environ.get('FYLE_API_MAX_RETRIES', 4))
+FYLE_API_RETRY_BACKOFF = float(os.environ.get('FYLE_API_RETRY_BACKOFF', 1))
+# Pooled HTTP session for Jobs and OAuth calls: kept alive connections, timeouts in
+# seconds and retries of failed connections
+HTTP_POOL_SIZE = int(os.environ.get('HTTP_POOL_SIZE', 10))
+HTTP_CONNECT_TIMEOUT = float(os.environ.get('HTTP_CONNECT_TIMEOUT', 5))
+HTTP_READ_TIMEOUT = float(os.environ.get('HTTP_READ_TIMEOUT', 30))
+HTTP_MAX_RETRIES = int(os.environ.get('HTTP_MAX_RETRIES', 3))
+HTTP_RETRY_BACKOFF = float(os.environ.get('HTTP_RETRY_BACKOFF', 0.5))
+# Concurrent attachment downloads per backup and retries per expense
+ATTACHMENT_DOWNLOAD_WORKERS = int(os.environ.get('ATTACHMENT_DOWNLOAD_WORKERS', 8))
+ATTACHMENT_DOWNLOAD_RETRIES = int(os.environ.get('ATTACHMENT_DOWNLOAD_RETRIES', 3))
+ATTACHMENT_RETRY_BACKOFF = float(os.environ.get('ATTACHMENT_RETRY_BACKOFF', 1))
+ATTACHMENT_PROGRESS_LOG_INTERVAL = 50
+# Attachments are decoded from base64 and written in blocks of this many bytes
+ATTACHMENT_DECODE_CHUNK_SIZE = 256 * 1024
+# 'directory' dumps to DOWNLOAD_PATH and zips it, 'stream' writes the zip directly,
+# 'multipart' uploads the zip to cloud storage while it is being written
+BACKUP_ARCHIVE_MODE = os.environ.get('BACKUP_ARCHIVE_MODE', 'directory')
+BACKUP_ZIP_COMPRESSION_LEVEL = int(os.environ.get('BACKUP_ZIP_COMPRESSION_LEVEL', 6))
+# Data files larger than this spill from memory to DOWNLOAD_PATH while streaming
+BACKUP_DATA_SPOOL_SIZE = 8 * 1024 * 1024
+BACKUP_COPY_CHUNK_SIZE = 1024 * 1024
+# Parquet and Arrow backups (need pyarrow): rows per row group and parquet codec
+COLUMNAR_ROW_GROUP_SIZE = int(os.environ.get('COLUMNAR_ROW_GROUP_SIZE', 50000))
+PARQUET_COMPRESSION = os.environ.get('PARQUET_COMPRESSION', 'snappy')
+# Compression levels of JSON Lines backups, zstd needs the zstandard package
+JSONL_GZIP_LEVEL = int(os.environ.get('JSONL_GZIP_LEVEL', 6))
+JSONL_ZSTD_LEVEL = int(os.environ.get('JSONL_ZSTD_LEVEL', 3))
+# Keep attachments once per org in cloud storage and reference them from backups
+ATTACHMENT_DEDUP_ENABLED = os.environ.get('ATTACHMENT_DEDUP_ENABLED') == 'True'
 CLOUD_STORAGE_PROVIDER = os.environ.get('CLOUD_STORAGE_PROVIDER')
 
 # AWS details
@@ -190,10 +242,52 @@ AWS_SECRET_ACCESS_KEY = os.environ.get('AWS_SECRET_ACCESS_KEY')
 S3_BUCKET_NAME = os.environ.get('S3_BUCKET_NAME')
 S3_REGION_NAME = os.environ.get('S3_REGION_NAME')
 PRESIGNED_URL_EXPIRY = os.environ.get('PRESIGNED_URL_EXPIRY')
+# Connections kept open by the shared S3 client, and threads per file upload
+S3_MAX_POOL_CONNECTIONS = int(os.environ.get('S3_MAX_POOL_CONNECTIONS', 20))
+S3_TRANSFER_MAX_CONCURRENCY = int(os.environ.get('S3_TRANSFER_MAX_CONCURRENCY', 10))
+# Multipart uploads: S3 needs parts of at least 5MB, except for the last one
+S3_MULTIPART_PART_SIZE = int(os.environ.get('S3_MULTIPART_PART_SIZE', 8 * 1024 * 1024))
+S3_MULTIPART_MAX_PENDING_PARTS = int(os.environ.get('S3_MULTIPART_MAX_PENDING_PARTS', 4))
+S3_MULTIPART_UPLOAD_WORKERS = int(os.environ.get('S3_MULTIPART_UPLOAD_WORKERS', 4))
 
 FYLE_JOBS_URL = os.environ.get('FYLE_JOBS_URL')
 FYLE_JOBS_CALLBACK_URL = os.environ.get('FYLE_JOBS_CALLBACK_URL')
 
+# Backup queue: the Jobs callback only queues backups, run_backup_workers processes them
+BACKUP_QUEUE_ENABLED = os.environ.get('BACKUP_QUEUE_ENABLED', 'True') == 'True'
+BACKUP_WORKER_CONCURRENCY = int(os.environ.get('BACKUP_WORKER_CONCURRENCY', 4))
+BACKUP_WORKER_POLL_INTERVAL = float(os.environ.get('BACKUP_WORKER_POLL_INTERVAL', 5))
+# Running jobs send a heartbeat at most every BACKUP_JOB_HEARTBEAT_INTERVAL seconds
+# while they write pages; jobs without one for BACKUP_JOB_STALE_AFTER seconds are
+# assumed to belong to a dead worker
+BACKUP_JOB_HEARTBEAT_INTERVAL = int(os.environ.get('BACKUP_JOB_HEARTBEAT_INTERVAL', 60))
+BACKUP_JOB_STALE_AFTER = int(os.environ.get('BACKUP_JOB_STALE_AFTER', 6 * 60 * 60))
+# Failed jobs are queued again, resuming from their checkpoint, until they have run
+# BACKUP_JOB_MAX_ATTEMPTS times. Retries wait BACKUP_JOB_RETRY_BACKOFF seconds,
+# doubled for every further attempt.
+BACKUP_JOB_MAX_ATTEMPTS = int(os.environ.get('BACKUP_JOB_MAX_ATTEMPTS', 3))
+BACKUP_JOB_RETRY_BACKOFF = int(os.environ.get('BACKUP_JOB_RETRY_BACKOFF', 60))
+# Running jobs allowed per org and per user; queued jobs over the limit wait
+BACKUP_ORG_MAX_RUNNING = int(os.environ.get('BACKUP_ORG_MAX_RUNNING', 4))
+BACKUP_USER_MAX_RUNNING = int(os.environ.get('BACKUP_USER_MAX_RUNNING', 2))
+# Orgs share the workers by the jobs started in this many seconds, relative to their
+# weight. Weights are given as 'orgId:weight,...', other orgs weigh 1.
+BACKUP_FAIR_SHARE_WINDOW = int(os.environ.get('BACKUP_FAIR_SHARE_WINDOW', 60 * 60))
+BACKUP_ORG_WEIGHTS = {org_id: float(weight) for org_id, weight in (
+    item.split(':') for item in os.environ.get('BACKUP_ORG_WEIGHTS', '').split(',') if item)}
+# New backups share the result of an identical ongoing backup of the user created
+# within this many seconds, if that backup has a Jobs Infra task or a queued job
+BACKUP_COALESCE_MAX_AGE = int(os.environ.get('BACKUP_COALESCE_MAX_AGE', 6 * 60 * 60))
+# Jobs Infra tasks created at once when scheduling backups in a batch
+BACKUP_SCHEDULE_WORKERS = int(os.environ.get('BACKUP_SCHEDULE_WORKERS', 8))
+# 'async' runs the queued backups as coroutines in the ASGI process, see asgi.py:
+# concurrent backups, threads for blocking calls and S3 part uploads, pages fetched ahead
+BACKUP_ENGINE = os.environ.get('BACKUP_ENGINE', 'threads')
+ASYNC_ENGINE_MAX_BACKUPS = int(os.environ.get('ASYNC_ENGINE_MAX_BACKUPS', 32))
+ASYNC_ENGINE_WORKERS = int(os.environ.get('ASYNC_ENGINE_WORKERS', 32))
+ASYNC_ENGINE_UPLOAD_WORKERS = int(os.environ.get('ASYNC_ENGINE_UPLOAD_WORKERS', 16))
+ASYNC_ENGINE_PAGE_QUEUE_SIZE = int(os.environ.get('ASYNC_ENGINE_PAGE_QUEUE_SIZE', 2))
+
 # Email settings
 SENDGRID_API_KEY = os.environ.get('SENDGRID_API_KEY')
 SENDER_EMAIL_ID = os.environ.get('SENDER_EMAIL_ID')
@@ -202,7 +296,9 @@ SENDER_EMAIL_ID = os.environ.get('SENDER_EMAIL_ID')
 TEST_REFRESH_TOKEN = os.environ.get('TEST_REFRESH_TOKEN')
 TEST_FYLE_ORG_ID = os.environ.get('TEST_FYLE_ORG_ID')
 
+# Backups per page of the backup history, and the most a page can ask for
 BACKUPS_LIMIT = 5
+BACKUPS_PAGE_MAX_LIMIT = 100
 
 LOGGING = {
     'version': 1,